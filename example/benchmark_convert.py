@@ -0,0 +1,33 @@
+""" Benchmark of the conversion of IPM weather responses into a xarray.Dataset
+
+Converts one year of hourly data of 4 parameters for an increasing number of
+stations: the time per station should stay constant (linear scaling).
+
+    python example/benchmark_convert.py
+"""
+import time
+
+import numpy as np
+
+from weatherdata.convert import build_dataset
+
+
+def responses(n_stations, n_times=365 * 24, parameters=(1002, 3002, 2001, 4002)):
+    data = np.random.default_rng(0).normal(size=(n_times, len(parameters)))
+    return [{'timeStart': '2020-01-01T00:00:00Z',
+             'timeEnd': '2020-12-30T23:00:00Z',
+             'interval': 3600,
+             'weatherParameters': list(parameters),
+             'locationWeatherData': [{'longitude': 20. + i / 1000., 'latitude': 60., 'altitude': 0.,
+                                      'data': data, 'width': len(parameters), 'length': n_times}]}
+            for i in range(n_stations)]
+
+
+if __name__ == '__main__':
+    print('%10s %12s %18s' % ('stations', 'time (s)', 'ms per station'))
+    for n in (100, 200, 400, 800, 1600, 3200):
+        res = responses(n)
+        t = time.perf_counter()
+        ds = build_dataset(res, stationId=list(range(n)))
+        elapsed = time.perf_counter() - t
+        print('%10d %12.3f %18.3f' % (n, elapsed, 1000 * elapsed / n))
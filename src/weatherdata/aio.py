@@ -0,0 +1,169 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Asynchronous access to the IPM weather services (requires aiohttp)
+
+The functions mirror the IPM calls of agroservices used by weatherdata.ipm
+(get_weatherdatasource, get_parameter and get_weatheradapter) but run on an
+event loop with a shared aiohttp.ClientSession.
+"""
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+# root of the IPM weather services, used for metadata and relative endpoints
+IPM_WX_URL = 'https://platform.ipmdecisions.net/api/wx/rest/'
+
+
+def _url(url, endpoint):
+    """ Absolute url of an endpoint, relative endpoints are appended to url """
+    if endpoint.startswith('http://') or endpoint.startswith('https://'):
+        return endpoint
+    url = url or IPM_WX_URL
+    return url.rstrip('/') + '/' + endpoint.lstrip('/')
+
+
+@asynccontextmanager
+async def open_session(session=None, limit=100):
+    """ Use `session` if given, otherwise open (and close) a new aiohttp.ClientSession
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession, optional
+        an opened session, by default None
+    limit : int, optional
+        maximum number of simultaneous connections of a new session, by default 100
+    """
+    if session is not None:
+        yield session
+    else:
+        import aiohttp
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit)) as session:
+            yield session
+
+
+# shared session of each event loop and number of its users
+_shared = {}
+
+
+@asynccontextmanager
+async def shared_session(session=None, limit=100):
+    """ Use `session` if given, otherwise the session shared by the tasks of the running event loop
+
+    The shared session is opened by its first user and closed when its last
+    user exits, so that it outlives the task which opened it while other tasks
+    use it (eg. a request shared by several callers, see SingleFlight.ado).
+    """
+    if session is not None:
+        yield session
+        return
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    entry = _shared.get(loop)
+    if entry is None:
+        entry = _shared[loop] = [aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit)), 0]
+    entry[1] += 1
+    try:
+        yield entry[0]
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            if _shared.get(loop) is entry:
+                del _shared[loop]
+            await entry[0].close()
+
+
+def _query(params):
+    """ aiohttp only accepts str, int or float as query values """
+    query = {}
+    for key, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ','.join(str(v) for v in value)
+        elif isinstance(value, bool):
+            value = str(value).lower()
+        query[key] = value
+    return query
+
+
+async def get_json(session, url, params=None, data=None):
+    """ GET (or POST if data is given) an url and decode the json response
+
+    Returns
+    -------
+    dict, list or int
+        the decoded response, or the HTTP status code on error
+
+    Raises
+    ------
+    ConnectionError
+        the server can not be reached
+    """
+    import aiohttp
+
+    if data is None:
+        request = session.get(url, params=_query(params or {}))
+    else:
+        request = session.post(url, data=_query(data))
+    try:
+        async with request as response:
+            if response.status != 200:
+                return response.status
+            return await response.json(content_type=None)
+    except aiohttp.ClientConnectionError as e:
+        raise ConnectionError(str(e)) from e
+
+
+async def get_weatheradapter(session, source, params, credentials=None, url=None):
+    """ Weather data of a weather adapter (asynchronous IPM.get_weatheradapter)
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        HTTP session
+    source : dict
+        description of the weatherdatasource
+    params : dict
+        query parameters built by IPM.weatheradapter_params
+    credentials : dict, optional
+        credentials of the resource if needed, by default None
+    url : str, optional
+        root url for relative endpoints, by default IPM_WX_URL
+
+    Returns
+    -------
+    dict or int
+        IPM json response or HTTP error code
+    """
+    endpoint = _url(url, source['endpoint'])
+    if credentials is not None:
+        data = dict(params, credentials=json.dumps(credentials))
+        return await get_json(session, endpoint, data=data)
+    return await get_json(session, endpoint, params=params)
+
+
+async def get_weatherdatasource(session, url=None):
+    """ Description of the weather data sources, indexed by source id """
+    res = await get_json(session, _url(url, 'weatherdatasource'))
+    if type(res) is int:
+        return res
+    sources = {}
+    for item in res:
+        spatial = item.get('spatial') or {}
+        if isinstance(spatial.get('geoJSON'), str):
+            spatial['geoJSON'] = json.loads(spatial['geoJSON'])
+        sources[item['id']] = item
+    return sources
+
+
+async def get_parameter(session, url=None):
+    """ List of the IPM weather parameters """
+    return await get_json(session, _url(url, 'parameter'))
@@ -0,0 +1,248 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Archive of weather datasets growing along time and location
+
+The datasets returned by WeatherDataSource.data are appended to a chunked and
+compressed store:
+
+- zarr (requires zarr): one store, the new time steps and the new locations are
+  appended without rewriting the existing chunks, and the time steps already
+  archived are updated in place,
+- netcdf: one compressed netCDF file per append, indexed by period and locations
+  so that a read only opens the files it needs. The last appended values win.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+import pandas
+import xarray as xr
+
+# default chunk sizes of the archived data variables
+CHUNKS = {'time': 24 * 31, 'location': 32}
+
+FORMATS = ('zarr', 'netcdf')
+
+# encoding of the packed variables
+PACKING = ('dtype', 'scale_factor', 'add_offset', '_FillValue')
+
+
+def _clean_attrs(attrs):
+    """ Attributes storable in zarr and netCDF (no None) """
+    return {key: value for key, value in attrs.items() if value is not None}
+
+
+class WeatherArchive:
+    """ Store of (time, location) weather datasets supporting appends and partial reads
+
+        ..doctest::
+        >>> from weatherdata.archive import WeatherArchive
+        >>> archive = WeatherArchive('fmi.zarr')
+        >>> archive.append(fmi.data(stationId=[101104], timeStart='2020-06-12', timeEnd='2020-07-03'))
+        >>> archive.append(fmi.data(stationId=[101104, 101150], timeStart='2020-07-03', timeEnd='2020-07-10'))
+        >>> ds = archive.read(stationId=[101150], timeStart='2020-07-05')
+    """
+
+    def __init__(self, path, format='zarr', chunks=None, complevel=4):
+        """
+        Parameters
+        ----------
+        path : str
+            directory of the archive
+        format : str, optional
+            'zarr' or 'netcdf', by default 'zarr'
+        chunks : dict, optional
+            chunk sizes along time and location, by default CHUNKS
+        complevel : int, optional
+            compression level of the netcdf files, by default 4
+        """
+        if format not in FORMATS:
+            raise ValueError('format %s not in %s' % (format, FORMATS))
+        self.path = str(path)
+        self.format = format
+        self.chunks = dict(CHUNKS, **(chunks or {}))
+        self.complevel = complevel
+        self._lock = threading.Lock()
+
+    @property
+    def exists(self):
+        if self.format == 'zarr':
+            return os.path.exists(os.path.join(self.path, '.zgroup'))
+        return os.path.exists(self.__index_path__())
+
+    def __prepare__(self, ds):
+        if 'location' not in ds.dims:
+            ds = ds.expand_dims('location')
+        ds = ds.sortby('time')
+        ds.attrs = _clean_attrs(ds.attrs)
+        for name in ds.variables:
+            ds[name].attrs = _clean_attrs(ds[name].attrs)
+        return ds
+
+    def __encoding__(self, ds):
+        encoding = {}
+        for name in ds.data_vars:
+            chunks = tuple(min(self.chunks.get(dim, size), size) or 1 for dim, size in ds[name].sizes.items())
+            # keep the packing of the variable (see weatherdata.convert)
+            encoding[name] = {key: value for key, value in ds[name].encoding.items() if key in PACKING}
+            if self.format == 'zarr':
+                encoding[name]['chunks'] = chunks
+            else:
+                encoding[name].update(zlib=True, complevel=self.complevel, chunksizes=chunks)
+        return encoding
+
+    def append(self, ds):
+        """ Add a dataset to the archive
+
+        The time steps and locations not yet archived are added, the archived
+        values of the time steps and locations of ds are replaced (except by NaN).
+
+        Parameters
+        ----------
+        ds : xarray.Dataset
+            (time, location) weather data, eg. returned by WeatherDataSource.data
+        """
+        ds = self.__prepare__(ds)
+        with self._lock:
+            if self.format == 'zarr':
+                self.__append_zarr__(ds)
+            else:
+                self.__append_netcdf__(ds)
+
+    def __append_zarr__(self, ds):
+        if not self.exists:
+            ds.to_zarr(self.path, mode='w', encoding=self.__encoding__(ds))
+            return
+
+        stored = xr.open_zarr(self.path, chunks=None)
+        times = stored.time.values
+        if ds.time.values[0] < times[0]:
+            raise ValueError('can not insert time steps before %s in the archive' % times[0])
+
+        # parameters missing in the archive or in ds
+        for name in ds.data_vars:
+            if name not in stored.data_vars:
+                empty = xr.Dataset({name: (('time', 'location'),
+                                           np.full((len(times), stored.sizes['location']), np.nan),
+                                           ds[name].attrs)})
+                empty.to_zarr(self.path, mode='a', encoding=self.__encoding__(empty))
+        for name in stored.data_vars:
+            if name not in ds.data_vars:
+                ds[name] = xr.full_like(ds[list(ds.data_vars)[0]], np.nan, dtype=float)
+                ds[name].attrs = stored[name].attrs
+
+        # new locations, over the archived time steps
+        locations = stored.location.values
+        new = ~np.isin(ds.location.values, locations)
+        if new.any():
+            part = ds.isel(location=new).reindex(time=times)
+            part.to_zarr(self.path, append_dim='location')
+            locations = np.concatenate([locations, ds.location.values[new]])
+
+        # archived time steps, updated in place (chunks of the region only)
+        past = ds.time.values <= times[-1]
+        if past.any() and (~new).any():
+            first, last = np.searchsorted(times, ds.time.values[past][[0, -1]])
+            positions = np.flatnonzero(np.isin(locations, ds.location.values[~new]))
+            region = {'time': slice(int(first), int(last) + 1),
+                      'location': slice(int(positions[0]), int(positions[-1]) + 1)}
+            stored = xr.open_zarr(self.path, chunks=None)
+            box = stored.isel(region).load()
+            part = ds.isel(time=past, location=~new).reindex_like(box)
+            part = part.combine_first(box)[list(box.data_vars)]
+            part.drop_vars(['lat', 'lon'], errors='ignore').to_zarr(self.path, region=region)
+
+        # new time steps
+        future = ds.time.values > times[-1]
+        if future.any():
+            part = ds.isel(time=future).reindex(location=locations)
+            part = part.drop_vars(['lat', 'lon'], errors='ignore')
+            part.to_zarr(self.path, append_dim='time')
+
+    def __index_path__(self):
+        return os.path.join(self.path, 'index.json')
+
+    def __index__(self):
+        if not os.path.exists(self.__index_path__()):
+            return []
+        with open(self.__index_path__()) as f:
+            return json.load(f)
+
+    def __append_netcdf__(self, ds):
+        os.makedirs(self.path, exist_ok=True)
+        index = self.__index__()
+        number = max([part['number'] for part in index], default=0) + 1
+        filename = 'part-%06d.nc' % number
+        ds.to_netcdf(os.path.join(self.path, filename), encoding=self.__encoding__(ds))
+        index.append({'number': number,
+                      'filename': filename,
+                      'timeStart': str(ds.time.values[0]),
+                      'timeEnd': str(ds.time.values[-1]),
+                      'location': [v.item() for v in ds.location.values]})
+        tmp = self.__index_path__() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, self.__index_path__())
+
+    def read(self, stationId=None, timeStart=None, timeEnd=None, parameters=None):
+        """ Dataset of a part of the archive
+
+        Parameters
+        ----------
+        stationId : list, optional
+            stations (or locations) to read, by default all
+        timeStart, timeEnd : str, optional
+            first and last dates to read, by default the whole period
+        parameters : list, optional
+            IPM weather parameter ids to read, by default all
+
+        Returns
+        -------
+        xarray.Dataset
+            (time, location) weather data
+        """
+        if not self.exists:
+            raise FileNotFoundError('no weather archive in %s' % self.path)
+        if self.format == 'zarr':
+            # only the chunks of the selection are read
+            ds = xr.open_zarr(self.path, chunks=None)
+            return self.__select__(ds, stationId, timeStart, timeEnd, parameters).load()
+
+        first = None if timeStart is None else pandas.Timestamp(timeStart)
+        last = None if timeEnd is None else pandas.Timestamp(timeEnd)
+        result = None
+        # the last parts override the first ones
+        for part in reversed(self.__index__()):
+            if first is not None and pandas.Timestamp(part['timeEnd']) < first:
+                continue
+            if last is not None and pandas.Timestamp(part['timeStart']) > last:
+                continue
+            if stationId is not None and not set(part['location']) & set(stationId):
+                continue
+            with xr.open_dataset(os.path.join(self.path, part['filename'])) as ds:
+                ds = self.__select__(ds, stationId, timeStart, timeEnd, parameters, missing=True).load()
+            # coordinates of locations are combined like the data
+            ds = ds.reset_coords(['lat', 'lon'])
+            result = ds if result is None else result.combine_first(ds)
+        if result is None:
+            raise KeyError('no data in the archive for this selection')
+        return result.set_coords(['lat', 'lon'])
+
+    def __select__(self, ds, stationId, timeStart, timeEnd, parameters, missing=False):
+        if parameters is not None:
+            ds = ds[[str(p) for p in parameters if str(p) in ds.data_vars or not missing]]
+        if stationId is not None:
+            if missing:
+                stationId = [s for s in stationId if s in ds.location.values]
+            ds = ds.sel(location=list(stationId))
+        if timeStart is not None or timeEnd is not None:
+            ds = ds.sel(time=slice(timeStart, timeEnd))
+        return ds
@@ -0,0 +1,201 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Apache Arrow tables and Parquet datasets of weather data (requires pyarrow)
+
+A weather dataset (time, location) is written as a table with one row per
+time step and location, in time major order: the (time, location) arrays of the
+parameters are the columns of the table without copy. The metadata of the IPM
+parameters are stored in the fields of the schema and the attributes of the
+dataset in the metadata of the schema.
+"""
+
+import json
+
+import numpy as np
+import pandas
+import xarray as xr
+
+# columns of the table which are not weather parameters
+KEYS = ('source', 'location', 'year', 'time', 'lat', 'lon')
+
+# partitioning of the Parquet datasets
+PARTITIONS = ('source', 'location', 'year')
+
+
+def _metadata(attrs):
+    return {b'weatherdata': json.dumps(attrs, default=str).encode()}
+
+
+def _attrs(metadata):
+    if metadata and b'weatherdata' in metadata:
+        return json.loads(metadata[b'weatherdata'])
+    return {}
+
+
+def to_table(ds, source=None):
+    """ Arrow table of a weather dataset
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        (time, location) data variables, with lat and lon coordinates
+    source : str, optional
+        id of the weather data source, by default ds.attrs['weatherRessource']
+
+    Returns
+    -------
+    pyarrow.Table
+        source, location, year, time, lat and lon columns and one column per data variable
+    """
+    import pyarrow as pa
+
+    if 'location' not in ds.dims:
+        ds = ds.expand_dims('location')
+    if source is None:
+        source = ds.attrs.get('weatherRessource', '')
+    times = pandas.DatetimeIndex(ds.time.values)
+    locations = ds.location.values
+    n, m = len(times), len(locations)
+
+    columns = {'source': pa.DictionaryArray.from_arrays(np.zeros(n * m, dtype=np.int32), [str(source)]),
+               'location': pa.array(np.tile(locations, n)),
+               'year': pa.array(np.repeat(times.year.values.astype(np.int32), m)),
+               'time': pa.array(np.repeat(times.values, m), type=pa.timestamp('ns', tz='UTC')),
+               'lat': pa.array(np.tile(np.broadcast_to(ds.lat.values, m), n).astype(float)),
+               'lon': pa.array(np.tile(np.broadcast_to(ds.lon.values, m), n).astype(float))}
+    fields = [pa.field(name, array.type) for name, array in columns.items()]
+    for name in ds.data_vars:
+        values = ds[name].transpose('time', 'location').values
+        # no copy of a C contiguous (time, location) array
+        columns[name] = pa.array(np.ascontiguousarray(values).reshape(-1))
+        fields.append(pa.field(str(name), columns[name].type, metadata=_metadata(ds[name].attrs)))
+
+    schema = pa.schema(fields, metadata=_metadata(ds.attrs))
+    return pa.Table.from_arrays(list(columns.values()), schema=schema)
+
+
+def from_table(table):
+    """ Weather dataset of an Arrow table (see to_table)
+
+    The rows can be in any order and the table can miss some (time, location).
+    The locations are in the order of their first row.
+
+    Returns
+    -------
+    xarray.Dataset
+        (time, location) data variables, with lat and lon coordinates, like WeatherDataSource.data
+    """
+    import pyarrow as pa
+
+    def column(name):
+        array = table.column(name).combine_chunks()
+        if pa.types.is_dictionary(array.type):
+            array = array.dictionary_decode()
+        if pa.types.is_timestamp(array.type):
+            return array.cast(pa.timestamp('ns', tz='UTC')).cast(pa.int64()).to_numpy().astype('datetime64[ns]')
+        return array.to_numpy(zero_copy_only=False)
+
+    names = [name for name in table.column_names if name not in KEYS]
+    time = column('time')
+    location = column('location')
+    if location.dtype.kind in 'iu':
+        location = location.astype(np.int64)
+    times, time_index = np.unique(time, return_inverse=True)
+    locations, first, location_index = np.unique(location, return_index=True, return_inverse=True)
+    # locations in the order of their first row
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    locations, first, location_index = locations[order], first[order], rank[location_index.ravel()]
+    n, m = len(times), len(locations)
+
+    grid = len(time) == n * m and (time_index == np.repeat(np.arange(n), m)).all() and \
+        (location_index == np.tile(np.arange(m), n)).all()
+    data_vars = {}
+    for name in names:
+        values = column(name)
+        if grid:
+            # rows in time major order: no copy
+            values = values.reshape(n, m)
+        else:
+            array = np.full((n, m), np.nan, dtype=values.dtype if values.dtype.kind == 'f' else float)
+            array[time_index, location_index] = values
+            values = array
+        data_vars[name] = (['time', 'location'], values, _attrs(table.schema.field(name).metadata))
+
+    coords = {'time': times,
+              'location': locations,
+              'lat': ('location', column('lat')[first]),
+              'lon': ('location', column('lon')[first])}
+    ds = xr.Dataset(data_vars, coords=coords)
+    ds.attrs.update(_attrs(table.schema.metadata))
+    if 'timeStart' in ds.attrs and n:
+        # the table may hold a part of the dataset
+        ds.attrs['timeStart'] = str(times[0])
+        ds.attrs['timeEnd'] = str(times[-1])
+        ds.attrs['parameters'] = names
+    return ds
+
+
+def to_parquet(ds, path, source=None, partition_cols=PARTITIONS, **kwds):
+    """ Write a weather dataset in a Parquet dataset partitioned by source, location and year
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        (time, location) data variables, with lat and lon coordinates
+    path : str
+        root directory of the Parquet dataset
+    source : str, optional
+        id of the weather data source, by default ds.attrs['weatherRessource']
+    partition_cols : tuple, optional
+        partitioning columns, by default PARTITIONS
+    kwds : dict
+        other arguments of pyarrow.parquet.write_to_dataset
+    """
+    import pyarrow.parquet as pq
+
+    pq.write_to_dataset(to_table(ds, source), path, partition_cols=list(partition_cols), **kwds)
+
+
+def read_parquet(path, source=None, location=None, years=None, parameters=None):
+    """ Weather dataset of a Parquet dataset written by to_parquet
+
+    Parameters
+    ----------
+    path : str
+        root directory of the Parquet dataset
+    source : str, optional
+        id of the weather data source to read, by default all
+    location : list, optional
+        stations (or locations) to read, by default all
+    years : list, optional
+        years to read, by default all
+    parameters : list, optional
+        IPM weather parameter ids to read, by default all
+
+    Returns
+    -------
+    xarray.Dataset
+        (time, location) data variables, with lat and lon coordinates
+    """
+    import pyarrow.parquet as pq
+
+    filters = []
+    if source is not None:
+        filters.append(('source', '=', source))
+    if location is not None:
+        filters.append(('location', 'in', list(location)))
+    if years is not None:
+        filters.append(('year', 'in', [int(year) for year in years]))
+    columns = None
+    if parameters is not None:
+        columns = list(KEYS) + [str(p) for p in parameters]
+    table = pq.read_table(path, columns=columns, filters=filters or None)
+    return from_table(table)
@@ -0,0 +1,621 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Cache of the weather adapter responses
+
+Responses are stored under pathCache()/'responses' with a canonical key built
+from the weather source, its endpoint and the query (location, parameters,
+interval and time window). Forecasts and historic data have different time to
+live, and the least recently used responses are evicted when the cache is
+larger than settings.CACHE_MAX_BYTES.
+
+Historic responses are also indexed by series (source, location and interval),
+weather parameters and time window, so that a query can be answered from the
+cached segments of its series containing its parameters, only the uncovered
+parameters and time windows being requested.
+
+Responses are written in one of the formats of FORMATS (settings.CACHE_FORMAT):
+  - 'json': the IPM json response
+  - 'npy': the data block as a float64 numpy array, memory-mapped when read,
+    with the rest of the response in a json sidecar
+  - 'npz': the data block as a compressed numpy array with a json sidecar
+With 'npy' and 'npz', cached responses are returned with a numpy array as data.
+
+The index of the cached responses is written at most every
+settings.CACHE_INDEX_DELAY seconds, at exit and by ResponseCache.flush.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas
+
+from weatherdata import settings
+from weatherdata.settings import pathCache
+
+
+def canonical_request(source, params):
+    """ Canonical description of a weather adapter query
+
+    Parameters
+    ----------
+    source : dict
+        description of the weatherdatasource
+    params : dict
+        query parameters built by IPM.weatheradapter_params
+
+    Returns
+    -------
+    dict
+        source id, endpoint and query parameters with normalized values
+    """
+    query = {}
+    for key, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, str) and (',' in value or key == 'parameters'):
+            value = value.split(',')
+        if isinstance(value, (list, tuple)):
+            value = [str(v).strip() for v in value]
+        else:
+            value = str(value)
+        query[key] = value
+    return {'source': source.get('id') or source.get('name'),
+            'endpoint': source.get('endpoint'),
+            'query': query}
+
+
+def jsonable(response):
+    """ IPM json response with the data blocks of its locations as nested lists (NaN as null) """
+    locations = response['locationWeatherData']
+    if not any(isinstance(location['data'], np.ndarray) for location in locations):
+        return response
+    converted = []
+    for location in locations:
+        data = location['data']
+        if isinstance(data, np.ndarray):
+            data = np.asarray(data, dtype=float)
+            location = dict(location, data=np.where(np.isnan(data), None, data).tolist())
+        converted.append(location)
+    return dict(response, locationWeatherData=converted)
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return np.where(np.isnan(obj), None, obj).tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+def _write(path, write):
+    tmp = path + '.%s.tmp' % threading.get_ident()
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _write_json(path, response):
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(response, f, default=_json_default)
+    _write(path + '.json', write)
+    return [path + '.json']
+
+
+def _read_json(path):
+    with open(path + '.json') as f:
+        return json.load(f)
+
+
+def _write_columnar(path, response, compressed):
+    location = response['locationWeatherData'][0]
+    data = np.asarray(location['data'], dtype=float)
+    if data.ndim != 2:
+        data = data.reshape(len(data), len(response['weatherParameters']))
+    sidecar = dict(response, locationWeatherData=[dict(location, data=None)])
+    if compressed:
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                np.savez_compressed(f, data=data)
+        filename = path + '.npz'
+    else:
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                np.save(f, data)
+        filename = path + '.npy'
+    _write(filename, write)
+    return [filename] + _write_json(path, sidecar)
+
+
+def _read_columnar(path, compressed):
+    response = _read_json(path)
+    if compressed:
+        with np.load(path + '.npz') as f:
+            data = f['data']
+    else:
+        data = np.load(path + '.npy', mmap_mode='r')
+    response['locationWeatherData'][0]['data'] = data
+    return response
+
+
+FORMATS = {'json': (_write_json, _read_json),
+           'npy': (lambda path, response: _write_columnar(path, response, False),
+                   lambda path: _read_columnar(path, False)),
+           'npz': (lambda path, response: _write_columnar(path, response, True),
+                   lambda path: _read_columnar(path, True))}
+
+
+def _hash(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+
+def request_key(source, params):
+    """ Key of a weather adapter query, identical for identical queries """
+    return _hash(canonical_request(source, params))
+
+
+def series_key(request):
+    """ Key of the series of a canonical request: the request without its time window and parameters """
+    query = {k: v for k, v in request['query'].items() if k not in ('timeStart', 'timeEnd', 'parameters')}
+    return _hash({'source': request['source'], 'endpoint': request['endpoint'], 'query': query})
+
+
+def _contains(parameters, others):
+    """ True if the parameters of a request are all in others (None stands for all the parameters) """
+    if parameters is None or others is None:
+        return parameters is None and others is None
+    return set(parameters) <= set(others)
+
+
+def to_seconds(time):
+    """ POSIX time in seconds of an IPM time string (UTC if no offset is given) """
+    return int(pandas.Timestamp(time).value // 10 ** 9)
+
+
+def to_ipm_time(seconds):
+    """ IPM time string (UTC) of a POSIX time in seconds """
+    return pandas.Timestamp(seconds, unit='s').strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def request_window(request):
+    """ First time, last time and interval (in seconds) of a canonical request """
+    query = request['query']
+    return to_seconds(query['timeStart']), to_seconds(query['timeEnd']), int(query['interval'])
+
+
+def missing_windows(start, end, interval, windows):
+    """ Time windows of [start, end] not covered by windows
+
+    Parameters
+    ----------
+    start, end : int
+        first and last time (in seconds) of the requested window
+    interval : int
+        time step in seconds
+    windows : list
+        list of covered (start, end) windows
+
+    Returns
+    -------
+    list
+        list of the (start, end) uncovered windows, aligned on the time steps of the request
+    """
+    n = (end - start) // interval + 1
+    covered = np.zeros(n, dtype=bool)
+    for first, last in windows:
+        i = max(0, -(-(first - start) // interval))
+        j = min(n, (last - start) // interval + 1)
+        if i < j:
+            covered[i:j] = True
+    # boundaries of the runs of uncovered time steps
+    edges = np.diff(np.concatenate(([0], (~covered).astype(np.int8), [0])))
+    firsts = np.flatnonzero(edges == 1)
+    lasts = np.flatnonzero(edges == -1) - 1
+    return [(int(start + i * interval), int(start + j * interval)) for i, j in zip(firsts, lasts)]
+
+
+def stitch(responses, start, end, interval, parameters=None):
+    """ Assemble responses of a location into one response covering [start, end]
+
+    Responses are aligned with integer offsets on the time steps of the window,
+    the last responses overriding the first ones, and missing values are NaN.
+
+    Parameters
+    ----------
+    responses : list
+        IPM json responses of the same location and interval
+    start, end : int
+        first and last time (in seconds) of the window
+    interval : int
+        time step in seconds
+    parameters : list, optional
+        weather parameters of the result, by default those of the first response
+
+    Returns
+    -------
+    dict
+        IPM json response, with data as a numpy array
+    """
+    if not parameters:
+        parameters = responses[0]['weatherParameters']
+    parameters = [int(p) for p in parameters]
+    n = (end - start) // interval + 1
+    values = np.full((n, len(parameters)), np.nan)
+    for response in responses:
+        data = np.asarray(response['locationWeatherData'][0]['data'], dtype=float)
+        if data.size == 0:
+            continue
+        offset, remainder = divmod(to_seconds(response['timeStart']) - start, interval)
+        if remainder or int(response['interval']) != interval:
+            logging.warning('response not aligned on the time steps of the request')
+            continue
+        columns = {int(p): i for i, p in enumerate(response['weatherParameters'])}
+        target = [i for i, p in enumerate(parameters) if p in columns]
+        source = [columns[parameters[i]] for i in target]
+        first, last = max(offset, 0), min(offset + len(data), n)
+        if first < last and target:
+            values[first:last, target] = data[first - offset:last - offset][:, source]
+
+    location = dict(responses[0]['locationWeatherData'][0])
+    location.update({'data': values,
+                     'width': len(parameters),
+                     'length': n})
+    return {'timeStart': to_ipm_time(start),
+            'timeEnd': to_ipm_time(end),
+            'interval': interval,
+            'weatherParameters': parameters,
+            'locationWeatherData': [location]}
+
+
+def covered_window(response, start, end, interval):
+    """ Window of [start, end] covered by a response: up to its timeEnd and its last row with a value
+
+    The trailing missing rows (eg. the future of a period which is not over)
+    are not covered, so that they are requested again.
+
+    Returns
+    -------
+    tuple
+        (start, end) covered window, None if the response has no value
+    """
+    first = to_seconds(response['timeStart']) if response.get('timeStart') else start
+    if response.get('timeEnd'):
+        end = min(end, to_seconds(response['timeEnd']))
+    data = np.asarray(response['locationWeatherData'][0]['data'], dtype=float)
+    rows = np.flatnonzero(~np.isnan(data.reshape(len(data), -1)).all(axis=1)) if data.size else []
+    if not len(rows):
+        return None
+    end = min(end, first + int(rows[-1]) * interval)
+    if end < start:
+        return None
+    return start, end
+
+
+# caches whose index is written at exit
+_caches = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_caches():
+    for cache in list(_caches):
+        cache.flush()
+
+
+class ResponseCache:
+    """ Thread-safe cache of weather adapter responses with TTL and LRU eviction
+
+        ..doctest::
+        >>> from weatherdata.cache import response_cache
+        >>> response_cache.stats
+    """
+
+    def __init__(self, path=None, max_bytes=None, forecast_ttl=None, historic_ttl=None, format=None):
+        """
+        Parameters
+        ----------
+        path : pathlib.Path, optional
+            directory of the cache, by default pathCache()/'responses'
+        max_bytes : int, optional
+            size budget of the cache, by default settings.CACHE_MAX_BYTES
+        forecast_ttl : float, optional
+            time to live in seconds of forecasts, by default settings.CACHE_FORECAST_TTL
+        historic_ttl : float, optional
+            time to live in seconds of historic data, by default settings.CACHE_HISTORIC_TTL
+        format : str, optional
+            format of the new cached responses (see FORMATS), by default settings.CACHE_FORMAT
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.forecast_ttl = forecast_ttl
+        self.historic_ttl = historic_ttl
+        self.format = format
+        self._index = None
+        # keys of the cached segments by series
+        self._series = None
+        # index not written yet, time of the last write
+        self._dirty = False
+        self._saved = 0.
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _caches.add(self)
+
+    @property
+    def directory(self):
+        path = self.path
+        if path is None:
+            path = pathCache() / 'responses'
+        settings.create_dir(path)
+        return path
+
+    @property
+    def index(self):
+        """ Description of the cached responses, indexed by key """
+        with self._lock:
+            if self._index is None:
+                self._index = {}
+                path = os.path.join(self.directory, 'index.json')
+                if os.path.exists(path):
+                    try:
+                        with open(path) as f:
+                            self._index = json.load(f)
+                    except ValueError as e:
+                        logging.warning('corrupted cache index %s: %s' % (path, e))
+            return self._index
+
+    def __segments__(self, series):
+        """ Keys of the cached segments of series """
+        with self._lock:
+            if self._series is None:
+                self._series = {}
+                for key, entry in self.index.items():
+                    if 'series' in entry:
+                        self._series.setdefault(entry['series'], set()).add(key)
+            return self._series.setdefault(series, set())
+
+    def __save_index__(self, force=False):
+        """ Write the index if it changed, at most every settings.CACHE_INDEX_DELAY seconds unless force """
+        with self._lock:
+            if not self._dirty and not force:
+                return
+            if not force and time.time() - self._saved < settings.CACHE_INDEX_DELAY:
+                return
+            path = os.path.join(self.directory, 'index.json')
+            tmp = path + '.%s.tmp' % threading.get_ident()
+            with open(tmp, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp, path)
+            self._dirty = False
+            self._saved = time.time()
+
+    def flush(self):
+        """ Write the pending changes of the index """
+        with self._lock:
+            if self._dirty:
+                self.__save_index__(force=True)
+
+    def __ttl__(self, forecast):
+        if forecast:
+            return settings.CACHE_FORECAST_TTL if self.forecast_ttl is None else self.forecast_ttl
+        else:
+            return settings.CACHE_HISTORIC_TTL if self.historic_ttl is None else self.historic_ttl
+
+    def __expired__(self, entry):
+        ttl = self.__ttl__(entry['forecast'])
+        return ttl is not None and time.time() - entry['created'] > ttl
+
+    def get(self, key):
+        """ Cached response of key, None if the response is missing or expired """
+        with self._lock:
+            entry = self.index.get(key)
+            if entry is not None and self.__expired__(entry):
+                self.__remove__(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry['accessed'] = time.time()
+            self.hits += 1
+        return self.__load__(key, entry)
+
+    def __load__(self, key, entry):
+        path = os.path.join(self.directory, key)
+        try:
+            return FORMATS[entry.get('format', 'json')][1](path)
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning('unable to read cached response %s: %s' % (path, e))
+            with self._lock:
+                # unless the response has been replaced since
+                self.__remove__(key, entry)
+            return None
+
+    def lookup(self, request):
+        """ Cached segments of the series of a historic request and uncovered parameters and windows
+
+        Parameters
+        ----------
+        request : dict
+            canonical description of the query (see canonical_request)
+
+        Returns
+        -------
+        tuple
+            list of the cached responses overlapping the request, from the oldest
+            to the newest, and list of the (parameters, start, end) to request,
+            parameters being None if the request has no parameters
+        """
+        series = series_key(request)
+        parameters = request['query'].get('parameters')
+        start, end, interval = request_window(request)
+        with self._lock:
+            segments = []
+            for key in list(self.__segments__(series)):
+                entry = self.index[key]
+                if self.__expired__(entry):
+                    self.__remove__(key)
+                    continue
+                others = entry.get('parameters')
+                if parameters is None or others is None:
+                    if not _contains(parameters, others):
+                        continue
+                elif not set(parameters) & set(others):
+                    continue
+                first, last = entry['window']
+                if first <= end and last >= start:
+                    segments.append((entry['created'], key, entry))
+            segments.sort(key=lambda segment: segment[0])
+
+        responses, windows = [], []
+        for created, key, entry in segments:
+            data = self.__load__(key, entry)
+            if data is not None:
+                entry['accessed'] = time.time()
+                responses.append(data)
+                windows.append((entry['window'], entry.get('parameters')))
+
+        # parameters missing on the same windows are requested together
+        groups = {}
+        for parameter in (parameters or [None]):
+            covered = [window for window, others in windows
+                       if parameter is None or parameter in others]
+            gaps = tuple(missing_windows(start, end, interval, covered))
+            groups.setdefault(gaps, []).append(parameter)
+        missing = [(None if parameters is None else group, first, last)
+                   for gaps, group in groups.items() for first, last in gaps]
+
+        with self._lock:
+            if not missing:
+                self.hits += 1
+            elif responses:
+                self.partial_hits += 1
+            else:
+                self.misses += 1
+        return responses, missing
+
+    def put(self, key, data, request=None, forecast=False):
+        """ Store the response data of key
+
+        Parameters
+        ----------
+        key : str
+            key of the query (see request_key)
+        data : dict
+            IPM json response
+        request : dict, optional
+            canonical description of the query (see canonical_request), by default None
+        forecast : bool, optional
+            True if data is a forecast, by default False
+        """
+        format = settings.CACHE_FORMAT if self.format is None else self.format
+        with self._lock:
+            # the files of a previous response of key are replaced
+            self.__remove__(key)
+        files = FORMATS[format][0](os.path.join(self.directory, key), data)
+        now = time.time()
+        entry = {'format': format,
+                 'files': [os.path.basename(f) for f in files],
+                 'size': sum(os.path.getsize(f) for f in files),
+                 'created': now,
+                 'accessed': now,
+                 'forecast': bool(forecast),
+                 'request': request}
+        if request is not None and not forecast:
+            start, end, interval = request_window(request)
+            window = covered_window(data, start, end, interval)
+            if window is not None:
+                entry.update({'series': series_key(request),
+                              'parameters': request['query'].get('parameters'),
+                              'window': list(window)})
+        with self._lock:
+            if 'series' in entry:
+                # the new segment supersedes the segments of its window and parameters
+                segments = self.__segments__(entry['series'])
+                for other in [k for k in segments
+                              if k != key and _contains(self.index[k].get('parameters'), entry['parameters'])
+                              and entry['window'][0] <= self.index[k]['window'][0]
+                              and self.index[k]['window'][1] <= entry['window'][1]]:
+                    self.__remove__(other)
+                segments.add(key)
+            self.index[key] = entry
+            self._dirty = True
+            self.evict()
+            self.__save_index__()
+
+    def __remove__(self, key, entry=None):
+        """ Remove the response of key, only if its entry is still entry if given """
+        if entry is not None and self.index.get(key) is not entry:
+            return
+        entry = self.index.pop(key, None)
+        if entry is not None:
+            self._dirty = True
+            if 'series' in entry and self._series is not None:
+                self._series.get(entry['series'], set()).discard(key)
+            for filename in entry.get('files', [entry.get('file')]):
+                if filename is None:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    def evict(self):
+        """ Remove expired responses, then the least recently used until the cache fits its size budget """
+        with self._lock:
+            for key in [key for key, entry in self.index.items() if self.__expired__(entry)]:
+                self.__remove__(key)
+                self.evictions += 1
+            max_bytes = settings.CACHE_MAX_BYTES if self.max_bytes is None else self.max_bytes
+            size = self.size
+            if max_bytes is None or size <= max_bytes:
+                return
+            for key in sorted(self.index, key=lambda k: self.index[k]['accessed']):
+                size -= self.index[key]['size']
+                self.__remove__(key)
+                self.evictions += 1
+                if size <= max_bytes:
+                    break
+
+    @property
+    def size(self):
+        """ Size of the cached responses in bytes """
+        with self._lock:
+            return sum(entry['size'] for entry in self.index.values())
+
+    @property
+    def stats(self):
+        """ Hit and miss statistics of the cache """
+        with self._lock:
+            requests = self.hits + self.partial_hits + self.misses
+            return {'hits': self.hits,
+                    'partial_hits': self.partial_hits,
+                    'misses': self.misses,
+                    'hit_ratio': self.hits / requests if requests else 0.,
+                    'evictions': self.evictions,
+                    'entries': len(self.index),
+                    'bytes': self.size}
+
+    def clear(self):
+        """ Remove all the cached responses """
+        with self._lock:
+            for key in list(self.index):
+                self.__remove__(key)
+            self._series = None
+            self.__save_index__(force=True)
+            self.hits = self.partial_hits = self.misses = self.evictions = 0
+
+
+response_cache = ResponseCache()
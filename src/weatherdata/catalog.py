@@ -0,0 +1,230 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Persistent catalog of the local weather data sources
+
+Each local source is stored under pathCache()/'catalog' as memory-mapped npy
+files (values and times) and described in a small json index (location,
+interval, parameters, period): listing the sources does not read their data,
+and a time slice is found by a binary search in the times.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas
+
+from weatherdata import settings
+from weatherdata.cache import _write
+from weatherdata.settings import pathCache
+
+
+def _save(path, array):
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+    _write(path, write)
+
+
+class LocalCatalog:
+    """ Catalog of local weather data sources (DataFrames of weather parameters indexed by time)
+
+        ..doctest::
+        >>> from weatherdata.catalog import local_catalog
+        >>> local_catalog.add('Mydata', df, longitude=3.87, latitude=43.61)
+        >>> local_catalog.names
+        >>> local_catalog.read('Mydata', timeStart='2012-10-01', timeEnd='2012-10-31')
+    """
+
+    def __init__(self, path=None):
+        """
+        Parameters
+        ----------
+        path : pathlib.Path, optional
+            directory of the catalog, by default pathCache()/'catalog'
+        """
+        self.path = path
+        self._index = None
+        self._lock = threading.RLock()
+
+    @property
+    def directory(self):
+        path = self.path
+        if path is None:
+            path = pathCache() / 'catalog'
+        settings.create_dir(path)
+        return path
+
+    @property
+    def index(self):
+        """ Description of the sources, by name """
+        with self._lock:
+            if self._index is None:
+                filename = os.path.join(self.directory, 'index.json')
+                if os.path.exists(filename):
+                    with open(filename) as f:
+                        self._index = json.load(f)
+                else:
+                    self._index = {}
+            return self._index
+
+    def __save_index__(self):
+        def write(tmp):
+            with open(tmp, 'w') as f:
+                json.dump(self._index, f)
+        _write(os.path.join(self.directory, 'index.json'), write)
+
+    @property
+    def names(self):
+        return list(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def metadata(self, name):
+        """ Description of the local source name """
+        if name not in self.index:
+            raise KeyError('no local source %s in the catalog' % name)
+        return self.index[name]
+
+    def add(self, name, data, longitude=3.87, latitude=43.61, altitude=0, timezone="Europe/Paris", interval=3600):
+        """ Store (or replace) a local source
+
+        Parameters
+        ----------
+        name : str
+            name of the source
+        data : pandas.DataFrame
+            weather parameters (columns) indexed by time
+        longitude, latitude, altitude : float, optional
+            location of the data
+        timezone : str, optional
+            time zone of the index, by default "Europe/Paris"
+        interval : int, optional
+            time step in seconds, by default 3600
+
+        Returns
+        -------
+        dict
+            description of the source
+        """
+        index = pandas.DatetimeIndex(data.index)
+        if index.tz is not None:
+            # local times, like the naive indexes
+            index = index.tz_localize(None)
+        order = None if index.is_monotonic_increasing else np.argsort(index.values, kind='stable')
+        values = data.to_numpy(dtype=float)
+        times = index.values.astype('datetime64[ns]')
+        if order is not None:
+            values, times = values[order], times[order]
+
+        with self._lock:
+            directory = os.path.join(self.directory, hashlib.sha1(str(name).encode()).hexdigest())
+            os.makedirs(directory, exist_ok=True)
+            _save(os.path.join(directory, 'values.npy'), values)
+            _save(os.path.join(directory, 'time.npy'), times)
+            entry = {'name': name,
+                     'directory': os.path.basename(directory),
+                     'longitude': longitude,
+                     'latitude': latitude,
+                     'altitude': altitude,
+                     'timezone': timezone,
+                     'interval': interval,
+                     'parameters': [p.item() if hasattr(p, 'item') else p for p in data.columns],
+                     'start': str(times[0]) if len(times) else None,
+                     'end': str(times[-1]) if len(times) else None,
+                     'length': len(times)}
+            self.index[name] = entry
+            self.__save_index__()
+        return entry
+
+    def read(self, name, timeStart=None, timeEnd=None, parameters=None):
+        """ Data of a local source, between timeStart and timeEnd (included)
+
+        Parameters
+        ----------
+        name : str
+            name of the source
+        timeStart, timeEnd : str, optional
+            first and last dates (in the time zone of the source), by default the whole period
+        parameters : list, optional
+            columns to read, by default all
+
+        Raises
+        ------
+        KeyError
+            unknown source or parameter
+
+        Returns
+        -------
+        pandas.DataFrame
+            memory-mapped (read-only) slice of the data, with the description of
+            the source in attrs (longitude, latitude, altitude, timezone and interval)
+        """
+        entry = self.metadata(name)
+        directory = os.path.join(self.directory, entry['directory'])
+        times = np.load(os.path.join(directory, 'time.npy'), mmap_mode='r')
+        first, last = 0, len(times)
+        if timeStart is not None:
+            first = np.searchsorted(times, np.datetime64(pandas.Timestamp(timeStart).tz_localize(None)), 'left')
+        if timeEnd is not None:
+            last = np.searchsorted(times, np.datetime64(pandas.Timestamp(timeEnd).tz_localize(None)), 'right')
+
+        columns = entry['parameters']
+        values = np.load(os.path.join(directory, 'values.npy'), mmap_mode='r')[first:last]
+        if parameters is not None:
+            position = {str(p): i for i, p in enumerate(columns)}
+            missing = [p for p in parameters if str(p) not in position]
+            if missing:
+                raise KeyError('parameters %s not in the local source %s' % (missing, name))
+            selected = [position[str(p)] for p in parameters]
+            columns = [columns[i] for i in selected]
+            values = values[:, selected]
+        data = pandas.DataFrame(values, index=pandas.DatetimeIndex(times[first:last]), columns=columns)
+        data.attrs = {key: entry[key] for key in ('longitude', 'latitude', 'altitude', 'timezone', 'interval')}
+        return data
+
+    def resource(self, name):
+        """ Description of a local source in the format of the IPM weather data sources """
+        entry = self.metadata(name)
+        return {"id": name,
+                "name": name,
+                "description": "personal data",
+                "public_URL": None,
+                "endpoint": None,
+                "authentication_type": None,
+                "needs_data_control": False,
+                "access_type": 'location',
+                "priority": 0,
+                "temporal": {"forecast": None,
+                             "historic": {"start": entry['start'] and entry['start'][:10],
+                                          "end": entry['end'] and entry['end'][:10],
+                                          "interval": [entry['interval']]}},
+                "parameters": {'common': list(entry['parameters']), 'optional': None},
+                "spatial": None,
+                "organization": None}
+
+    def remove(self, name):
+        """ Remove a local source from the catalog """
+        with self._lock:
+            entry = self.index.pop(name, None)
+            if entry is not None:
+                shutil.rmtree(os.path.join(self.directory, entry['directory']), ignore_errors=True)
+                self.__save_index__()
+
+    def clear(self):
+        """ Remove all the local sources """
+        for name in self.names:
+            self.remove(name)
+
+
+local_catalog = LocalCatalog()
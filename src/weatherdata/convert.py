@@ -0,0 +1,295 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Conversion of IPM weather responses into a xarray.Dataset
+
+The data of all the responses are written in one preallocated (time, location)
+array per weather parameter and the Dataset is built once, so that the
+conversion time grows linearly with the number of locations.
+
+Responses may cover different periods (eg. a station starting later): the time
+axis is the union of their periods, and the data of each response is written at
+its integer offset in this axis.
+
+A lazy (dask-backed) dataset can also be assembled from blocks of data loaded
+on demand, eg. one block per station and time window.
+
+The data variables can be stored in float32, or packed in int16 with the CF
+scale_factor/add_offset of their IPM parameter: the packed variables are decoded
+lazily by xarray, on access.
+"""
+
+import logging
+
+import numpy as np
+import pandas
+import xarray as xr
+
+from weatherdata import settings
+
+DTYPES = ('float64', 'float32', 'int16')
+
+# CF packing in int16 (scale_factor, add_offset) of the IPM weather parameters,
+# by parameter id, then by family of parameters (id // 1000)
+INT16_PACKING = {4001: (0.1, 0.),  # wind direction (degrees)
+                 4011: (0.1, 0.)}
+INT16_FAMILY_PACKING = {1: (0.01, 0.),  # temperature (Celcius)
+                        2: (0.01, 0.),  # precipitation (mm)
+                        3: (0.01, 0.),  # relative humidity (%), leaf wetness (minutes/hour)
+                        4: (0.01, 0.),  # wind speed (m/s)
+                        5: (0.1, 0.)}  # radiation (W/sqm)
+
+# int16 value of the missing data
+INT16_FILL = np.iinfo(np.int16).min
+
+
+def _ns(time):
+    """ time in nanoseconds (UTC if an offset is given) """
+    return pandas.Timestamp(time).value
+
+
+def time_axis(responses, times=None):
+    """ Common time axis of responses and offset of each response in it
+
+    Parameters
+    ----------
+    responses : list
+        IPM json responses with the same interval
+    times : array-like, optional
+        requested time axis, by default the union of the periods of the responses
+
+    Returns
+    -------
+    tuple
+        numpy.datetime64 time axis and integer offset of the first time step of each response
+    """
+    if not len(responses):
+        raise ValueError('no response to convert')
+    intervals = {int(response['interval']) for response in responses}
+    if len(intervals) > 1:
+        raise ValueError('responses with different intervals: %s' % sorted(intervals))
+    step = intervals.pop() * 10 ** 9
+    starts = np.array([_ns(response['timeStart']) for response in responses], dtype=np.int64)
+
+    if times is None:
+        first = starts.min()
+        last = max(_ns(response['timeEnd']) for response in responses)
+        axis = first + np.arange((last - first) // step + 1, dtype=np.int64) * step
+    else:
+        axis = np.asarray(pandas.DatetimeIndex(times).tz_localize(None).values, dtype='datetime64[ns]').view(np.int64)
+        first = axis[0]
+
+    offsets, remainders = np.divmod(starts - first, step)
+    if remainders.any():
+        raise ValueError('responses not aligned on the time steps of %s' % str(axis[0].astype('datetime64[ns]')))
+    return axis.astype('datetime64[ns]'), offsets
+
+
+def int16_packing(parameter):
+    """ (scale_factor, add_offset) of IPM parameter id in int16, None if the parameter can not be packed """
+    parameter = int(parameter)
+    return INT16_PACKING.get(parameter, INT16_FAMILY_PACKING.get(parameter // 1000))
+
+
+def packable(values, scale_factor, add_offset=0.):
+    """ True if the packed float values (NaN ignored) are in the range of int16 """
+    with np.errstate(invalid='ignore'):
+        packed = np.round((np.asarray(values) - add_offset) / scale_factor)
+        return not ((packed < INT16_FILL + 1) | (packed > np.iinfo(np.int16).max)).any()
+
+
+def pack(values, scale_factor, add_offset=0.):
+    """ Pack float values in int16, NaN as INT16_FILL
+
+    The values out of the range of int16 are clipped, with a warning.
+    """
+    packed = np.round((values - add_offset) / scale_factor)
+    with np.errstate(invalid='ignore'):
+        overflow = (packed < INT16_FILL + 1) | (packed > np.iinfo(np.int16).max)
+    if overflow.any():
+        logging.warning('%d values out of the int16 range (scale_factor %s, add_offset %s) are clipped'
+                        % (np.count_nonzero(overflow), scale_factor, add_offset))
+        np.clip(packed, INT16_FILL + 1, np.iinfo(np.int16).max, out=packed)
+    packed[np.isnan(packed)] = INT16_FILL
+    return packed.astype(np.int16)
+
+
+def check_dtype(dtype=None):
+    """ dtype of the data variables, by default settings.DTYPE """
+    if dtype is None:
+        dtype = settings.DTYPE
+    try:
+        name = np.dtype(dtype).name
+    except TypeError:
+        name = None
+    if name not in DTYPES:
+        raise ValueError('dtype %s not in %s' % (dtype, DTYPES))
+    return name
+
+
+def response_parameters(responses):
+    """ Weather parameters of the responses, in the order of appearance """
+    parameters = {}
+    for response in responses:
+        for parameter in response['weatherParameters']:
+            parameters.setdefault(int(parameter), None)
+    return list(parameters)
+
+
+def build_dataset(responses, stationId=None, times=None, dtype=None):
+    """ Dataset of the data of a list of IPM json responses (one location per response)
+
+    Parameters
+    ----------
+    responses : list
+        IPM json responses with the same interval
+    stationId : list, optional
+        weather station id of each response, by default None: the locations
+        are named by their coordinates '[latitude, longitude]'
+    times : array-like, optional
+        time axis of the dataset, by default the union of the periods of the responses
+    dtype : str, optional
+        'float64', 'float32' or 'int16' (CF packing, decoded lazily in float32),
+        by default settings.DTYPE. The parameters with values out of the int16
+        range are stored in float32
+
+    Returns
+    -------
+    xarray.Dataset
+        one (time, location) data variable per weather parameter, named by
+        parameter id, and time, location, lat and lon coordinates
+    """
+    dtype = check_dtype(dtype)
+    ftype = np.float64 if dtype == 'float64' else np.float32
+    times, offsets = time_axis(responses, times)
+    locations = [response['locationWeatherData'][0] for response in responses]
+    # no copy for the numpy arrays of the binary cache formats
+    datas = [np.asarray(location['data'], dtype="float").reshape(-1, len(response['weatherParameters']))
+             for location, response in zip(locations, responses)]
+    parameters = response_parameters(responses)
+
+    first = [int(p) for p in responses[0]['weatherParameters']]
+    if not offsets.any() and all(len(data) == len(times) for data in datas) and \
+            all([int(p) for p in response['weatherParameters']] == first for response in responses):
+        # same layout for all the responses: one copy in a (time, parameter, location) block
+        block = np.stack(datas, axis=2, dtype=ftype)
+        values = {parameter: block[:, i, :] for i, parameter in enumerate(first)}
+    else:
+        values = {parameter: np.full((len(times), len(responses)), np.nan, dtype=ftype) for parameter in parameters}
+        for j, (response, data, offset) in enumerate(zip(responses, datas, offsets)):
+            # rows of data inside the time axis
+            a, b = max(0, -offset), min(len(data), len(times) - offset)
+            if a >= b:
+                continue
+            for i, parameter in enumerate(response['weatherParameters']):
+                values[int(parameter)][offset + a:offset + b, j] = data[a:b, i]
+
+    if stationId:
+        location = list(stationId)
+    else:
+        location = [str([loc['latitude'], loc['longitude']]) for loc in locations]
+
+    coords = {'time': times,
+              'location': location,
+              'lat': ('location', np.array([float(loc['latitude']) for loc in locations])),
+              'lon': ('location', np.array([float(loc['longitude']) for loc in locations]))}
+    data_vars = {}
+    for parameter in parameters:
+        packing = int16_packing(parameter) if dtype == 'int16' else None
+        if packing is not None and not packable(values[parameter], *packing):
+            logging.warning('values of parameter %s out of the int16 range: stored in float32' % parameter)
+            packing = None
+        if packing is None:
+            data_vars[str(parameter)] = (['time', 'location'], values[parameter])
+        else:
+            scale_factor, add_offset = packing
+            attrs = {'scale_factor': scale_factor, 'add_offset': add_offset, '_FillValue': INT16_FILL}
+            data_vars[str(parameter)] = (['time', 'location'], pack(values[parameter], scale_factor, add_offset), attrs)
+        # free the float array before packing the next parameter
+        values[parameter] = None
+    ds = xr.Dataset(data_vars, coords=coords)
+    if dtype == 'int16':
+        # physical values are computed on access
+        ds = xr.decode_cf(ds, decode_times=False, decode_coords=False)
+    return ds
+
+
+def _load_block(load, dtype):
+    return np.asarray(load(), dtype=dtype)
+
+
+def lazy_dataset(blocks, times, parameters, location, lat, lon, dtype=None):
+    """ Dask-backed dataset of blocks of data loaded on demand (requires dask)
+
+    Parameters
+    ----------
+    blocks : list
+        for each location, list of (offset, length, load) where load() returns
+        the (length, len(parameters)) array of the time steps offset to offset + length - 1.
+        The time steps not covered by a block are NaN
+    times : array-like
+        time axis of the dataset
+    parameters : list
+        IPM weather parameter ids of the columns of the blocks
+    location, lat, lon : list
+        location names and coordinates
+    dtype : str, optional
+        'float64', 'float32' or 'int16', by default settings.DTYPE
+
+    Returns
+    -------
+    xarray.Dataset
+        one (time, location) data variable per weather parameter, one dask
+        chunk per block (and location)
+    """
+    import dask
+    import dask.array as da
+
+    dtype = check_dtype(dtype)
+    ftype = np.float64 if dtype == 'float64' else np.float32
+    times = np.asarray(pandas.DatetimeIndex(times).tz_localize(None).values, dtype='datetime64[ns]')
+    parameters = [int(p) for p in parameters]
+
+    def gap(n):
+        return da.full((n, len(parameters)), np.nan, dtype=ftype, chunks=(n, len(parameters)))
+
+    columns = []
+    for location_blocks in blocks:
+        pieces = []
+        position = 0
+        for offset, length, load in sorted(location_blocks, key=lambda block: block[0]):
+            if offset > position:
+                pieces.append(gap(offset - position))
+            block = dask.delayed(_load_block)(load, ftype)
+            pieces.append(da.from_delayed(block, shape=(length, len(parameters)), dtype=ftype))
+            position = offset + length
+        if position < len(times):
+            pieces.append(gap(len(times) - position))
+        columns.append(da.concatenate(pieces, axis=0)[:len(times)])
+    # (time, parameter, location)
+    array = da.stack(columns, axis=2)
+
+    coords = {'time': times,
+              'location': list(location),
+              'lat': ('location', np.asarray(lat, dtype=float)),
+              'lon': ('location', np.asarray(lon, dtype=float))}
+    data_vars = {}
+    for i, parameter in enumerate(parameters):
+        values = array[:, i, :]
+        packing = int16_packing(parameter) if dtype == 'int16' else None
+        if packing is None:
+            data_vars[str(parameter)] = (['time', 'location'], values)
+        else:
+            scale_factor, add_offset = packing
+            attrs = {'scale_factor': scale_factor, 'add_offset': add_offset, '_FillValue': INT16_FILL}
+            values = values.map_blocks(pack, scale_factor, add_offset, dtype=np.int16)
+            data_vars[str(parameter)] = (['time', 'location'], values, attrs)
+    ds = xr.Dataset(data_vars, coords=coords)
+    if dtype == 'int16':
+        ds = xr.decode_cf(ds, decode_times=False, decode_coords=False)
+    return ds
@@ -0,0 +1,223 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Interpolation of station datasets on a grid (requires scipy)
+
+The interpolation of the stations on the points of the grid is a sparse
+(grid points, stations) weight matrix, computed once for a set of stations and
+a grid and cached: every data variable is interpolated at all the time steps
+by a single sparse matrix product. The weights of the missing values (NaN) are
+removed and the others renormalized.
+
+- 'idw': inverse distance weighting of the k nearest stations (great-circle distance),
+- 'linear': barycentric interpolation in the Delaunay triangles of the stations
+  (NaN outside of their convex hull).
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+
+from weatherdata.spatial import SpatialIndex
+
+METHODS = ('idw', 'linear')
+
+# number of cached weight matrices
+CACHE_SIZE = 32
+
+_weights = OrderedDict()
+_lock = threading.Lock()
+
+
+def idw_weights(latitude, longitude, grid_latitude, grid_longitude, k=8, power=2, max_distance=None):
+    """ Inverse distance weights of the stations for the points of a grid
+
+    Parameters
+    ----------
+    latitude, longitude : array-like
+        coordinates of the stations in degrees
+    grid_latitude, grid_longitude : array-like
+        coordinates of the points of the grid in degrees
+    k : int, optional
+        number of nearest stations of a point, by default 8
+    power : float, optional
+        power of the distance, by default 2
+    max_distance : float, optional
+        maximum distance (km) of the stations of a point, by default None
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (points, stations) weights, rows summing to 1 (or empty without station)
+    """
+    from scipy import sparse
+
+    n, m = len(grid_latitude), len(latitude)
+    index = SpatialIndex(np.arange(m), latitude, longitude)
+    ids, distances = index.nearest(np.asarray(grid_latitude), np.asarray(grid_longitude),
+                                   k=k, max_distance=max_distance)
+    found = np.isfinite(distances)
+    with np.errstate(divide='ignore'):
+        weights = np.where(found, 1. / distances ** power, 0.)
+    # a point on a station takes its value
+    exact = distances == 0
+    weights = np.where(exact.any(axis=1, keepdims=True), exact.astype(float), weights)
+    total = weights.sum(axis=1, keepdims=True)
+    weights = np.divide(weights, total, out=np.zeros_like(weights), where=total > 0)
+
+    rows = np.broadcast_to(np.arange(n)[:, None], found.shape)[found]
+    columns = ids[found].astype(int)
+    return sparse.csr_matrix((weights[found], (rows, columns)), shape=(n, m))
+
+
+def linear_weights(latitude, longitude, grid_latitude, grid_longitude):
+    """ Barycentric weights of the stations for the points of a grid
+
+    The Delaunay triangulation of the stations is computed on an equirectangular
+    projection centered on the stations.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (points, stations) weights, empty rows for the points outside of the
+        convex hull of the stations
+    """
+    from scipy import sparse
+    from scipy.spatial import Delaunay
+
+    latitude, longitude = np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float)
+    scale = np.cos(np.radians(latitude.mean()))
+    triangulation = Delaunay(np.column_stack([longitude * scale, latitude]))
+    points = np.column_stack([np.asarray(grid_longitude, dtype=float) * scale, np.asarray(grid_latitude, dtype=float)])
+    simplex = triangulation.find_simplex(points)
+    inside = simplex >= 0
+
+    transform = triangulation.transform[simplex[inside]]
+    barycentric = np.einsum('ijk,ik->ij', transform[:, :2], points[inside] - transform[:, 2])
+    weights = np.column_stack([barycentric, 1 - barycentric.sum(axis=1)])
+    vertices = triangulation.simplices[simplex[inside]]
+    rows = np.repeat(np.flatnonzero(inside), 3)
+    return sparse.csr_matrix((weights.ravel(), (rows, vertices.ravel())), shape=(len(points), len(latitude)))
+
+
+def _digest(*arrays):
+    h = hashlib.sha1()
+    for array in arrays:
+        h.update(np.ascontiguousarray(array, dtype=float).tobytes())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def weights(latitude, longitude, grid_latitude, grid_longitude, method='idw', **kwds):
+    """ Cached weight matrix of the stations for the points of a grid
+
+    Parameters
+    ----------
+    latitude, longitude : array-like
+        coordinates of the stations in degrees
+    grid_latitude, grid_longitude : array-like
+        coordinates of the points of the grid in degrees
+    method : str, optional
+        'idw' or 'linear', by default 'idw'
+    kwds : dict
+        other arguments of idw_weights
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (points, stations) weights
+    """
+    if method not in METHODS:
+        raise ValueError('method %s not in %s' % (method, METHODS))
+    key = (method, _digest(latitude, longitude), _digest(grid_latitude, grid_longitude), tuple(sorted(kwds.items())))
+    with _lock:
+        if key in _weights:
+            _weights.move_to_end(key)
+            return _weights[key]
+    if method == 'idw':
+        matrix = idw_weights(latitude, longitude, grid_latitude, grid_longitude, **kwds)
+    else:
+        matrix = linear_weights(latitude, longitude, grid_latitude, grid_longitude)
+    with _lock:
+        _weights[key] = matrix
+        while len(_weights) > CACHE_SIZE:
+            _weights.popitem(last=False)
+    return matrix
+
+
+def apply_weights(matrix, values):
+    """ Interpolated values of (time, stations) values: values @ matrix.T, without the NaN
+
+    Returns
+    -------
+    numpy.ndarray
+        (time, points) values, NaN for the points without any weighted value
+    """
+    values = np.asarray(values, dtype=float)
+    missing = np.isnan(values)
+    incomplete = np.flatnonzero(missing.any(axis=1))
+    if len(incomplete):
+        values = np.where(missing, 0., values)
+    result = np.asarray(values @ matrix.T)
+
+    # the rows of the matrix sum to 1 (or 0) when all the values are available
+    total = np.asarray(matrix.sum(axis=1)).ravel()
+    result[:, total == 0] = np.nan
+    if len(incomplete):
+        # weights of the available values at the incomplete time steps
+        available = (~missing[incomplete]).astype(float)
+        partial = np.asarray(available @ matrix.T)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[incomplete] = np.where(partial > 0, result[incomplete] / partial, np.nan)
+    return result
+
+
+def to_grid(ds, latitude, longitude, method='idw', **kwds):
+    """ Interpolate a station dataset on a regular latitude/longitude grid
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        (time, location) data variables with lat and lon coordinates, eg. returned
+        by WeatherDataSource.data
+    latitude, longitude : array-like
+        coordinates of the rows and the columns of the grid in degrees
+    method : str, optional
+        'idw' or 'linear', by default 'idw'
+    kwds : dict
+        other arguments of idw_weights (k, power, max_distance)
+
+    Returns
+    -------
+    xarray.Dataset
+        (time, lat, lon) data variables
+    """
+    if 'location' not in ds.dims:
+        ds = ds.expand_dims('location')
+    lat = np.broadcast_to(ds.lat.values, ds.sizes['location']).astype(float)
+    lon = np.broadcast_to(ds.lon.values, ds.sizes['location']).astype(float)
+    located = np.isfinite(lat) & np.isfinite(lon)
+    if not located.all():
+        ds, lat, lon = ds.isel(location=located), lat[located], lon[located]
+
+    latitude, longitude = np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float)
+    grid_lat, grid_lon = np.meshgrid(latitude, longitude, indexing='ij')
+    matrix = weights(lat, lon, grid_lat.ravel(), grid_lon.ravel(), method=method, **kwds)
+
+    shape = (ds.sizes['time'], len(latitude), len(longitude))
+    data_vars = {}
+    for name in ds.data_vars:
+        values = ds[name].transpose('time', 'location').values
+        data_vars[name] = (('time', 'lat', 'lon'), apply_weights(matrix, values).reshape(shape), ds[name].attrs)
+    grid = xr.Dataset(data_vars, coords={'time': ds.time.values, 'lat': latitude, 'lon': longitude}, attrs=ds.attrs)
+    grid.lat.attrs.update(name='latitude', unit='degrees_north')
+    grid.lon.attrs.update(name='longitude', unit='degrees_east')
+    return grid
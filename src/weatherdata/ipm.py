@@ -12,19 +12,106 @@ from unicodedata import name
 import pandas 
 import xarray as xr
 import numpy as np
-import os
-import json
 import logging
+import asyncio
+import itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 import cartopy.feature as cfea
 
 from agroservices import IPM
 
-from weatherdata.settings import pathCache
+from weatherdata import settings
+from weatherdata.metadata import metadata_cache
+from weatherdata.catalog import local_catalog
+from weatherdata.cache import (canonical_request, jsonable, request_key, request_window,
+                               response_cache, stitch, to_ipm_time, to_seconds)
+from weatherdata.singleflight import flight_key, single_flight
+from weatherdata.scheduler import scheduler, source_max_workers
+from weatherdata.convert import build_dataset, lazy_dataset
+from weatherdata import serializer
+from weatherdata import spatial
 
 logging.basicConfig(format='%(levelname)s:%(message)s',level=logging.INFO)
 
+def split_window(start, end, interval, size, bounds=(None, None)):
+    """ Split a time window in consecutive sub-windows
+
+    Parameters
+    ----------
+    start, end : int
+        first and last time (in seconds) of the window
+    interval : int
+        time step in seconds
+    size : int
+        duration of the sub-windows in seconds (rounded to a multiple of interval)
+    bounds : tuple, optional
+        first and last available times (in seconds, or None), by default (None, None)
+
+    Returns
+    -------
+    list
+        list of the (start, end) sub-windows inside bounds, aligned on the time steps of the window
+    """
+    first, last = bounds
+    if first is not None and first > start:
+        # first time step of the window inside bounds
+        start += -(-(first - start) // interval) * interval
+    if last is not None and last < end:
+        end -= -(-(end - last) // interval) * interval
+    step = max(1, int(size) // interval) * interval
+    return [(t, min(t + step - interval, end)) for t in range(start, end + 1, step)]
+
+def _nearest_frame(indexes, latitude, longitude, k=1, max_distance=None):
+    """ k nearest points of the spatial indexes (by source) of one or several locations
+
+    Returns
+    -------
+    pandas.DataFrame
+        location (position of the location), source, station and distance (km), sorted by distance
+    """
+    latitude, longitude = np.atleast_1d(latitude), np.atleast_1d(longitude)
+    n = len(latitude)
+    ids, distances, sources = [np.empty((n, 0), dtype=object)], [np.empty((n, 0))], [np.empty((n, 0), dtype=object)]
+    for name, index in indexes.items():
+        station, distance = index.nearest(latitude, longitude, k=k, max_distance=max_distance)
+        ids.append(station)
+        distances.append(distance)
+        sources.append(np.full(station.shape, name, dtype=object))
+    ids, distances, sources = (np.concatenate(a, axis=1) for a in (ids, distances, sources))
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    rows = np.arange(n)[:, None]
+    ids, distances, sources = ids[rows, order], distances[rows, order], sources[rows, order]
+    found = np.isfinite(distances)
+    return pandas.DataFrame({'location': np.broadcast_to(rows, found.shape)[found],
+                             'source': sources[found],
+                             'station': ids[found],
+                             'distance': distances[found]})
+
+def _relocate(response, latitude, longitude, altitude):
+    """ Copy of a weather adapter response (not of its data) at another location """
+    if type(response) is not dict:
+        return response
+    locations = [dict(location, latitude=float(latitude), longitude=float(longitude), altitude=float(altitude))
+                 for location in response['locationWeatherData']]
+    return dict(response, locationWeatherData=locations)
+
+def _region_stations(index, bbox=None, polygon=None):
+    """ ids of the points of a spatial index inside a bounding box and/or a polygon """
+    if bbox is None and polygon is None:
+        raise ValueError('a bbox or a polygon is required')
+    stations = None
+    if bbox is not None:
+        stations = index.bbox(*bbox)
+    if polygon is not None:
+        inside = index.polygon(polygon)
+        if stations is not None:
+            inside = set(inside)
+            inside = [station for station in stations if station in inside]
+        stations = inside
+    return stations
+
 class WeatherDataHub:    
     """
         Allows to access at IPM weather resources 
@@ -49,7 +136,10 @@ class WeatherDataHub:
     def __resources__(self):
         
         if self.sources is None:
-            self.sources= self.ipm.get_weatherdatasource()
+            self.sources= dict(metadata_cache.weatherdatasource())
+            # the description of the local sources of the catalog (not their data)
+            for name in local_catalog.names:
+                self.sources.setdefault(name, local_catalog.resource(name))
             
         if len(self.local_sources)>0:
             self.sources.update(self.local_sources)
@@ -74,7 +164,49 @@ class WeatherDataHub:
     
     @property                 
     def parameters(self):
-        ipm_parameter=self.ipm.get_parameter()
+        ipm_parameter=metadata_cache.parameter()
+        return pandas.DataFrame.from_records(ipm_parameter)
+
+    async def aresources(self, session=None):
+        """ Asynchronous version of __resources__
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession, optional
+            HTTP session to use, by default a session is opened for the call
+
+        Returns
+        -------
+        dict
+            description of the weather data sources, indexed by source id
+        """
+        from weatherdata import aio
+
+        if self.sources is None:
+            async with aio.open_session(session) as session:
+                sources = await aio.get_weatherdatasource(session)
+            if type(sources) is int:
+                raise ConnectionError('HTTPError: %s for weatherdatasource' % sources)
+            metadata_cache.set('weatherdatasource', sources)
+            self.sources = dict(sources)
+
+        return self.__resources__
+
+    async def aparameters(self, session=None):
+        """ Asynchronous version of parameters
+
+        Returns
+        -------
+        pandas.DataFrame
+            IPM weather parameters
+        """
+        from weatherdata import aio
+
+        async with aio.open_session(session) as session:
+            ipm_parameter = await aio.get_parameter(session)
+        if type(ipm_parameter) is int:
+            raise ConnectionError('HTTPError: %s for parameter' % ipm_parameter)
+        metadata_cache.set('parameter', ipm_parameter)
         return pandas.DataFrame.from_records(ipm_parameter)
 
     def __forecast__(self):
@@ -84,6 +216,85 @@ class WeatherDataHub:
         return {key: value["endpoint"] for key, value in self.__resources__.items()}
     
         
+    def spatial_indexes(self, sources=None):
+        """ spatial indexes of the stations of the sources (see weatherdata.spatial)
+
+        Parameters
+        ----------
+        sources : list, optional
+            names of the sources, by default all the sources with stations
+
+        Returns
+        -------
+        dict
+            SpatialIndex by source name
+        """
+        resources = self.__resources__
+        names = list(resources) if sources is None else sources
+        indexes = {name: spatial.spatial_index(name, resources[name]) for name in names}
+        return {name: index for name, index in indexes.items() if len(index)}
+
+    def nearest_stations(self, latitude, longitude, k=1, max_distance=None, sources=None):
+        """ k nearest stations of one or several locations, across the sources
+
+        Parameters
+        ----------
+        latitude, longitude : float or array-like
+            coordinates of the locations in degrees
+        k : int, optional
+            number of stations by location, by default 1
+        max_distance : float, optional
+            maximum distance in km, by default None
+        sources : list, optional
+            names of the sources, by default all
+
+        Returns
+        -------
+        pandas.DataFrame
+            location (position of the location), source, station and distance (km), sorted by distance
+        """
+        return _nearest_frame(self.spatial_indexes(sources), latitude, longitude, k, max_distance)
+
+    def stations_within(self, latitude, longitude, radius, sources=None):
+        """ ids of the stations within radius (km) of a location, by source """
+        return {name: index.radius(latitude, longitude, radius)
+                for name, index in self.spatial_indexes(sources).items()}
+
+    def stations_in_bbox(self, min_latitude, min_longitude, max_latitude, max_longitude, sources=None):
+        """ ids of the stations inside a latitude/longitude box, by source """
+        return {name: index.bbox(min_latitude, min_longitude, max_latitude, max_longitude)
+                for name, index in self.spatial_indexes(sources).items()}
+
+    def data_in_region(self, bbox=None, polygon=None, sources=None, **kwds):
+        """ Weather data of the stations inside a bounding box or a polygon, across the sources
+
+        The sources are fetched in parallel (see WeatherDataSource.data_in_region).
+
+        Parameters
+        ----------
+        bbox : tuple, optional
+            (min_latitude, min_longitude, max_latitude, max_longitude)
+        polygon : list or dict, optional
+            ring of [longitude, latitude] vertices, or geoJSON Polygon or MultiPolygon
+        sources : list, optional
+            names of the sources, by default all the sources with stations
+        kwds : dict
+            other arguments of WeatherDataSource.data
+
+        Returns
+        -------
+        dict
+            xarray.Dataset by source name, for the sources with stations in the region
+        """
+        names = [name for name, index in self.spatial_indexes(sources).items()
+                 if _region_stations(index, bbox, polygon)]
+        if not names:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            futures = {name: executor.submit(self.get_ressource(name).data_in_region, bbox, polygon, **kwds)
+                       for name in names}
+            return {name: future.result() for name, future in futures.items()}
+
     def get_ressource(self, name:str):
         """ Get ressource from WeatherDataSource
 
@@ -103,7 +314,9 @@ class WeatherDataHub:
             the resource is unknown or the name of the resource is misspelled
         """        
         if name in self.local_sources:
-            return WeatherDataSource(name=name,forecast=None,endpoint=None,df=self.local_sources[name]["endpoint"])
+            return WeatherDataSource(name=name,forecast=None,endpoint=None,local=self.local_sources[name]["name"])
+        elif name in local_catalog:
+            return WeatherDataSource(name=name,forecast=None,endpoint=None,local=name)
         else:
             keys = [item for item in self.__resources__]
             if name in keys:
@@ -135,34 +348,24 @@ class WeatherDataHub:
                     "timezone":timezone,
                     "interval":interval}
         
-        d={"personal_data":{
-            "id":"personal data",
-           "name": name,
-           "description": "personal data",
-           "public_URL": None,
-           "endpoint":data,
-           "authentication_type":None,
-           "needs_data_control":False,
-           "access_type":'location',
-           "priority":0,
-           "temporal" : {"forecast" : None,
-                         "historic" : {"start": data.index.tolist()[0].strftime('%Y-%m-%d'),
-                                       "end": data.index.tolist()[-1].strftime('%Y-%m-%d'),
-                                       "interval" : [interval]}
-                          },
-           "parameters" : {'common': data.columns.tolist(), 'optional': None},
-           "spatial" : None,
-           "organization" : None}
-        }
+        # the data are stored in the local catalog, and read by time slice
+        local_catalog.add(name, data, longitude=longitude, latitude=latitude, altitude=altitude,
+                          timezone=timezone, interval=interval)
+        d={"personal_data":dict(local_catalog.resource(name), id="personal data")}
         
         self.local_sources.update(d)
         return data
         
     def __data_reader__(self,path=r'C:\Users\mlabadie\Documents\GitHub\weatherdata\example\Boigneville_2012_2013_h.csv',sep=';',column_name=['date', 'h', 'temperature_air',
                                              'relative_humidity', 'rain',
-                                             'wind_speed', 'global_radiation'],skiprows=2,dec=","):
+                                             'wind_speed', 'global_radiation'],skiprows=2,dec=",",
+                        date_format='%d/%m/%Y %H:%M',usecache=True):
         r""" Reader for my data boignonville
 
+        The file is read by chunks (see weatherdata.local.read_csv) and a binary
+        copy is kept in the cache for the next reads. The returned DataFrame can
+        be modified, it is a copy of the memory-mapped binary copy.
+
         Parameters
         ----------
         path : regexp, optional
@@ -175,34 +378,33 @@ class WeatherDataHub:
         line of data begin, by default 2
         dec : str, optional
             type of decimal used in my file, by default ","
+        date_format : str, optional
+            format of the date and hour columns joined by a space, by default '%d/%m/%Y %H:%M'
+        usecache : bool, optional
+            read (or write) the binary copy of the file, by default True
         """
-        data=pandas.read_csv(path, names=column_name,
-                            sep=';', skiprows=skiprows, decimal=dec,encoding='latin-1')
-        data.index = pandas.to_datetime(data['date'].map(str) + ' ' + data['h'],
-                                        dayfirst=True)
-        data['date'] = data.index
-        
-        # convert Rg J/cm2 -> J.m-2.s-1
-        data['global_radiation'] *= (10000. / 3600)
-        
-        # convert Global radiation to PPFD -> µmol.m-2.s-1
-        #data["Par"]=data["global_radiation"]*0.48*4.6
-        
-        # convert wind km/h -> m.s-1
-        data['wind_speed'] *= (1000. / 3600)
-        data=data.drop(columns=["date", "h"])
-        
-        return data    
+        from weatherdata import local
+
+        # Rg J/cm2 -> J.m-2.s-1 and wind km/h -> m.s-1
+        # (global radiation to PPFD in µmol.m-2.s-1: *0.48*4.6)
+        data = local.read_csv(path, sep=sep, column_name=column_name, skiprows=skiprows, dec=dec,
+                              date_format=date_format, conversions=local.BOIGNEVILLE_CONVERSIONS,
+                              usecache=usecache)
+        # writable, like the frame of the first read
+        return data if data.values.flags.writeable else data.copy()
             
 
 class WeatherDataSource:
-    def __init__(self, name, forecast,endpoint,df=None):
+    def __init__(self, name, forecast,endpoint,df=None,local=None):
         self.name = name
         self.forecast=forecast
         self.endpoint=endpoint
         self.sources=WeatherDataHub().__resources__
         self.ipm = IPM()
         self.df= df 
+        # name of the source in the local catalog (weatherdata.catalog)
+        self.local = local
+        self.cache = response_cache
     
         # WeatherDataHub.__init__(self)   
   
@@ -219,10 +421,10 @@ class WeatherDataSource:
     @property               
     def parameter(self):
         df= WeatherDataHub().parameters
-        list_parameters= self.__source__["parameters"]["common"]
+        list_parameters= list(self.__source__["parameters"]["common"])
         
         if self.__source__["parameters"]["optional"]:
-            list_parameters.append(list_parameters)
+            list_parameters.extend(self.__source__["parameters"]["optional"])
             
         
         return df[df["id"].isin(list_parameters)]
@@ -230,29 +432,93 @@ class WeatherDataSource:
     
     @property
     def stations(self):
-        stations = {}
-        if "features" in self.__source__["spatial"]["geoJSON"]:
-            features = self.__source__["spatial"]["geoJSON"]['features']
-            def _get_id(feature):
-                if 'id' in feature:
-                    return int(feature['id'])
-                else:
-                    return int(feature['properties']['id'])
-            def _get_properties(feature):
-                properties = feature["properties"]
-                coord = feature['geometry']['coordinates']
-                properties.update(dict(latitude=float(coord[0]), longitude=float(coord[1])))
-                return properties
-                #recupère les infos stations dans une properties
-            stations={_get_id(feature): _get_properties(feature) for feature in features}
-        df = pandas.DataFrame(stations).T
-        return df
+        """ properties, latitude and longitude of the stations, indexed by station id (parsed once) """
+        return spatial.stations(self.name, self.__source__).copy()
+
+    @property
+    def spatial_index(self):
+        """ spatial index of the stations of the source (see weatherdata.spatial) """
+        return spatial.spatial_index(self.name, self.__source__)
+
+    def nearest_stations(self, latitude, longitude, k=1, max_distance=None):
+        """ k nearest stations of one or several locations
+
+        Parameters
+        ----------
+        latitude, longitude : float or array-like
+            coordinates of the locations in degrees
+        k : int, optional
+            number of stations by location, by default 1
+        max_distance : float, optional
+            maximum distance in km, by default None
+
+        Returns
+        -------
+        pandas.DataFrame
+            location (position of the location), station and distance (km), sorted by distance
+        """
+        return _nearest_frame({self.name: self.spatial_index}, latitude, longitude, k, max_distance)
+
+    def stations_within(self, latitude, longitude, radius):
+        """ ids of the stations within radius (km) of a location, sorted by distance """
+        return self.spatial_index.radius(latitude, longitude, radius)
+
+    def stations_in_bbox(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """ ids of the stations inside a latitude/longitude box """
+        return self.spatial_index.bbox(min_latitude, min_longitude, max_latitude, max_longitude)
+
+    def stations_in_region(self, bbox=None, polygon=None):
+        """ ids of the stations inside a bounding box or a polygon
+
+        Parameters
+        ----------
+        bbox : tuple, optional
+            (min_latitude, min_longitude, max_latitude, max_longitude)
+        polygon : list or dict, optional
+            ring of [longitude, latitude] vertices, or geoJSON Polygon or MultiPolygon
+
+        Returns
+        -------
+        list
+            ids of the stations
+        """
+        return _region_stations(self.spatial_index, bbox, polygon)
+
+    def data_in_region(self, bbox=None, polygon=None, **kwds):
+        """ Weather data of all the stations inside a bounding box or a polygon
+
+        The stations are found with the spatial index of the source and fetched
+        like a list of stations (in parallel, with the cache).
+
+        Parameters
+        ----------
+        bbox : tuple, optional
+            (min_latitude, min_longitude, max_latitude, max_longitude)
+        polygon : list or dict, optional
+            ring of [longitude, latitude] vertices, or geoJSON Polygon or MultiPolygon
+        kwds : dict
+            other arguments of data (parameters, timeStart, timeEnd, usecache, ...)
+
+        Returns
+        -------
+        xarray.Dataset
+            weather data of the stations, with lat and lon coordinates
+
+        Raises
+        ------
+        ValueError
+            no station of the source in the region
+        """
+        stationId = self.stations_in_region(bbox, polygon)
+        if not stationId:
+            raise ValueError('no station of %s in the region' % self.name)
+        return self.data(stationId=stationId, **kwds)
 
     def data(self,
              parameters =None,
              stationId =None,
-             timeStart = '2020-06-12',
-             timeEnd = '2020-07-03',
+             timeStart =None,
+             timeEnd =None,
              timeZone = "UTC",
              altitude = [70.0],
              longitude = [14.3711],
@@ -262,10 +528,262 @@ class WeatherDataSource:
              display ='ds',
              varname = 'id',
              usecache =False,
-            savecache =False):
+            savecache =False,
+            max_workers =None,
+            window =None,
+            dtype =None,
+            lazy =False,
+            snap =False):
+        """ Get weather data of the resource for a list of stations or of locations
+
+        Stations (or locations) are fetched in parallel by a pool of at most
+        `max_workers` threads, the number of requests in flight for a source
+        being also bounded by `settings.SOURCE_MAX_WORKERS`.
+        Responses keep the order of `stationId` (or of `latitude`).
+        Identical requests in flight in other threads are sent only once
+        (see weatherdata.singleflight).
+        Long periods can be split in sub-windows of duration `window`,
+        requested in parallel and concatenated along time.
+        For a local source, only the period [timeStart, timeEnd] is read from
+        the local catalog (by default its whole period).
+
+        Parameters
+        ----------
+        parameters : list, optional
+            list of IPM weather parameter ids, by default None
+        stationId : list, optional
+            list of weather station ids (for non forecast resources), by default None
+        timeStart : str, optional
+            first date of the period, by default '2020-06-12' (the first date for a local source)
+        timeEnd : str, optional
+            last date of the period, by default '2020-07-03' (the last date for a local source)
+        timeZone : str, optional
+            time zone of timeStart and timeEnd, by default "UTC"
+        altitude, longitude, latitude : list, optional
+            coordinates of the locations (for forecast resources)
+        credentials : dict, optional
+            credentials of the resource if needed, by default None
+        interval : int, optional
+            time step in seconds, by default 3600
+        display : str, optional
+            "ds" for a xarray.Dataset, "stream" for a generator of the dataset of
+            each station (or location) as soon as it is fetched, otherwise the
+            list of IPM json responses, by default 'ds'
+        varname : str, optional
+            name the data variables with parameter "id" or "name", by default 'id'
+        usecache : bool, optional
+            read responses from the cache (weatherdata.cache) when available, by default False.
+            For historic resources, only the time windows missing in the cache are requested
+        savecache : bool, optional
+            write responses in the cache, by default False
+        max_workers : int, optional
+            number of stations fetched in parallel, by default settings.MAX_WORKERS
+        window : str or int, optional
+            duration of the sub-windows (eg. '90D' or seconds), by default
+            settings.SOURCE_WINDOW of the source, no split if None
+        dtype : str, optional
+            dtype of the data variables of the dataset: 'float64', 'float32' or 'int16'
+            (packed with a CF scale_factor/add_offset per parameter and decoded lazily),
+            by default settings.DTYPE
+        lazy : bool, optional
+            if display is "ds", return a dask-backed dataset (requires dask) without
+            fetching anything: each station (or location) and sub-window is a chunk
+            fetched (or read from the cache) when it is computed, by default False
+        snap : bool or float, optional
+            for forecast resources, snap the locations to the grid of the model
+            (settings.SOURCE_RESOLUTION of the source, or a resolution in degrees)
+            and their altitude to settings.SNAP_ALTITUDE: the locations of a same
+            cell are requested once, at the coordinates of the cell, and the cached
+            responses of the cell serve the next locations of the cell, by default False
+
+        Returns
+        -------
+        xarray.Dataset, generator or list
+            weather data of the stations (or locations)
+        """
         
-        responses=[]
+        if self.local is not None or self.df is not None:
+            return self.__local_data__(parameters, timeStart, timeEnd, display, varname, dtype)
+        if timeStart is None:
+            timeStart = '2020-06-12'
+        if timeEnd is None:
+            timeEnd = '2020-07-03'
+
+        points, cells = None, None
+        resolution = self.__resolution__(snap)
+        if resolution:
+            points = list(zip(latitude, longitude, altitude))
+            latitude, longitude, altitude, cells = spatial.snap_points(latitude, longitude, resolution,
+                                                                       altitude, settings.SNAP_ALTITUDE)
+            latitude, longitude, altitude = latitude.tolist(), longitude.tolist(), altitude.tolist()
+
+        requests, stationId = self.__requests__(parameters=parameters,
+                                                stationId=stationId,
+                                                timeStart=timeStart,
+                                                timeEnd=timeEnd,
+                                                timeZone=timeZone,
+                                                altitude=altitude,
+                                                longitude=longitude,
+                                                latitude=latitude,
+                                                interval=interval)
 
+        def fetch(request):
+            params, key, station = request
+            # identical concurrent requests wait for the same response
+            return single_flight.do(flight_key(key, credentials, usecache=usecache, savecache=savecache),
+                                    self.__fetch__,
+                                    params, key, station,
+                                    credentials=credentials,
+                                    usecache=usecache,
+                                    savecache=savecache)
+
+        tasks, groups = self.__split__(requests, window)
+        if lazy and display == "ds":
+            ds = self.__lazy_dataset__(requests, tasks, groups, fetch, parameters, stationId, varname, dtype)
+            return ds if cells is None else self.__spread_dataset__(ds, cells, points)
+
+        workers = min(max_workers or settings.MAX_WORKERS,
+                      source_max_workers(self.name),
+                      len(tasks))
+        if display == "stream":
+            spread = None
+            if cells is not None:
+                spread = [[] for _ in requests]
+                for cell, point in zip(cells, points):
+                    spread[cell].append(point)
+            return self.__stream__(requests, tasks, groups, fetch, workers, stationId, varname, dtype, spread)
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                datas = list(executor.map(fetch, tasks))
+        else:
+            datas = [fetch(task) for task in tasks]
+
+        datas = self.__join__(requests, groups, datas)
+        if cells is not None:
+            # the response of a cell for each of its locations
+            requests = [requests[cell] for cell in cells]
+            datas = [_relocate(datas[cell], *point) for cell, point in zip(cells, points)]
+        return self.__responses__(requests, datas, stationId, varname, display, dtype)
+
+    def __resolution__(self, snap):
+        """ Resolution (in degrees) of the grid of the locations for the snap argument of data """
+        if not snap or not self.forecast:
+            return None
+        if snap is True:
+            return settings.SOURCE_RESOLUTION.get(self.name)
+        return float(snap)
+
+    def __spread_dataset__(self, ds, cells, points):
+        """ Dataset of the locations of points from the dataset of their cells """
+        ds = ds.isel(location=list(cells))
+        return ds.assign_coords(location=[str([float(lat), float(lon)]) for lat, lon, alt in points],
+                                lat=('location', [float(lat) for lat, lon, alt in points], ds.lat.attrs),
+                                lon=('location', [float(lon) for lat, lon, alt in points], ds.lon.attrs))
+
+    async def adata(self,
+                    parameters =None,
+                    stationId =None,
+                    timeStart = '2020-06-12',
+                    timeEnd = '2020-07-03',
+                    timeZone = "UTC",
+                    altitude = [70.0],
+                    longitude = [14.3711],
+                    latitude = [67.2828],
+                    credentials = None,
+                    interval = 3600,
+                    display ='ds',
+                    varname = 'id',
+                    usecache =False,
+                    savecache =False,
+                    max_workers =None,
+                    window =None,
+                    dtype =None,
+                    session =None):
+        """ Asynchronous version of data, to be awaited in an event loop
+
+        All the requests share one HTTP session (aiohttp.ClientSession) and at
+        most `max_workers` of them are in flight at the same time. If the task
+        is cancelled, or if one request raises, the pending requests are cancelled,
+        except those still awaited by other callers.
+
+        Parameters
+        ----------
+        see data, and
+        session : aiohttp.ClientSession, optional
+            HTTP session to use, by default the session shared by the calls of the event loop
+
+        Returns
+        -------
+        xarray.Dataset or list
+            weather data of the stations (or locations)
+        """
+        from weatherdata import aio
+
+        requests, stationId = self.__requests__(parameters=parameters,
+                                                stationId=stationId,
+                                                timeStart=timeStart,
+                                                timeEnd=timeEnd,
+                                                timeZone=timeZone,
+                                                altitude=altitude,
+                                                longitude=longitude,
+                                                latitude=latitude,
+                                                interval=interval)
+
+        workers = min(max_workers or settings.MAX_WORKERS, source_max_workers(self.name))
+        semaphore = asyncio.Semaphore(max(workers, 1))
+
+        async def fetch(request):
+            params, key, station = request
+            loop = asyncio.get_running_loop()
+            if station is not None:
+                logging.info('start connecting to station %s' % station)
+            if usecache:
+                cached, queries = await loop.run_in_executor(None, self.__read_cache__, key, params)
+            else:
+                cached, queries = [], [params]
+            fetched = []
+            # a request shared with other callers keeps the shared session open
+            async with aio.shared_session(session) as http:
+                for query in queries:
+                    async with semaphore:
+                        data = await scheduler(self.name).acall(aio.get_weatheradapter,
+                                                                http, self.__source__, query,
+                                                                credentials=credentials,
+                                                                label=self.__label__(params, station),
+                                                                key=request_key(self.__source__, query))
+                    fetched.append(data)
+                    if type(data) is not dict:
+                        break
+            return await loop.run_in_executor(None, self.__write_cache__, key, params, cached, fetched, savecache)
+
+        def shared_key(key):
+            # the requests on a session of a caller are only shared with the callers of this session
+            key = flight_key(key, credentials, usecache=usecache, savecache=savecache)
+            return key if session is None else '%s-%d' % (key, id(session))
+
+        queries, groups = self.__split__(requests, window)
+        async with aio.shared_session(session):
+            tasks = [asyncio.ensure_future(single_flight.ado(shared_key(query[1]), fetch, query))
+                     for query in queries]
+            try:
+                datas = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        datas = self.__join__(requests, groups, datas)
+        return self.__responses__(requests, datas, stationId, varname, display, dtype)
+
+    def __requests__(self, parameters, stationId, timeStart, timeEnd, timeZone, altitude, longitude, latitude, interval):
+        """ Build the weather adapter queries of data
+
+        Returns
+        -------
+        tuple
+            list of (query parameters, cache key, station id) and the station ids (None for locations)
+        """
         times = pandas.date_range(timeStart, timeEnd, freq=str(interval) + 's', tz=timeZone)
         # time transformation for query format
         timeStart = times[0].strftime('%Y-%m-%dT%H:%M:%S')
@@ -278,10 +796,9 @@ class WeatherDataSource:
             decstr = decstr[:-2] + ':' + decstr[-2:]
             timeStart += decstr
             timeEnd += decstr
-        interval = pandas.Timedelta(times.freq).seconds
+        interval = int(pandas.Timedelta(times.freq).total_seconds())
 
-        param_list = []
-        path_list = []
+        requests = []
 
         if self.forecast== False:
             for station in stationId:
@@ -291,15 +808,10 @@ class WeatherDataSource:
                                                         timeEnd=timeEnd,
                                                         interval=interval,
                                                         parameters=parameters)
-                path=os.path.join(pathCache(),str(station)+'_'+str(parameters)+"_"+timeStart.split("T")[0]+"_"+timeEnd.split("T")[0]+'.json')
-
-                param_list.append(params)
-                path_list.append(path)
+                requests.append((params, request_key(self.__source__, params), station))
         else:
             stationId = None # controls the behaviour of response parsing to xarray
             for el in range(len(latitude)):
-                path = os.path.join(pathCache(),
-                                    str(altitude[el]) + '_' + str(latitude[el]) + "_" + str(longitude[el]) + '.json')
                 params = self.ipm.weatheradapter_params(self.__source__,
                                                         altitude=altitude[el],
                                                         latitude=latitude[el],
@@ -308,165 +820,463 @@ class WeatherDataSource:
                                                         timeEnd=timeEnd,
                                                         interval=interval,
                                                         parameters=parameters)
-                param_list.append(params)
-                path_list.append(path)
+                requests.append((params, request_key(self.__source__, params), None))
 
-        for params, path in zip(param_list, path_list):
-            if self.forecast == False:
-                logging.info('start connecting to station %s' % station)
+        return requests, stationId
 
-            if usecache and os.path.exists(path):
-                with open(path) as f:
-                    data=json.load(f)
-            else:
-                data = self.ipm.get_weatheradapter(self.__source__,
-                                params,
-                                credentials=credentials)
+    def __split__(self, requests, window=None):
+        """ Split the requests of data in requests of sub-windows of duration window
+
+        Sub-windows outside the historic period of the resource are not requested.
 
+        Returns
+        -------
+        tuple
+            list of the (query parameters, cache key, station id) to send, and
+            for each request the indices of its sub-windows (None if there is no split)
+
+        Raises
+        ------
+        ValueError
+            the requested period is outside the historic period of the resource
+        """
+        if window is None:
+            window = settings.SOURCE_WINDOW.get(self.name)
+        if not window:
+            return requests, None
+        size = window if isinstance(window, (int, float)) else pandas.Timedelta(window).total_seconds()
+
+        historic = (self.__source__.get("temporal") or {}).get("historic") or {}
+        bounds = tuple(None if historic.get(bound) is None else to_seconds(historic[bound])
+                       for bound in ("start", "end"))
+        if bounds[1] is not None:
+            # the last day is available
+            bounds = (bounds[0], bounds[1] + 24 * 3600 - 1)
+
+        tasks, groups = [], []
+        for params, key, station in requests:
+            start, end, interval = request_window(canonical_request(self.__source__, params))
+            group = []
+            for first, last in split_window(start, end, interval, size, bounds):
+                query = dict(params, timeStart=to_ipm_time(first), timeEnd=to_ipm_time(last))
+                group.append(len(tasks))
+                tasks.append((query, request_key(self.__source__, query), station))
+            if not group:
+                raise ValueError('period %s - %s outside the historic period of %s (%s - %s)'
+                                 % (params['timeStart'], params['timeEnd'], self.name,
+                                    historic.get('start'), historic.get('end')))
+            groups.append(group)
+        return tasks, groups
+
+    def __join__(self, requests, groups, datas):
+        """ Concatenate the responses of the sub-windows of each request (see __split__)
+
+        Returns
+        -------
+        list
+            for each request, the IPM json response or the HTTP error code
+        """
+        if groups is None:
+            return datas
+
+        joined = []
+        for (params, key, station), group in zip(requests, groups):
+            parts = [datas[i] for i in group]
+            responses = [data for data in parts if type(data) is dict]
+            if not responses:
+                joined.append(parts[0])
+                continue
+            if len(responses) < len(parts):
+                logging.warning('HTTPError: %s for a part of the period of %s'
+                                % ([data for data in parts if type(data) is not dict][0], station))
+            request = canonical_request(self.__source__, params)
+            start, end, interval = request_window(request)
+            joined.append(stitch(responses, start, end, interval,
+                                 parameters=request['query'].get('parameters')))
+        return joined
+
+    def __stream__(self, requests, tasks, groups, fetch, workers, stationId, varname, dtype=None, spread=None):
+        """ Generator of the dataset of each station (or location) of data, in the order of completion
+
+        At most 2 * workers tasks are submitted ahead, so that the memory used
+        does not grow with the number of stations.
+
+        Parameters
+        ----------
+        requests : list
+            (query parameters, cache key, station id) of the stations (or locations)
+        tasks, groups : list
+            sub-window requests and their indices for each request, as returned by __split__
+        fetch : function
+            response (or HTTP error code) of a task
+        spread : list, optional
+            (latitude, longitude, altitude) of the locations of each request, if
+            the requests are the cells of snapped locations (see data)
+        """
+        split = groups is not None
+        if not split:
+            groups = [[i] for i in range(len(tasks))]
+        owner = {i: j for j, group in enumerate(groups) for i in group}
+        todo = iter(range(len(tasks)))
+        parts = {}
+        pending = {}
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            try:
+                while True:
+                    for i in itertools.islice(todo, 2 * max(workers, 1) - len(pending)):
+                        pending[executor.submit(fetch, tasks[i])] = i
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i = pending.pop(future)
+                        j = owner[i]
+                        parts.setdefault(j, {})[i] = future.result()
+                        if len(parts[j]) < len(groups[j]):
+                            continue
+                        if split:
+                            data = self.__join__([requests[j]], [groups[j]], parts.pop(j))[0]
+                        else:
+                            data = parts.pop(j)[i]
+                        station = requests[j][2]
+                        if type(data) is not dict:
+                            logging.warning('HTTPError: %s for %s' % (data, station))
+                            continue
+                        if spread is not None:
+                            for point in spread[j]:
+                                yield self.__convert_xarray_dataset__([_relocate(data, *point)], None,
+                                                                      varname, "ds", dtype)
+                            continue
+                        yield self.__convert_xarray_dataset__([data], [station] if stationId else None,
+                                                              varname, "ds", dtype)
+            finally:
+                # the consumer may stop before the end
+                for future in pending:
+                    future.cancel()
+
+    def __lazy_dataset__(self, requests, tasks, groups, fetch, parameters, stationId, varname, dtype=None):
+        """ Dask-backed dataset of data, with one chunk per request of tasks (see __split__)
+
+        Parameters
+        ----------
+        requests : list
+            (query parameters, cache key, station id) of the stations (or locations)
+        tasks, groups : list
+            sub-window requests and their indices for each request, as returned by __split__
+        fetch : function
+            response (or HTTP error code) of a task
+        """
+        if groups is None:
+            groups = [[i] for i in range(len(tasks))]
+        if not parameters:
+            parameters = self.__source__["parameters"]["common"]
+        parameters = [int(p) for p in parameters]
+
+        start, end, interval = request_window(canonical_request(self.__source__, requests[0][0]))
+        times = (start + np.arange((end - start) // interval + 1) * interval) * 10 ** 9
+
+        def loader(task):
+            def load():
+                data = fetch(task)
+                first, last, interval = request_window(canonical_request(self.__source__, task[0]))
+                if type(data) is not dict:
+                    logging.warning('HTTPError: %s for %s' % (data, task[2]))
+                    return np.full(((last - first) // interval + 1, len(parameters)), np.nan)
+                return stitch([data], first, last, interval, parameters=parameters)['locationWeatherData'][0]['data']
+            return load
+
+        blocks = []
+        for group in groups:
+            location_blocks = []
+            for i in group:
+                first, last, interval = request_window(canonical_request(self.__source__, tasks[i][0]))
+                location_blocks.append(((first - start) // interval, (last - first) // interval + 1, loader(tasks[i])))
+            blocks.append(location_blocks)
+
+        if stationId:
+            location = stationId
+            stations = self.stations
+            coordinates = [stations.loc[station, ['latitude', 'longitude']].tolist() if station in stations.index
+                           else (np.nan, np.nan) for station in stationId]
+        else:
+            coordinates = [(float(params['latitude']), float(params['longitude'])) for params, key, station in requests]
+            location = [str([lat, lon]) for lat, lon in coordinates]
+        lat = [float(c[0]) for c in coordinates]
+        lon = [float(c[1]) for c in coordinates]
+
+        ds = lazy_dataset(blocks, times.astype('datetime64[ns]'), parameters, location, lat, lon, dtype=dtype)
+        return self.__dataset_attrs__(ds, stationId, varname)
+
+    def __responses__(self, requests, datas, stationId, varname, display, dtype=None):
+        """ Gather the responses of the requests of data, in the order of the requests """
+        responses = []
+        # keep only the stations which respond, in the order of the request
+        stations = []
+        for (params, key, station), data in zip(requests, datas):
             if type(data) is dict:
                 responses.append(data)
+                stations.append(station)
             elif type(data) is int:
                 logging.warning('HTTPError: %s for %s' %(data,station))
-
-            if savecache and type(data) is dict:
-                with open(path,'w') as f:
-                    json.dump(data, f)
+        if stationId:
+            stationId = stations
 
         if display=="ds":
-            return self.__convert_xarray_dataset__(responses,stationId,varname,display)
+            return self.__convert_xarray_dataset__(responses,stationId,varname,display,dtype)
         else:
-            return responses
+            return [jsonable(response) for response in responses]
+
+    def __fetch__(self, params, key, station=None, credentials=None, usecache=False, savecache=False):
+        """ Get the response of the weather adapter for one station (or one location)
+
+        Parameters
+        ----------
+        params : dict
+            query parameters built by IPM.weatheradapter_params
+        key : str
+            key of the response in the cache
+        station : int, optional
+            weather station id, None for a location, by default None
+        credentials : dict, optional
+            credentials of the resource if needed, by default None
+        usecache : bool, optional
+            read the response from the cache when available, by default False
+        savecache : bool, optional
+            write the response in the cache, by default False
+
+        Returns
+        -------
+        dict or int
+            IPM json response or HTTP error code
+        """
+        if station is not None:
+            logging.info('start connecting to station %s' % station)
+
+        if usecache:
+            cached, queries = self.__read_cache__(key, params)
+        else:
+            cached, queries = [], [params]
+
+        fetched = []
+        for query in queries:
+            data = scheduler(self.name).call(self.ipm.get_weatheradapter,
+                                             self.__source__, query,
+                                             credentials=credentials,
+                                             label=self.__label__(params, station),
+                                             key=request_key(self.__source__, query))
+            fetched.append(data)
+            if type(data) is not dict:
+                break
+
+        return self.__write_cache__(key, params, cached, fetched, savecache)
+
+    def __label__(self, params, station=None):
+        """ Station id, or (latitude, longitude) of a location, for the logs of the scheduler """
+        if station is not None:
+            return station
+        return (params.get('latitude'), params.get('longitude'))
+
+    def __read_cache__(self, key, params):
+        """ Cached responses of a query and the queries of the parameters and time windows missing in the cache
+
+        Forecasts are only read if the same query is cached, whereas historic
+        data are read from the cached segments of the series of the query,
+        which can hold more parameters or other time windows.
+
+        Returns
+        -------
+        tuple
+            list of the cached responses and list of the queries to send
+        """
+        if self.forecast:
+            data = self.cache.get(key)
+            return ([], [params]) if data is None else ([data], [])
+
+        responses, missing = self.cache.lookup(canonical_request(self.__source__, params))
+        if not responses:
+            return [], [params]
+        queries = []
+        for parameters, start, end in missing:
+            query = dict(params, timeStart=to_ipm_time(start), timeEnd=to_ipm_time(end))
+            if parameters is not None:
+                # same format as IPM.weatheradapter_params
+                if isinstance(params['parameters'], str):
+                    query['parameters'] = ','.join(parameters)
+                else:
+                    query['parameters'] = [int(p) for p in parameters]
+            queries.append(query)
+        return responses, queries
+
+    def __write_cache__(self, key, params, cached, fetched, savecache=False):
+        """ Assemble the cached and fetched responses of a query and store the result if savecache
+
+        Returns
+        -------
+        dict or int
+            IPM json response or HTTP error code
+        """
+        for data in fetched:
+            if type(data) is not dict:
+                return data
+
+        request = canonical_request(self.__source__, params)
+        if not cached and len(fetched) == 1:
+            data = fetched[0]
+        elif self.forecast:
+            data = cached[0]
+        else:
+            start, end, interval = request_window(request)
+            data = stitch(cached + fetched, start, end, interval,
+                          parameters=request['query'].get('parameters'))
+
+        if savecache and fetched:
+            self.cache.put(key, data, request=request, forecast=bool(self.forecast))
+        return data
     
-    def __convert_xarray_dataset__(self, responses,stationId,varname,display):
+    def __convert_xarray_dataset__(self, responses,stationId,varname,display,dtype=None):
         
         if display != "ds":
             return responses
         else:          
-            times=pandas.date_range(start=responses[0]["timeStart"],
-                                    end=responses[0]["timeEnd"],
-                                    freq=str(responses[0]["interval"])+"S",
-                                    name="time")
-            
-            #times.strftime('%Y-%m-%dT%H:%M:%S')
-            
-            datas= [np.array(response['locationWeatherData'][0]['data']).astype("float") for response in responses]
-            
-            dats = [[data[:,i].reshape(data.shape[0],1) for i in range(data.shape[1])] for data in datas]
-            
+            # one array per parameter filled from all the responses
+            ds=build_dataset(responses, stationId, dtype=dtype)
+            ds=self.__dataset_attrs__(ds, stationId, varname)
+        return ds
 
-            # construction of dict for dataset variable
-            data_vars=[{str(response['weatherParameters'][i]):(['time','location'],dat[i]) for i in range(len(response['weatherParameters']))} for response in responses for dat in dats]
-
-            # construction dictionnaire coordonnée
-            if stationId:
-                coords=[{'time':times.values,
-                'location':([stationId[el]]),
-                'lat':("location",[float(responses[el]['locationWeatherData'][0]['latitude'])]),
-                'lon':("location",[float(responses[el]['locationWeatherData'][0]['longitude'])]),
-                #'alt':[float(responses[el]['locationWeatherData'][0]['altitude'])]
-                } 
-                for el in range(len(responses))]
-                
-            else:
-                coords=[{'time':times.values,
-                        'location':([str([responses[el]['locationWeatherData'][0]['latitude'],responses[el]['locationWeatherData'][0]['longitude']])]),
-                        'lat':('location',[responses[el]['locationWeatherData'][0]['latitude']]),
-                        'lon':('location',[responses[el]['locationWeatherData'][0]['longitude']]),
-            #'alt':[float(responses[el]['locationWeatherData'][0]['altitude'])]
-            } for el in range(len(responses))]
-                
-                    
-            # list de ds
-            list_ds=[xr.Dataset(data_vars[el], coords=coords[el]) for el in range(len(responses))]
-            
-            #merge ds
-            ds=xr.merge(list_ds)
-            
-            #add coordinates attributes
-            if stationId:
-                ds.coords['time'].attrs["name"]="time"
-                ds.coords['location'].attrs['name']= 'WeatherStationId'
-                ds.coords['lat'].attrs['name']='latitude'
-                ds.coords['lat'].attrs['unit']='degrees_north'
-                ds.coords['lon'].attrs['name']='longitude'
-                ds.coords['lon'].attrs['unit']='degrees_east'
-            else:
-                #ds.coords['location'].attrs['name']='[latitude,longitude]'
-                ds.coords['lat'].attrs['name']='latitude'
-                ds.coords['lat'].attrs['unit']='degrees_north'
-                ds.coords['lon'].attrs['name']='longitude'
-                ds.coords['lon'].attrs['unit']='degrees_east'
-            
-            # add data variable  attributes
-            param = self.ipm.get_parameter()
-            p={str(item['id']): item for item in param if item['id'] in responses[0]['weatherParameters']}
-                    
+    def __dataset_attrs__(self, ds, stationId, varname):
+        """ Add the attributes of the coordinates, of the parameters and of the dataset """
+        #add coordinates attributes
+        if stationId:
+            ds.coords['time'].attrs["name"]="time"
+            ds.coords['location'].attrs['name']= 'WeatherStationId'
+            ds.coords['lat'].attrs['name']='latitude'
+            ds.coords['lat'].attrs['unit']='degrees_north'
+            ds.coords['lon'].attrs['name']='longitude'
+            ds.coords['lon'].attrs['unit']='degrees_east'
+        else:
+            #ds.coords['location'].attrs['name']='[latitude,longitude]'
+            ds.coords['lat'].attrs['name']='latitude'
+            ds.coords['lat'].attrs['unit']='degrees_north'
+            ds.coords['lon'].attrs['name']='longitude'
+            ds.coords['lon'].attrs['unit']='degrees_east'
+        
+        # add data variable  attributes
+        param = metadata_cache.parameter()
+        p={str(item['id']): item for item in param}
                 
-            for el in list(ds.data_vars):
-                try:
-                    ds.data_vars[el].attrs=p[str(el)]
-                except KeyError as e:
-                    logging.exception("The weatherParameter not implemented; key error: %s".format(e))
             
-            # Attribute of dataset
-            if stationId:
-                ds.attrs['weatherRessource']=self.name
-                #ds.attrs['weatherStationId']=stationId
-                ds.attrs['timeStart']=str(ds.coords['time'].values[0])
-                ds.attrs['timeEnd']=str(ds.coords['time'].values[-1])
-                ds.attrs['parameters']=list(ds.data_vars)
-            else:
-                ds.attrs['weatherRessource']=self.name
-                ds.attrs['timeStart']=str(ds.coords['time'].values[0])
-                ds.attrs['timeEnd']=str(ds.coords['time'].values[-1])
-                ds.attrs['parameters']=list(ds.data_vars)
+        for el in list(ds.data_vars):
+            try:
+                ds.data_vars[el].attrs=p[str(el)]
+            except KeyError as e:
+                logging.exception("The weatherParameter not implemented; key error: %s".format(e))
+        
+        # Attribute of dataset
+        if stationId:
+            ds.attrs['weatherRessource']=self.name
+            #ds.attrs['weatherStationId']=stationId
+            ds.attrs['timeStart']=str(ds.coords['time'].values[0])
+            ds.attrs['timeEnd']=str(ds.coords['time'].values[-1])
+            ds.attrs['parameters']=list(ds.data_vars)
+        else:
+            ds.attrs['weatherRessource']=self.name
+            ds.attrs['timeStart']=str(ds.coords['time'].values[0])
+            ds.attrs['timeEnd']=str(ds.coords['time'].values[-1])
+            ds.attrs['parameters']=list(ds.data_vars)
+        
+        if varname=="name":
+            ds= ds.rename_vars(name_dict={str(ds[el].attrs['id']):ds[el].attrs['name'] for el in list(ds.keys())}) 
             
-            if varname=="name":
-                ds= ds.rename_vars(name_dict={str(ds[el].attrs['id']):ds[el].attrs['name'] for el in list(ds.keys())}) 
-                
         return ds
     
-    def __dataset_to_ipm__(self,ds:xr.Dataset):
+    def __dataset_to_ipm__(self,ds:xr.Dataset,fp=None,raw=False):
         """Parser from dataset to weather ouput IPM format
 
         Parameters
         ----------
         ds : xr.Dataset
-            weatherdata in xarray dataset format
+            weatherdata in xarray dataset format, one item of locationWeatherData
+            is written per location
+        fp : file-like, optional
+            binary stream where the json is written (see weatherdata.serializer.dump), by default None
+        raw : bool, optional
+            keep the data as numpy arrays (not json serializable), by default False
 
         Returns
         -------
-        dict
-            IPM weather data from IPM weatherdata format
+        list
+            IPM weather data from IPM weatherdata format, None if written to fp
         """
-        
-        timeStart=pandas.to_datetime(ds.time.values[0])
-        timesecondDate= pandas.to_datetime(ds.time.values[1])
-        timeEnd=pandas.to_datetime(ds.time.values[-1])
-        
-        interval= timesecondDate-timeStart
-        interval=interval.seconds
-        
-        timeStart=timeStart.strftime("%Y-%m-%dT%H:%M")+"Z"
-        timeEnd=timeEnd.strftime("%Y-%m-%dT%H:%M")+"Z"
-        
-        # parser ipm format
-        d={"timeStart":timeStart,
-        "timeEnd":timeEnd,
-        "interval":interval,
-        'weatherParameters':[int(el) for el in list(ds.data_vars)],
-        "locationWeatherData":[{"longitude":float(ds.lon.values),
-                                "latitude":float(ds.lat.values),
-                                "altitude":0,
-                                "amalgamation":list(np.repeat(0,len(ds.data_vars))),
-                                "data":ds.to_dataframe().drop(columns=['lat','lon']).to_numpy().tolist(),
-                                "qc":list(np.repeat(0,len(ds.data_vars))),
-                                "width":len(ds.data_vars),
-                                "length":len(ds.time)}]}
-        return [d]
+        d=serializer.dataset_response(ds)
+        if fp is not None:
+            serializer.dump([d],fp)
+            return None
+        return [d if raw else jsonable(d)]
     
+    def __local_frame__(self, timeStart=None, timeEnd=None, parameters=None):
+        """ DataFrame of the data of a local source, between timeStart and timeEnd
+
+        Only the requested slice is read from the local catalog (weatherdata.catalog).
+        """
+        data=self.endpoint
+        if data is None:
+            data = self.df
+        if data is None:
+            data = local_catalog.read(self.local, timeStart=timeStart, timeEnd=timeEnd, parameters=parameters)
+        else:
+            attrs = data.attrs
+            if timeStart is not None or timeEnd is not None:
+                data = data.loc[timeStart:timeEnd]
+            if parameters is not None:
+                columns = {str(p): p for p in data.columns}
+                missing = [p for p in parameters if str(p) not in columns]
+                if missing:
+                    raise KeyError('parameters %s not in the local source %s' % (missing, self.name))
+                data = data[[columns[str(p)] for p in parameters]]
+            data.attrs = attrs
+        if len(data) == 0:
+            raise ValueError('no data of the local source %s between %s and %s' % (self.name, timeStart, timeEnd))
+        return data
+
+    def __frame_to_ipm__(self, data):
+        """ IPM weather response of a DataFrame described by its attrs (see add_local_ressource) """
+        bounds = pandas.DatetimeIndex([data.index[0], data.index[-1]])
+        if bounds.tz is None:
+            bounds = bounds.tz_localize(data.attrs["timezone"])
+        time = bounds.tz_convert("UTC").strftime('%Y-%m-%dT%H:%M:%S')+"Z"
+        
+        weather_ipm_schema={}
+        weather_ipm_schema["timeStart"]=time[0]
+        weather_ipm_schema["timeEnd"]=time[-1]
+        weather_ipm_schema["interval"]=data.attrs["interval"]
+        weather_ipm_schema['weatherParameters']=data.columns.to_list()
+        weather_ipm_schema["locationWeatherData"]=[
+            {"longitude":data.attrs["longitude"],
+            "latitude":data.attrs["latitude"],
+            "altitude":data.attrs["altitude"],
+            "amalgamation":np.repeat(0,data.shape[1]).tolist(),
+            "data":np.asarray(data,dtype=float),
+            "qc":np.repeat(0,data.shape[1]).tolist(),
+            "width":data.shape[1],
+            "length":data.shape[0]}
+        ]
+        return weather_ipm_schema
+
+    def __local_data__(self, parameters, timeStart, timeEnd, display, varname, dtype=None):
+        """ data of a local source: only the slice [timeStart, timeEnd] is read """
+        response = self.__frame_to_ipm__(self.__local_frame__(timeStart, timeEnd, parameters))
+        if display in ("ds", "stream"):
+            ds = self.__convert_xarray_dataset__([response], None, varname, "ds", dtype)
+            return iter([ds]) if display == "stream" else ds
+        return [jsonable(response)]
+
     def to_ipm(self,
-                       display="json"):
+                       display="json",
+                       dtype=None,
+                       fp=None,
+                       timeStart=None,
+                       timeEnd=None,
+                       raw=False):
         """Convert weather dataframe into IPM weather output schema
 
         Parameters
@@ -485,6 +1295,15 @@ class WeatherDataSource:
             dict of conversion between weather dataframe and ipm parameters, by default {'temperature_air':1002, "relative_humidity":3001, "rain":2001, "wind_speed":4005, "global_radiation":5001}
         display : str, optional
             choose the type of data according json schema ipm or ds in xarray.dataset , by default "json"
+        dtype : str, optional
+            dtype of the data variables if display is "ds": 'float64', 'float32' or 'int16', by default settings.DTYPE
+        fp : file-like, optional
+            binary stream where the json is written if display is "json" (see
+            weatherdata.serializer.dump), by default None
+        timeStart, timeEnd : str, optional
+            first and last dates of the data (in the time zone of the data), by default the whole period
+        raw : bool, optional
+            if display is "json", keep the data as a numpy array (not json serializable), by default False
 
         Returns
         -------
@@ -493,37 +1312,71 @@ class WeatherDataSource:
         """
         
         
-        data=self.endpoint
-        if data is None:
-            data = self.df
-
-        time=pandas.date_range(start=data.index.tolist()[0],
-                               end=data.index.tolist()[-1],
-                               tz=data.attrs["timezone"],
-                               freq=str(data.attrs["interval"])+"s").tz_convert("UTC").strftime('%Y-%m-%dT%H:%M:%S')+"Z"
-        
-        weather_ipm_schema={}
-        weather_ipm_schema["timeStart"]=time.tolist()[0]
-        weather_ipm_schema["timeEnd"]=time.tolist()[-1]
-        weather_ipm_schema["interval"]=data.attrs["interval"]
-        weather_ipm_schema['weatherParameters']=data.columns.to_list()
-        weather_ipm_schema["locationWeatherData"]=[
-            {"longitude":data.attrs["longitude"],
-            "latitude":data.attrs["latitude"],
-            "altitude":data.attrs["altitude"],
-            "amalgamation":np.repeat(0,data.shape[1]).tolist(),
-            "data":np.array(data).tolist(),
-            "qc":np.repeat(0,data.shape[1]).tolist(),
-            "width":data.shape[1],
-            "length":data.shape[0]}
-        ]
+        data=self.__local_frame__(timeStart, timeEnd)
+        weather_ipm_schema=self.__frame_to_ipm__(data)
         
         if display=="ds":
-            return self.__convert_xarray_dataset__([weather_ipm_schema],stationId=None,varname="id",display="ds")
+            return self.__convert_xarray_dataset__([weather_ipm_schema],stationId=None,varname="id",display="ds",dtype=dtype)
         else:
             responses=weather_ipm_schema
-        return [responses]
+        if fp is not None:
+            serializer.dump([responses],fp)
+            return None
+        return [responses if raw else jsonable(responses)]
     
+    def to_arrow(self, ds):
+        """ Apache Arrow table of a dataset of the resource (see weatherdata.arrow.to_table)
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+            weather data returned by data
+
+        Returns
+        -------
+        pyarrow.Table
+            one row per time and location, one column per parameter
+        """
+        from weatherdata import arrow
+        return arrow.to_table(ds, source=self.name)
+
+    def to_parquet(self, ds, path, **kwds):
+        """ Write a dataset of the resource in a Parquet dataset partitioned by source, location and year
+
+        Parameters
+        ----------
+        ds : xr.Dataset
+            weather data returned by data
+        path : str
+            root directory of the Parquet dataset
+        kwds : dict
+            other arguments of weatherdata.arrow.to_parquet
+        """
+        from weatherdata import arrow
+        arrow.to_parquet(ds, path, source=self.name, **kwds)
+
+    def read_parquet(self, path, stationId=None, years=None, parameters=None):
+        """ Dataset of the data of the resource stored in a Parquet dataset by to_parquet
+
+        Parameters
+        ----------
+        path : str
+            root directory of the Parquet dataset
+        stationId : list, optional
+            stations (or locations) to read, by default all
+        years : list, optional
+            years to read, by default all
+        parameters : list, optional
+            IPM weather parameter ids to read, by default all
+
+        Returns
+        -------
+        xr.Dataset
+            weather data, like data
+        """
+        from weatherdata import arrow
+        return arrow.read_parquet(path, source=self.name, location=stationId, years=years, parameters=parameters)
+
     def station_plot(self,ds=None,varname=None,time=None,resample=None):
         """_summary_
 
@@ -0,0 +1,169 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Ingestion of local weather files
+
+The csv files are read by chunks of rows, with an explicit datetime format,
+the unit conversions are applied to each chunk and the result is kept in a
+binary copy (npy data and times with a json sidecar, under pathCache()/'local')
+so that the next reads of an unchanged file are memory-mapped. The copy of a
+file is replaced when the file changes (size or modification time).
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas
+
+from weatherdata import settings
+from weatherdata.cache import _write
+from weatherdata.settings import pathCache
+
+# number of rows read at once
+CHUNKSIZE = 100000
+
+# columns and unit conversions of the Boigneville (Arvalis) exports
+BOIGNEVILLE_COLUMNS = ['date', 'h', 'temperature_air', 'relative_humidity', 'rain', 'wind_speed', 'global_radiation']
+BOIGNEVILLE_CONVERSIONS = {'global_radiation': 10000. / 3600,  # J/cm2 -> J.m-2.s-1
+                           'wind_speed': 1000. / 3600}  # km/h -> m.s-1
+
+
+def _key(path, options):
+    """ Key of the binary copy of a file read with options """
+    description = json.dumps({'path': os.path.abspath(path),
+                              'options': options}, sort_keys=True, default=str)
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def _version(path):
+    """ Size and modification time of a file, stored in the sidecar of its binary copy """
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def _directory(cache_path=None):
+    path = cache_path if cache_path is not None else pathCache() / 'local'
+    settings.create_dir(path)
+    return path
+
+
+def _frame(times, values, columns):
+    return pandas.DataFrame(values, index=pandas.DatetimeIndex(times), columns=columns)
+
+
+def _read_copy(filename, version):
+    """ Binary copy of a file, None if missing or made from another version of the file """
+    if not (os.path.exists(filename + '.json') and os.path.exists(filename + '.npy')
+            and os.path.exists(filename + '.time.npy')):
+        return None
+    with open(filename + '.json') as f:
+        sidecar = json.load(f)
+    if sidecar.get('version') != version:
+        return None
+    values = np.load(filename + '.npy', mmap_mode='r')
+    times = np.load(filename + '.time.npy', mmap_mode='r')
+    return _frame(times, values, sidecar['columns'])
+
+
+def _write_copy(filename, path, version, times, values, columns):
+    def write_array(array):
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                np.save(f, array)
+        return write
+    _write(filename + '.npy', write_array(values))
+    _write(filename + '.time.npy', write_array(times))
+
+    def write_sidecar(tmp):
+        with open(tmp, 'w') as f:
+            json.dump({'path': os.path.abspath(path), 'version': version, 'columns': columns}, f)
+    # written last: the copy is complete
+    _write(filename + '.json', write_sidecar)
+
+
+def read_csv(path,
+             sep=';',
+             column_name=BOIGNEVILLE_COLUMNS,
+             skiprows=2,
+             dec=',',
+             date_columns=('date', 'h'),
+             date_format='%d/%m/%Y %H:%M',
+             conversions=BOIGNEVILLE_CONVERSIONS,
+             encoding='latin-1',
+             chunksize=None,
+             usecache=True,
+             cache_path=None):
+    """ Weather data of a local csv file, read by chunks
+
+    Parameters
+    ----------
+    path : str
+        csv file
+    sep : str, optional
+        column separator, by default ';'
+    column_name : list, optional
+        names of the columns, by default BOIGNEVILLE_COLUMNS
+    skiprows : int, optional
+        number of header lines, by default 2
+    dec : str, optional
+        decimal separator, by default ','
+    date_columns : tuple, optional
+        columns joined with a space to build the dates, by default ('date', 'h')
+    date_format : str, optional
+        strftime format of the joined date columns, by default '%d/%m/%Y %H:%M'
+    conversions : dict, optional
+        factor applied to the values of some columns, by default BOIGNEVILLE_CONVERSIONS
+    encoding : str, optional
+        encoding of the file, by default 'latin-1'
+    chunksize : int, optional
+        number of rows read at once, by default CHUNKSIZE
+    usecache : bool, optional
+        read (or write) the binary copy of the file, by default True
+    cache_path : pathlib.Path, optional
+        directory of the binary copies, by default pathCache()/'local'
+
+    Returns
+    -------
+    pandas.DataFrame
+        float columns indexed by date (memory-mapped and read-only when read from
+        the binary copy, use copy() to modify them)
+    """
+    date_columns = list(date_columns)
+    columns = [name for name in column_name if name not in date_columns]
+    conversions = dict(conversions or {})
+
+    filename = None
+    if usecache:
+        options = [sep, list(column_name), skiprows, dec, date_columns, date_format, conversions, encoding]
+        filename = os.path.join(_directory(cache_path), _key(path, options))
+        # the version read, the copy is not marked up to date if the file changes while read
+        version = _version(path)
+        data = _read_copy(filename, version)
+        if data is not None:
+            return data
+
+    factors = np.array([conversions.get(name, 1.) for name in columns])
+    times, values = [], []
+    reader = pandas.read_csv(path, names=column_name, sep=sep, skiprows=skiprows, decimal=dec,
+                             encoding=encoding, chunksize=chunksize or CHUNKSIZE,
+                             dtype={name: str for name in date_columns})
+    for chunk in reader:
+        text = chunk[date_columns[0]]
+        for name in date_columns[1:]:
+            text = text + ' ' + chunk[name]
+        times.append(pandas.to_datetime(text, format=date_format).values)
+        values.append(chunk[columns].to_numpy(dtype=float) * factors)
+
+    times = np.concatenate(times) if times else np.array([], dtype='datetime64[ns]')
+    values = np.concatenate(values) if values else np.empty((0, len(columns)))
+    if filename is not None:
+        # replaces the copy of the previous version of the file
+        _write_copy(filename, path, version, times, values, columns)
+    return _frame(times, values, columns)
@@ -0,0 +1,177 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Process-wide cache of the IPM weather metadata
+
+The description of the weather data sources and of the weather parameters
+rarely change: they are fetched once, kept in memory for `settings.METADATA_TTL`
+seconds and persisted under pathCache(). When IPM can not be reached, the last
+persisted copy (even expired) is used, then the files bundled in weatherdata/data.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from weatherdata import settings
+from weatherdata.settings import pathCache
+
+datadir = os.path.join(os.path.dirname(__file__), 'data')
+
+# bundled copies of the IPM metadata
+FALLBACK = {'weatherdatasource': os.path.join(datadir, 'ipm_weatherdatasource.json'),
+            'parameter': os.path.join(datadir, 'ipm_weatherparameter.json')}
+
+
+def _sources_dict(sources):
+    """ Format a list of weather data source description like IPM.get_weatherdatasource """
+    if isinstance(sources, dict):
+        return sources
+    d = {}
+    for item in sources:
+        spatial = item.get('spatial') or {}
+        if isinstance(spatial.get('geoJSON'), str):
+            spatial['geoJSON'] = json.loads(spatial['geoJSON'])
+        d[item.get('id') or item['name']] = item
+    return d
+
+
+class MetadataCache:
+    """ Thread-safe cache of IPM metadata with time to live and disk persistence
+
+        ..doctest::
+        >>> from weatherdata.metadata import metadata_cache
+        >>> sources = metadata_cache.weatherdatasource()
+        >>> parameters = metadata_cache.parameter()
+    """
+
+    def __init__(self, ttl=None, path=None, ipm=None):
+        """
+        Parameters
+        ----------
+        ttl : float, optional
+            time to live of the metadata in seconds, by default settings.METADATA_TTL
+        path : pathlib.Path, optional
+            directory of the persisted metadata, by default pathCache()/'metadata'
+        ipm : agroservices.IPM, optional
+            IPM interface used to fetch the metadata, by default IPM()
+        """
+        self.ttl = ttl
+        self.path = path
+        self._ipm = ipm
+        self._entries = {}
+        self._locks = {name: threading.Lock() for name in FALLBACK}
+
+    @property
+    def ipm(self):
+        if self._ipm is None:
+            from agroservices import IPM
+            self._ipm = IPM()
+        return self._ipm
+
+    def __filename__(self, name):
+        path = self.path
+        if path is None:
+            path = pathCache() / 'metadata'
+        settings.create_dir(path)
+        return os.path.join(path, name + '.json')
+
+    def __fresh__(self, timestamp):
+        ttl = settings.METADATA_TTL if self.ttl is None else self.ttl
+        return time.time() - timestamp < ttl
+
+    def __read__(self, name):
+        path = self.__filename__(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            return entry['timestamp'], entry['data']
+        except (ValueError, KeyError) as e:
+            logging.warning('corrupted metadata cache %s: %s' % (path, e))
+            return None
+
+    def __write__(self, name, timestamp, data):
+        path = self.__filename__(name)
+        tmp = path + '.%s.tmp' % threading.get_ident()
+        with open(tmp, 'w') as f:
+            json.dump({'timestamp': timestamp, 'data': data}, f)
+        os.replace(tmp, path)
+
+    def __fetch__(self, name):
+        if name == 'weatherdatasource':
+            return self.ipm.get_weatherdatasource()
+        else:
+            return self.ipm.get_parameter()
+
+    def get(self, name):
+        """ Metadata `name` ('weatherdatasource' or 'parameter') """
+        entry = self._entries.get(name)
+        if entry is not None and self.__fresh__(entry[0]):
+            return entry[1]
+
+        with self._locks[name]:
+            # another thread may have refreshed the entry
+            entry = self._entries.get(name)
+            if entry is not None and self.__fresh__(entry[0]):
+                return entry[1]
+
+            stored = self.__read__(name)
+            if stored is not None and self.__fresh__(stored[0]):
+                self._entries[name] = stored
+                return stored[1]
+
+            try:
+                data = self.__fetch__(name)
+            except Exception as e:
+                logging.warning('unable to get %s from IPM: %s' % (name, e))
+                data = None
+            if data is None or type(data) is int:
+                # offline: use the expired copy, then the bundled one
+                if stored is None:
+                    with open(FALLBACK[name]) as f:
+                        stored = (0, json.load(f))
+                    logging.warning('use bundled %s metadata' % name)
+                # IPM will be requested again after ttl
+                data = stored[1]
+                timestamp = time.time()
+            else:
+                timestamp = time.time()
+                self.__write__(name, timestamp, data)
+
+            if name == 'weatherdatasource':
+                data = _sources_dict(data)
+            self._entries[name] = (timestamp, data)
+            return data
+
+    def set(self, name, data):
+        """ Store metadata `name` fetched elsewhere (eg. asynchronously) """
+        timestamp = time.time()
+        with self._locks[name]:
+            self.__write__(name, timestamp, data)
+            if name == 'weatherdatasource':
+                data = _sources_dict(data)
+            self._entries[name] = (timestamp, data)
+
+    def weatherdatasource(self):
+        """ Description of the weather data sources, indexed by source id """
+        return self.get('weatherdatasource')
+
+    def parameter(self):
+        """ List of the IPM weather parameters """
+        return self.get('parameter')
+
+    def clear(self):
+        """ Forget the metadata kept in memory """
+        self._entries.clear()
+
+
+metadata_cache = MetadataCache()
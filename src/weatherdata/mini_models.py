@@ -1,5 +1,15 @@
 """ Short meteorological models """
 
+import numpy as np
+
+# IPM weather parameter ids of the inputs of the leaf wetness models
+RAIN = (2001,)
+RELATIVE_HUMIDITY = (3001, 3002)
+GLOBAL_RADIATION = (5001,)
+
+# global radiation (W.m-2) to PPFD (micromol.m-2.sec-1)
+PPFD_FACTOR = 0.48 * 4.6
+
 def temp_par(self, Tair, PAR):
     """ Return an estimation of air temperature near the leaf
     
@@ -41,6 +51,82 @@ def leaf_wetness_rapilly(rain_intensity=0., relative_humidity=0., PPFD=0.):
     else:
         return False
 
+def _values(x):
+    """ x if it is an array (numpy, pandas or xarray), else a numpy array """
+    return x if hasattr(x, 'ndim') else np.asarray(x, dtype=float)
+
+def leaf_wetness_rapilly_array(rain_intensity=0., relative_humidity=0., PPFD=0.):
+    """ Vectorized leaf_wetness_rapilly
+    
+    Parameters
+    ----------
+    rain_intensity: array-like
+        Rain (in mm.h-1)
+    relative_humidity: array-like
+        Relative humidity of the air around the leaf (in %)
+    PPFD: array-like
+        Photosynthetically active radiation around the leaf (in micromol.m-2.sec-1)
+    
+    The inputs are numpy arrays, pandas Series or xarray DataArrays (aligned and
+    broadcast by dimension name, eg. time and location) or scalars. Missing
+    values (NaN) are dry.
+    
+    Returns
+    -------
+    wet: boolean array (numpy, pandas or xarray)
+        True where the leaf is wet
+    """
+    rain_intensity, relative_humidity, PPFD = map(_values, (rain_intensity, relative_humidity, PPFD))
+    return (rain_intensity > 0.) | ((relative_humidity >= 85.) & (PPFD < 644.))
+
+def _variable(data, ids):
+    """ First variable of data (Dataset or DataFrame) named or identified by one of the IPM parameter ids """
+    for id in ids:
+        for key in (str(id), id):
+            if key in data:
+                return data[key]
+    if hasattr(data, 'data_vars'):
+        # variables named by parameter name (varname='name')
+        for id in ids:
+            for name in data.data_vars:
+                if str(data[name].attrs.get('id')) == str(id):
+                    return data[name]
+    return None
+
+def leaf_wetness_dataset(data, rain=RAIN, relative_humidity=RELATIVE_HUMIDITY, radiation=GLOBAL_RADIATION):
+    """ Leaf wetness (Rapilly et Jolivet, 1976) of a weather dataset
+    
+    Parameters
+    ----------
+    data: xarray.Dataset or pandas.DataFrame
+        weather data with variables (or columns) named by IPM parameter id,
+        eg. returned by WeatherDataSource.data
+    rain: tuple
+        IPM parameter ids of the rain (in mm), the first found is used, by default RAIN
+    relative_humidity: tuple
+        IPM parameter ids of the relative humidity (in %), by default RELATIVE_HUMIDITY
+    radiation: tuple
+        IPM parameter ids of the global radiation (in W.m-2), converted in PPFD,
+        by default GLOBAL_RADIATION
+    
+    Missing rain or radiation are 0.
+    
+    Returns
+    -------
+    wet: xarray.DataArray or pandas.Series
+        True where the leaf is wet
+    """
+    rain_intensity = _variable(data, rain)
+    humidity = _variable(data, relative_humidity)
+    if rain_intensity is None and humidity is None:
+        raise KeyError('no rain %s nor relative humidity %s in the weather data' % (rain, relative_humidity))
+    global_radiation = _variable(data, radiation)
+    PPFD = 0. if global_radiation is None else global_radiation * PPFD_FACTOR
+    wet = leaf_wetness_rapilly_array(0. if rain_intensity is None else rain_intensity,
+                                     0. if humidity is None else humidity,
+                                     PPFD)
+    return wet.rename('leaf_wetness')
+
 def leaf_wetness_pedro_gillepsie(leaf_geometry=None, rain_intensity=0., temperature_air=0., 
                                  wind_speed=0., wind_direction=(0.,0.,0.), 
                                  relative_humidity=0., net_radiation=0.):
@@ -0,0 +1,271 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Scheduling of the requests sent to each weather source
+
+A SourceScheduler bounds the requests in flight (settings.SOURCE_MAX_WORKERS)
+and their rate (settings.SOURCE_RATE, token bucket), retries transient failures
+with a jittered exponential backoff, and remembers the requests which keep
+failing with a server error (after their retries) so that they are not sent
+again before settings.NEGATIVE_TTL seconds. The client errors (4xx, eg. a
+wrong period or credentials) are not remembered.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+
+from weatherdata import settings
+
+# HTTP status codes of the errors worth retrying
+TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# exceptions of the errors worth retrying (requests exceptions are OSError)
+TRANSIENT_EXCEPTIONS = (OSError, asyncio.TimeoutError)
+
+# HTTP status code returned for a request which keeps raising one of TRANSIENT_EXCEPTIONS
+UNREACHABLE_STATUS = 503
+
+
+def source_max_workers(name):
+    """ Number of requests that can be sent in parallel to a weather source
+
+    Parameters
+    ----------
+    name : str
+        id of the weatherdatasource
+
+    Returns
+    -------
+    int
+        concurrency cap of the source (settings.SOURCE_MAX_WORKERS or settings.MAX_WORKERS)
+    """
+    return max(1, int(settings.SOURCE_MAX_WORKERS.get(name, settings.MAX_WORKERS)))
+
+
+def source_rate(name):
+    """ Maximum number of requests per second sent to a weather source, None if unlimited """
+    return settings.SOURCE_RATE.get(name, settings.MAX_RATE)
+
+
+class TokenBucket:
+    """ Thread-safe token bucket allowing `rate` requests per second, by bursts of `burst` (by default rate) """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = self.size
+        self._time = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        if self.burst is not None:
+            return self.burst
+        return max(1, self.rate or 1)
+
+    def reserve(self):
+        """ Take a token and return the time (in seconds) to wait before using it """
+        if not self.rate:
+            return 0.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.size, self._tokens + (now - self._time) * self.rate)
+            self._time = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """ Wait for a token """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SourceScheduler:
+    """ Rate limit, concurrency cap, retries and negative cache of the requests to a weather source
+
+        ..doctest::
+        >>> from weatherdata.scheduler import scheduler
+        >>> fmi = scheduler('fi.fmi.observation.station')
+        >>> fmi.stats
+    """
+
+    def __init__(self, name):
+        """
+        Parameters
+        ----------
+        name : str
+            id of the weatherdatasource
+        """
+        self.name = name
+        self.bucket = TokenBucket(source_rate(name))
+        self._semaphore = (None, None)
+        # (cap, asyncio.Semaphore) by event loop
+        self._asemaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._failures = {}
+        self.requests = 0
+        self.retries = 0
+        self.skipped = 0
+
+    @property
+    def semaphore(self):
+        """ Semaphore bounding the requests in flight (sized by source_max_workers) """
+        cap = source_max_workers(self.name)
+        with self._lock:
+            if self._semaphore[0] != cap:
+                self._semaphore = (cap, threading.BoundedSemaphore(cap))
+            return self._semaphore[1]
+
+    @property
+    def asemaphore(self):
+        """ Semaphore bounding the requests in flight of the tasks of the running event loop """
+        cap = source_max_workers(self.name)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._asemaphores.get(loop)
+            if semaphore is None or semaphore[0] != cap:
+                semaphore = self._asemaphores[loop] = (cap, asyncio.Semaphore(cap))
+            return semaphore[1]
+
+    def __count__(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def __delays__(self):
+        """ Jittered exponential backoff delays of the retries """
+        return [random.uniform(0, settings.RETRY_BACKOFF * 2 ** i) for i in range(settings.RETRIES)]
+
+    def failure(self, key):
+        """ HTTP status of the last failure of the request key, None if not known to fail """
+        if key is None:
+            return None
+        with self._lock:
+            failure = self._failures.get(key)
+            if failure is None:
+                return None
+            if time.time() > failure[0]:
+                del self._failures[key]
+                return None
+            self.skipped += 1
+            return failure[1]
+
+    def __result__(self, key, label, data):
+        # only the server errors, once retried, are remembered
+        if type(data) is int and key is not None and (data in TRANSIENT_STATUS or data >= 500):
+            with self._lock:
+                self._failures[key] = (time.time() + settings.NEGATIVE_TTL, data, label)
+        return data
+
+    def __unreachable__(self, key, label, error):
+        # the station is dropped from the data instead of failing the whole request
+        logging.warning('%s for %s after %d retries' % (error, label, settings.RETRIES))
+        return self.__result__(key, label, UNREACHABLE_STATUS)
+
+    def call(self, fn, *args, label=None, key=None, **kwds):
+        """ Call the request fn(*args, **kwds) of the station (or location) label
+
+        Parameters
+        ----------
+        label : optional
+            station id (or location) of the request, for the logs
+        key : str, optional
+            key of the request in the negative cache, by default label
+
+        Returns
+        -------
+        dict or int
+            response of fn, or HTTP error code (without calling fn if the request is known to fail),
+            UNREACHABLE_STATUS if fn keeps raising a transient exception
+        """
+        key = label if key is None else key
+        status = self.failure(key)
+        if status is not None:
+            return status
+
+        delays = self.__delays__()
+        while True:
+            self.bucket.acquire()
+            try:
+                with self.semaphore:
+                    self.__count__('requests')
+                    data = fn(*args, **kwds)
+            except TRANSIENT_EXCEPTIONS as e:
+                if not delays:
+                    return self.__unreachable__(key, label, e)
+                logging.warning('%s for %s, retry' % (e, label))
+            else:
+                if not (type(data) is int and data in TRANSIENT_STATUS and delays):
+                    return self.__result__(key, label, data)
+                logging.warning('HTTPError: %s for %s, retry' % (data, label))
+            self.__count__('retries')
+            time.sleep(delays.pop(0))
+
+    async def acall(self, fn, *args, label=None, key=None, **kwds):
+        """ Asynchronous version of call, for the coroutine function fn """
+        key = label if key is None else key
+        status = self.failure(key)
+        if status is not None:
+            return status
+
+        delays = self.__delays__()
+        while True:
+            await asyncio.sleep(self.bucket.reserve())
+            try:
+                async with self.asemaphore:
+                    self.__count__('requests')
+                    data = await fn(*args, **kwds)
+            except TRANSIENT_EXCEPTIONS as e:
+                if not delays:
+                    return self.__unreachable__(key, label, e)
+                logging.warning('%s for %s, retry' % (e, label))
+            else:
+                if not (type(data) is int and data in TRANSIENT_STATUS and delays):
+                    return self.__result__(key, label, data)
+                logging.warning('HTTPError: %s for %s, retry' % (data, label))
+            self.__count__('retries')
+            await asyncio.sleep(delays.pop(0))
+
+    def forget(self, label=None):
+        """ Forget the failures of the requests of station label, or of all the requests """
+        with self._lock:
+            if label is None:
+                self._failures.clear()
+            else:
+                for key in [key for key, failure in self._failures.items() if failure[2] == label]:
+                    del self._failures[key]
+
+    @property
+    def stats(self):
+        """ Number of requests, retries, skipped requests and stations with requests known to fail """
+        with self._lock:
+            return {'requests': self.requests,
+                    'retries': self.retries,
+                    'skipped': self.skipped,
+                    'failing': sorted({failure[2] for failure in self._failures.values()}, key=str)}
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def scheduler(name):
+    """ Process-wide scheduler of the weather source name """
+    with _schedulers_lock:
+        if name not in _schedulers:
+            _schedulers[name] = SourceScheduler(name)
+        sched = _schedulers[name]
+    # the rate can be changed in settings
+    sched.bucket.rate = source_rate(name)
+    return sched
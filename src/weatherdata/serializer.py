@@ -0,0 +1,176 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Serialization of IPM weather data to json bytes
+
+The data arrays are formatted by numpy, block of rows by block of rows, and
+written to a binary stream: no python float is created, and the missing
+values (NaN) are written as null.
+"""
+
+import io
+import json
+
+import numpy as np
+import pandas
+
+from weatherdata.cache import _json_default
+
+# number of rows of data formatted at once
+ROWS = 65536
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), default=_json_default).encode()
+
+
+def format_rows(data):
+    """ json bytes of the rows of a 2D array, without the enclosing brackets
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        (rows, columns) array of floats, NaN (and infinite) values are written as null
+
+    Returns
+    -------
+    bytes
+        eg. b'[1.0,null],[2.5,3.0]'
+    """
+    data = np.asarray(data)
+    if data.dtype != np.float32:
+        data = data.astype(float, copy=False)
+    if data.ndim == 1:
+        data = data.reshape(-1, 1)
+    if data.size == 0:
+        return b','.join([b'[]'] * len(data))
+    # shortest repr of each value, formatted by numpy in zero padded byte strings
+    cells = data.astype('S24', order='C')
+    cells[~np.isfinite(data)] = b'null'
+    rows, width = data.shape
+    size = cells.dtype.itemsize
+    # [value, padding and separators of each cell, then drop the padding
+    buffer = np.zeros((rows, width, size + 3), dtype=np.uint8)
+    buffer[:, 0, 0] = ord('[')
+    buffer[:, :, 1:size + 1] = cells.view(np.uint8).reshape(rows, width, size)
+    buffer[:, :-1, size + 1] = ord(',')
+    buffer[:, -1, size + 1] = ord(']')
+    buffer[:, -1, size + 2] = ord(',')
+    return buffer[buffer != 0].tobytes()[:-1]
+
+
+def iter_rows(data, rows=None):
+    """ Generator of the json bytes of the array data, by blocks of rows """
+    rows = rows or ROWS
+    yield b'['
+    for i in range(0, len(data), rows):
+        if i:
+            yield b','
+        yield format_rows(data[i:i + rows])
+    yield b']'
+
+
+def iter_location(location, parameters):
+    """ Generator of the json bytes of an item of locationWeatherData """
+    data = np.asarray(location['data'])
+    if data.ndim != 2:
+        data = data.reshape(-1, len(parameters))
+    width = len(parameters)
+    header = {'longitude': float(location['longitude']),
+              'latitude': float(location['latitude']),
+              'altitude': float(location.get('altitude') or 0.),
+              'amalgamation': [int(a) for a in location.get('amalgamation') or [0] * width]}
+    yield _dumps(header)[:-1] + b',"data":'
+    yield from iter_rows(data)
+    footer = {'qc': [int(q) for q in location.get('qc') or [0] * width],
+              'width': width,
+              'length': len(data)}
+    yield b',' + _dumps(footer)[1:]
+
+
+def iter_response(response):
+    """ Generator of the json bytes of an IPM weather response """
+    header = {key: response[key] for key in ('timeStart', 'timeEnd', 'interval')}
+    header['weatherParameters'] = list(response['weatherParameters'])
+    yield _dumps(header)[:-1] + b',"locationWeatherData":['
+    for i, location in enumerate(response['locationWeatherData']):
+        if i:
+            yield b','
+        yield from iter_location(location, header['weatherParameters'])
+    yield b']}'
+
+
+def dump(responses, fp):
+    """ Write IPM weather responses in json to a binary stream
+
+    Parameters
+    ----------
+    responses : dict or list
+        IPM weather response, or list of responses, with data as list or numpy arrays
+    fp : file-like
+        binary stream with a write method (eg. open(path, 'wb'), socket.makefile('wb'))
+    """
+    if isinstance(responses, dict):
+        for chunk in iter_response(responses):
+            fp.write(chunk)
+        return
+    fp.write(b'[')
+    for i, response in enumerate(responses):
+        if i:
+            fp.write(b',')
+        for chunk in iter_response(response):
+            fp.write(chunk)
+    fp.write(b']')
+
+
+def dumps(responses):
+    """ json bytes of IPM weather responses (see dump) """
+    fp = io.BytesIO()
+    dump(responses, fp)
+    return fp.getvalue()
+
+
+def dataset_response(ds):
+    """ IPM weather response of a dataset, with one item of locationWeatherData per location
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        (time, location) or (time) data variables named by IPM parameter id,
+        with lat and lon coordinates
+
+    Returns
+    -------
+    dict
+        IPM weather response, with data as (time, parameter) numpy arrays
+    """
+    times = pandas.DatetimeIndex(ds.time.values)
+    interval = int((times[1] - times[0]).total_seconds()) if len(times) > 1 else 0
+    names = list(ds.data_vars)
+    if 'location' in ds.dims:
+        # (time, parameter, location) block, one copy of the data
+        block = np.stack([ds[name].transpose('time', 'location').values for name in names], axis=1)
+        lats, lons = np.atleast_1d(ds.lat.values), np.atleast_1d(ds.lon.values)
+    else:
+        block = np.stack([ds[name].values for name in names], axis=1)[:, :, np.newaxis]
+        lats, lons = [ds.lat.values], [ds.lon.values]
+
+    locations = [{'longitude': float(lon),
+                  'latitude': float(lat),
+                  'altitude': 0,
+                  'amalgamation': [0] * len(names),
+                  'data': block[:, :, j],
+                  'qc': [0] * len(names),
+                  'width': len(names),
+                  'length': len(times)}
+                 for j, (lat, lon) in enumerate(zip(lats, lons))]
+    return {'timeStart': times[0].strftime('%Y-%m-%dT%H:%M') + 'Z',
+            'timeEnd': times[-1].strftime('%Y-%m-%dT%H:%M') + 'Z',
+            'interval': interval,
+            'weatherParameters': [int(name) for name in names],
+            'locationWeatherData': locations}
@@ -2,6 +2,63 @@ from pathlib import Path
 
 PATH_CACHE = Path.home()/'weatherdata'/'cache'
 
+# default number of stations (or points) fetched in parallel by WeatherDataSource.data
+MAX_WORKERS = 8
+
+# concurrency cap per weather source id, overrides MAX_WORKERS
+# eg. {'fi.fmi.observation.station': 4}
+SOURCE_MAX_WORKERS = {}
+
+# time to live (in seconds) of the IPM metadata (weather data sources and parameters)
+METADATA_TTL = 24 * 3600
+
+# default maximum number of requests per second sent to a weather source, None for no limit
+MAX_RATE = None
+
+# maximum number of requests per second per weather source id, overrides MAX_RATE
+# eg. {'fi.fmi.observation.station': 5}
+SOURCE_RATE = {}
+
+# number of retries of the requests failing with a transient error, and base delay
+# (in seconds) of their jittered exponential backoff
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+# time (in seconds) during which a station which keeps failing is not requested again
+NEGATIVE_TTL = 3600
+
+# duration of the sub-windows of the long periods requested to a weather source id
+# eg. {'fi.fmi.observation.station': '90D'}, the periods are not split if missing
+SOURCE_WINDOW = {}
+
+# size budget (in bytes) of the cache of weather adapter responses, None for no limit
+CACHE_MAX_BYTES = 1024 ** 3
+
+# time to live (in seconds) of the cached responses of forecast and historic sources
+# None for no expiration
+CACHE_FORECAST_TTL = 3600
+CACHE_HISTORIC_TTL = 30 * 24 * 3600
+
+# delay (in seconds) between two writes of the index of the cached responses,
+# the index is also written at exit and by ResponseCache.flush
+CACHE_INDEX_DELAY = 10
+
+# format of the cached responses: 'json', 'npy' (memory-mapped) or 'npz' (compressed)
+CACHE_FORMAT = 'json'
+
+# dtype of the data variables of the datasets: 'float64', 'float32' or 'int16'
+# (packed with a CF scale_factor/add_offset per IPM parameter, decoded lazily)
+DTYPE = 'float64'
+
+# resolution (in degrees) of the grid of the forecast model of a weather source id:
+# with WeatherDataSource.data(snap=True), the points are snapped to this grid and
+# the points of a same cell are requested once
+SOURCE_RESOLUTION = {'no.met.locationforecast': 0.025,
+                     'fi.fmi.forecast.location': 0.025}
+
+# step (in meters) of the altitudes of the snapped locations, None to keep the altitudes
+SNAP_ALTITUDE = 100
+
 def create_dir(path):
     if not path.exists():
         create_dir(path.parent)
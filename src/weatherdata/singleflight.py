@@ -0,0 +1,136 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Coalescing of identical concurrent requests
+
+While a request is in flight, the identical requests (same key) of other
+threads, or of other tasks of the same event loop, wait for its result
+instead of being sent again.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+
+
+def flight_key(key, credentials=None, **options):
+    """ Key of a request sent with credentials and options (eg. savecache)
+
+    The responses are only shared between identical credentials and options.
+    """
+    if options:
+        key = key + '-' + ','.join('%s=%s' % item for item in sorted(options.items()))
+    if credentials is None:
+        return key
+    digest = hashlib.sha1(json.dumps(credentials, sort_keys=True, default=str).encode()).hexdigest()
+    return key + '-' + digest
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """ Run a function once for all the concurrent calls with the same key
+
+        ..doctest::
+        >>> from weatherdata.singleflight import single_flight
+        >>> single_flight.do('key', sum, [1, 2])
+        3
+        >>> single_flight.stats
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwds):
+        """ Result of fn(*args, **kwds), shared with the concurrent calls of key (in threads) """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwds)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key, fn, *args, **kwds):
+        """ Result of the coroutine fn(*args, **kwds), shared with the concurrent calls of key (in tasks)
+
+        The shared request runs in its own task: it is cancelled when all the
+        tasks waiting for it are cancelled, not when one of them is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key)
+        with self._lock:
+            self.calls += 1
+            flight = self._tasks.get(task_key)
+            if flight is None:
+                # [task, number of waiting tasks]
+                flight = self._tasks[task_key] = [loop.create_task(fn(*args, **kwds)), 0]
+
+                def done(task):
+                    with self._lock:
+                        if self._tasks.get(task_key) is flight:
+                            del self._tasks[task_key]
+                flight[0].add_done_callback(done)
+            else:
+                self.coalesced += 1
+            flight[1] += 1
+        task = flight[0]
+        cancelled = False
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            with self._lock:
+                flight[1] -= 1
+                last = cancelled and flight[1] == 0 and not task.done()
+                if last and self._tasks.get(task_key) is flight:
+                    # the later calls send the request again
+                    del self._tasks[task_key]
+            if last:
+                task.cancel()
+
+    @property
+    def stats(self):
+        """ Number of calls and of calls which waited for another identical call """
+        with self._lock:
+            return {'calls': self.calls,
+                    'coalesced': self.coalesced,
+                    'in_flight': len(self._calls) + len(self._tasks)}
+
+
+single_flight = SingleFlight()
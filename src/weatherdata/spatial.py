@@ -0,0 +1,308 @@
+# -*- python -*-
+# -*- coding:utf-8 -*-
+#
+#       Copyright 2020 INRAE-CIRAD
+#       Distributed under the Cecill-C License.
+#       See https://cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+# ==============================================================================
+""" Spatial index of the weather stations (requires scipy)
+
+The stations are placed on the unit sphere and indexed by a KD-tree
+(scipy.spatial.cKDTree): the euclidean (chord) distance between two points of
+the sphere increases with their great-circle distance, so nearest and radius
+queries on the tree are exact for the great-circle distance. The stations and
+the index of a source are built once from its geoJSON, and cached.
+"""
+
+import threading
+
+import numpy as np
+import pandas
+
+# mean earth radius (km)
+EARTH_RADIUS = 6371.0088
+
+
+def unit_vectors(latitude, longitude):
+    """ (n, 3) cartesian coordinates on the unit sphere of points given in degrees """
+    lat = np.radians(np.asarray(latitude, dtype=float))
+    lon = np.radians(np.asarray(longitude, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord(km):
+    """ Chord length on the unit sphere of a great-circle distance in km """
+    return 2 * np.sin(np.minimum(np.asarray(km, dtype=float) / EARTH_RADIUS, np.pi) / 2)
+
+
+def great_circle(chord_length):
+    """ Great-circle distance in km of a chord length on the unit sphere """
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chord_length, dtype=float) / 2, 0, 1))
+
+
+def station_table(source):
+    """ Stations of a weather data source description (IPM weatherdatasource)
+
+    Returns
+    -------
+    pandas.DataFrame
+        properties of the stations with their latitude and longitude, indexed by station id
+    """
+    geojson = ((source or {}).get("spatial") or {}).get("geoJSON") or {}
+    features = geojson.get("features") if isinstance(geojson, dict) else None
+    if not features:
+        return pandas.DataFrame()
+    ids, properties = [], []
+    for feature in features:
+        if (feature.get('geometry') or {}).get('type') != 'Point':
+            # eg. area covered by a forecast source
+            continue
+        ids.append(int(feature['id']) if 'id' in feature else int(feature['properties']['id']))
+        coordinates = feature['geometry']['coordinates']
+        # geoJSON positions are [longitude, latitude(, altitude)]
+        properties.append(dict(feature["properties"],
+                               latitude=float(coordinates[1]),
+                               longitude=float(coordinates[0])))
+    if not ids:
+        return pandas.DataFrame()
+    return pandas.DataFrame(properties, index=ids)
+
+
+def _rings(polygon):
+    """ (n, 2) [longitude, latitude] rings of a polygon
+
+    polygon is a ring of [longitude, latitude] vertices or a geoJSON Polygon or
+    MultiPolygon geometry (or a Feature of them)
+    """
+    if isinstance(polygon, dict):
+        if polygon.get('type') == 'Feature':
+            polygon = polygon['geometry']
+        if polygon['type'] == 'Polygon':
+            rings = polygon['coordinates']
+        elif polygon['type'] == 'MultiPolygon':
+            rings = [ring for part in polygon['coordinates'] for ring in part]
+        else:
+            raise ValueError('geometry %s is not a polygon' % polygon['type'])
+    else:
+        rings = [polygon]
+    return [np.asarray(ring, dtype=float)[:, :2] for ring in rings]
+
+
+def points_in_polygon(latitude, longitude, polygon):
+    """ Mask of the points inside a polygon (even-odd rule, holes and parts included)
+
+    Parameters
+    ----------
+    latitude, longitude : array-like
+        coordinates of the points in degrees
+    polygon : list or dict
+        ring of [longitude, latitude] vertices, or geoJSON Polygon or MultiPolygon
+
+    Returns
+    -------
+    numpy.ndarray
+        boolean mask of the points
+    """
+    y = np.asarray(latitude, dtype=float)[:, None]
+    x = np.asarray(longitude, dtype=float)[:, None]
+    inside = np.zeros(len(y), dtype=bool)
+    for ring in _rings(polygon):
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        # edges crossing the horizontal line of the point, on the right of the point
+        crossing = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xc = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= (np.count_nonzero(crossing & (x < xc), axis=1) % 2).astype(bool)
+    return inside
+
+
+def snap_points(latitude, longitude, resolution, altitude=None, altitude_step=None):
+    """ Snap points to the nodes of a regular latitude/longitude (and altitude) grid
+
+    Parameters
+    ----------
+    latitude, longitude : array-like
+        coordinates of the points in degrees
+    resolution : float
+        step of the grid in degrees
+    altitude : array-like, optional
+        altitude of the points in meters, by default None
+    altitude_step : float, optional
+        step of the altitudes in meters, by default None (altitudes not snapped)
+
+    Returns
+    -------
+    tuple
+        latitude, longitude and altitude (None without altitude) of the distinct
+        nodes, in the order of their first point, and position of the node of each point
+    """
+    steps = np.array([resolution, resolution])
+    nodes = np.round(np.column_stack([latitude, longitude]).astype(float) / steps)
+    if altitude is not None:
+        altitude = np.asarray(altitude, dtype=float)
+        if altitude_step:
+            altitude = np.round(altitude / altitude_step)
+        steps = np.append(steps, altitude_step or 1.)
+        nodes = np.column_stack([nodes, altitude])
+    _, first, inverse = np.unique(nodes, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    cells = nodes[first[order]] * steps
+    # decimals of the resolution, without floating point noise
+    cells[:, :2] = np.round(cells[:, :2], max(0, int(np.ceil(-np.log10(resolution))) + 1))
+    return cells[:, 0], cells[:, 1], cells[:, 2] if altitude is not None else None, position[inverse.ravel()]
+
+
+class SpatialIndex:
+    """ Nearest, radius, bounding box and polygon queries on points given by latitude and longitude
+
+        ..doctest::
+        >>> from weatherdata.spatial import SpatialIndex
+        >>> index = SpatialIndex([101104, 101150], [60.8, 60.2], [23.5, 24.9])
+        >>> index.nearest(60.5, 24.0, k=1)
+    """
+
+    def __init__(self, ids, latitude, longitude):
+        """
+        Parameters
+        ----------
+        ids : array-like
+            identifiers of the points (eg. station ids)
+        latitude, longitude : array-like
+            coordinates of the points in degrees
+        """
+        from scipy.spatial import cKDTree
+
+        self.ids = np.asarray(ids)
+        self.latitude = np.asarray(latitude, dtype=float)
+        self.longitude = np.asarray(longitude, dtype=float)
+        self.tree = cKDTree(unit_vectors(self.latitude, self.longitude)) if len(self.ids) else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nearest(self, latitude, longitude, k=1, max_distance=None):
+        """ k nearest points of one or several locations
+
+        Parameters
+        ----------
+        latitude, longitude : float or array-like
+            coordinates of the locations in degrees
+        k : int, optional
+            number of points, by default 1
+        max_distance : float, optional
+            maximum distance in km, by default None
+
+        Returns
+        -------
+        tuple
+            ids and great-circle distances (km) of the points, sorted by distance,
+            of shape (k,) for one location or (n, k). Missing points have a None
+            id and an infinite distance
+        """
+        scalar = np.ndim(latitude) == 0
+        points = unit_vectors(np.atleast_1d(latitude), np.atleast_1d(longitude))
+        k = min(k, len(self))
+        if k == 0:
+            shape = (0,) if scalar else (len(points), 0)
+            return np.empty(shape, dtype=object), np.empty(shape)
+        bound = np.inf if max_distance is None else chord(max_distance) * (1 + 1e-12)
+        distances, positions = self.tree.query(points, k=k, distance_upper_bound=bound)
+        distances = distances.reshape(len(points), k)
+        positions = positions.reshape(len(points), k)
+        found = positions < len(self)
+        ids = np.empty(positions.shape, dtype=object)
+        ids[found] = self.ids[positions[found]]
+        distances = np.where(found, great_circle(distances), np.inf)
+        if scalar:
+            return ids[0], distances[0]
+        return ids, distances
+
+    def radius(self, latitude, longitude, distance):
+        """ Points within distance (km) of one or several locations
+
+        Returns
+        -------
+        list
+            ids of the points sorted by distance, or list of them for several locations
+        """
+        scalar = np.ndim(latitude) == 0
+        points = unit_vectors(np.atleast_1d(latitude), np.atleast_1d(longitude))
+        if not len(self):
+            result = [[] for _ in points]
+        else:
+            result = []
+            for point, positions in zip(points, self.tree.query_ball_point(points, chord(distance) * (1 + 1e-12))):
+                positions = np.asarray(positions, dtype=int)
+                order = np.argsort(np.linalg.norm(self.tree.data[positions] - point, axis=1), kind='stable')
+                result.append(self.ids[positions[order]].tolist())
+        return result[0] if scalar else result
+
+    def bbox(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """ Points inside a latitude/longitude box (crossing the antimeridian if min_longitude > max_longitude)
+
+        Returns
+        -------
+        list
+            ids of the points
+        """
+        inside = (self.latitude >= min_latitude) & (self.latitude <= max_latitude)
+        if min_longitude <= max_longitude:
+            inside &= (self.longitude >= min_longitude) & (self.longitude <= max_longitude)
+        else:
+            inside &= (self.longitude >= min_longitude) | (self.longitude <= max_longitude)
+        return self.ids[inside].tolist()
+
+
+    def polygon(self, polygon):
+        """ Points inside a polygon (see points_in_polygon)
+
+        Returns
+        -------
+        list
+            ids of the points
+        """
+        vertices = np.concatenate(_rings(polygon))
+        (min_longitude, min_latitude), (max_longitude, max_latitude) = vertices.min(axis=0), vertices.max(axis=0)
+        candidates = np.flatnonzero((self.latitude >= min_latitude) & (self.latitude <= max_latitude) &
+                                    (self.longitude >= min_longitude) & (self.longitude <= max_longitude))
+        inside = points_in_polygon(self.latitude[candidates], self.longitude[candidates], polygon)
+        return self.ids[candidates[inside]].tolist()
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(name, source, build):
+    """ Cached build(source) of a source, rebuilt when the description of the source changes """
+    geojson = ((source or {}).get("spatial") or {}).get("geoJSON")
+    key = (name, build.__name__)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] is geojson:
+            return entry[1]
+    value = build(source)
+    with _cache_lock:
+        _cache[key] = (geojson, value)
+    return value
+
+
+def stations(name, source):
+    """ Cached station_table of the source name """
+    return _cached(name, source, station_table)
+
+
+def _station_index(source):
+    table = station_table(source)
+    if table.empty:
+        return SpatialIndex([], [], [])
+    return SpatialIndex(table.index.values, table['latitude'].values, table['longitude'].values)
+
+
+def spatial_index(name, source):
+    """ Cached SpatialIndex of the stations of the source name """
+    return _cached(name, source, _station_index)
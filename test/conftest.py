@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pandas
+import pytest
+
+from weatherdata import ipm
+from weatherdata.cache import response_cache
+from weatherdata.catalog import local_catalog
+from weatherdata.metadata import MetadataCache
+from weatherdata.scheduler import _schedulers
+
+FMI = 'fi.fmi.observation.station'
+
+
+def ipm_response(data, parameters=(1002,), start='2020-06-12T00:00:00Z', interval=3600,
+                 longitude=23.5, latitude=60.8, altitude=0.0):
+    '''
+    IPM json response of one location with a (time, parameter) block of data
+    '''
+    end = pandas.Timestamp(start) + pandas.Timedelta(seconds=interval * (len(data) - 1))
+    return {'timeStart': start, 'timeEnd': end.strftime('%Y-%m-%dT%H:%M:%SZ'), 'interval': interval,
+            'weatherParameters': list(parameters),
+            'locationWeatherData': [{'longitude': longitude, 'latitude': latitude, 'altitude': altitude,
+                                     'data': data, 'width': len(parameters), 'length': len(data)}]}
+
+
+class FakeAdapter:
+    '''
+    Weather adapter answering value(time, params) at each time step of a query, for all its parameters
+
+    The queries are recorded in calls, with the maximum number of queries in flight.
+    status(params), if given, returns the HTTP error of a query or None.
+    '''
+    def __init__(self, value=None, delay=0, status=None):
+        self.value = value or (lambda t, params: float(t.hour))
+        self.delay = delay
+        self.status = status
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    @property
+    def windows(self):
+        return [(params['timeStart'], params['timeEnd']) for params in self.calls]
+
+    def __call__(self, source, params, credentials=None):
+        with self.lock:
+            self.calls.append(params)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            delay = self.delay(params) if callable(self.delay) else self.delay
+            if delay:
+                time.sleep(delay)
+            status = self.status(params) if self.status else None
+            if status is not None:
+                return status
+            interval = int(params.get('interval', 3600))
+            times = pandas.date_range(params['timeStart'], params['timeEnd'], freq='%ds' % interval)
+            parameters = [int(p) for p in str(params.get('parameters', 1002)).split(',')]
+            location = {key: float(params[key]) for key in ('longitude', 'latitude', 'altitude') if key in params}
+            rep = ipm_response([[self.value(t, params)] * len(parameters) for t in times], parameters,
+                               start=params['timeStart'], interval=interval, **location)
+            rep['timeEnd'] = params['timeEnd']
+            return rep
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+class OfflineIPM:
+    '''
+    IPM interface without network: the bundled metadata are used
+    '''
+    def get_weatherdatasource(self):
+        raise ConnectionError('offline')
+
+    def get_parameter(self):
+        return 503
+
+
+@pytest.fixture
+def metadata(tmp_path_factory):
+    return MetadataCache(path=tmp_path_factory.mktemp('metadata'), ipm=OfflineIPM())
+
+
+@pytest.fixture
+def hub(metadata, monkeypatch):
+    '''
+    WeatherDataHub of the bundled metadata
+    '''
+    monkeypatch.setattr(ipm, 'metadata_cache', metadata)
+    return ipm.WeatherDataHub()
+
+
+@pytest.fixture
+def fmi(hub):
+    return hub.get_ressource(FMI)
+
+
+@pytest.fixture
+def fake_adapter(monkeypatch):
+    '''
+    Replace the weather adapter of a source by a FakeAdapter(**kwds)
+    '''
+    def install(source, **kwds):
+        adapter = FakeAdapter(**kwds)
+        monkeypatch.setattr(source.ipm, 'get_weatheradapter', adapter)
+        return adapter
+    return install
+
+
+@pytest.fixture(autouse=True)
+def reset(tmp_path_factory, monkeypatch):
+    '''
+    Empty response cache and local catalog, and no remembered failure for each test
+    '''
+    monkeypatch.setattr(local_catalog, 'path', tmp_path_factory.mktemp('catalog'))
+    monkeypatch.setattr(local_catalog, '_index', None)
+    monkeypatch.setattr(response_cache, 'path', tmp_path_factory.mktemp('responses'))
+    for name in ('_index', '_series'):
+        monkeypatch.setattr(response_cache, name, None)
+    for name in ('hits', 'partial_hits', 'misses', 'evictions'):
+        monkeypatch.setattr(response_cache, name, 0)
+    monkeypatch.setattr(response_cache, '_dirty', False)
+    yield
+    for sched in list(_schedulers.values()):
+        sched.forget()
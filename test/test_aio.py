@@ -0,0 +1,106 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import xarray
+from weatherdata import aio, settings
+from weatherdata.getdata import ipm_get_weatherparameter
+
+aiohttp = pytest.importorskip('aiohttp')
+
+source = 'fi.fmi.observation.station'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    Local stub of the IPM weather services
+    '''
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path.endswith('/parameter'):
+            return self.send_json(200, ipm_get_weatherparameter())
+        station = int(query['weatherStationId'])
+        if station == 500:
+            return self.send_json(500, {})
+        if station == 900:
+            # slow station
+            time.sleep(0.3)
+        parameters = [int(p) for p in query['parameters'].split(',')]
+        self.send_json(200, {'timeStart': query['timeStart'],
+                             'timeEnd': query['timeEnd'],
+                             'interval': int(query['interval']),
+                             'weatherParameters': parameters,
+                             'locationWeatherData': [{'longitude': float(station), 'latitude': 60.0, 'altitude': 0.0,
+                                                      'data': [[float(station)] * len(parameters)] * 2,
+                                                      'width': len(parameters), 'length': 2}]})
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d/api/wx/rest/' % server.server_port
+    server.shutdown()
+
+
+def testAsyncData(fmi, stub, monkeypatch):
+    monkeypatch.setattr(settings, 'RETRY_BACKOFF', 0.01)
+    monkeypatch.setitem(fmi.sources, source, dict(fmi.sources[source], endpoint=stub + 'weatheradapter/fmi/'))
+    stations = [101104, 500, 101533, 101185]
+
+    rep = asyncio.run(fmi.adata(stationId=stations, parameters=[1002, 3002],
+                                timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+                                display='json', max_workers=2))
+    assert [r['locationWeatherData'][0]['longitude'] for r in rep] == [101104, 101533, 101185]
+
+    ds = asyncio.run(fmi.adata(stationId=stations, parameters=[1002, 3002],
+                               timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+                               display='ds'))
+    assert type(ds) is xarray.Dataset
+    assert sorted(ds.location.values) == [101104, 101185, 101533]
+    assert list(ds.data_vars) == ['1002', '3002']
+
+
+def testCancelledFirstCaller(fmi, stub, monkeypatch):
+    from weatherdata import ipm
+    from weatherdata.singleflight import SingleFlight
+
+    monkeypatch.setattr(ipm, 'single_flight', SingleFlight())
+    monkeypatch.setitem(fmi.sources, source, dict(fmi.sources[source], endpoint=stub + 'weatheradapter/fmi/'))
+    kwds = dict(stationId=[900], parameters=[1002], timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+                display='json')
+
+    async def main():
+        first = asyncio.ensure_future(fmi.adata(**kwds))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(fmi.adata(**kwds))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        return await second
+    # the shared request completes on a session still opened for the second caller
+    rep = asyncio.run(main())
+    assert rep[0]['locationWeatherData'][0]['data'] == [[900.], [900.]]
+    assert ipm.single_flight.stats['coalesced'] == 1
+
+
+def testAsyncParameters(hub, stub, monkeypatch):
+    monkeypatch.setattr(aio, 'IPM_WX_URL', stub)
+    parameters = asyncio.run(hub.aparameters())
+    assert 1002 in list(parameters.id)
@@ -0,0 +1,57 @@
+import numpy
+import pandas
+import pytest
+
+from conftest import ipm_response
+from weatherdata.archive import WeatherArchive
+from weatherdata.convert import build_dataset
+
+
+def response(station, start, end, parameters=(1002, 3002)):
+    times = pandas.date_range(start, end, freq='H')
+    return ipm_response([[station % 100 + p % 10 + t.hour / 100. for p in parameters] for t in times], parameters,
+                        start=start, longitude=20. + station % 7, latitude=60. + station % 5)
+
+
+def dataset(stations, start, end, **kwds):
+    ds = build_dataset([response(s, start, end, **kwds) for s in stations], stationId=stations, **{})
+    ds['1002'].attrs = {'id': 1002, 'name': 'Mean air temperature at 2m', 'description': None, 'unit': 'Celcius'}
+    ds.attrs = {'weatherRessource': 'fi.fmi.observation.station'}
+    return ds
+
+
+@pytest.mark.parametrize('format', ['zarr', 'netcdf'])
+def testArchive(tmp_path, format):
+    if format == 'zarr':
+        pytest.importorskip('zarr')
+    archive = WeatherArchive(str(tmp_path / 'archive'), format=format, chunks={'time': 10, 'location': 2})
+    first = dataset([101104, 101150], '2020-06-12T00:00:00Z', '2020-06-12T23:00:00Z')
+    archive.append(first)
+    # new time steps and a new station, overlapping the archived period
+    second = dataset([101150, 101533], '2020-06-12T20:00:00Z', '2020-06-13T05:00:00Z')
+    second['1002'] += 100
+    archive.append(second)
+
+    ds = archive.read()
+    assert list(ds.location.values) == [101104, 101150, 101533]
+    assert len(ds.time) == 30
+    assert ds['1002'].attrs['unit'] == 'Celcius'
+    values = ds['1002'].sel(location=101150).to_series()
+    assert (values[:'2020-06-12T19:00'].values == first['1002'].sel(location=101150).values[:20]).all()
+    assert (values['2020-06-12T20:00':].values == second['1002'].sel(location=101150).values).all()
+    assert ds['1002'].sel(location=101104, time='2020-06-13').isnull().all()
+    assert ds['1002'].sel(location=101533, time='2020-06-12T19:00').isnull()
+    assert list(ds.lat.values) == [first.lat.values[0], first.lat.values[1], second.lat.values[1]]
+
+    part = archive.read(stationId=[101533], timeStart='2020-06-13T01:00', timeEnd='2020-06-13T02:00', parameters=[1002])
+    assert list(part.data_vars) == ['1002']
+    assert part['1002'].shape == (2, 1)
+    assert (part['1002'].values[:, 0] == second['1002'].sel(location=101533).values[5:7]).all()
+
+
+def testArchiveNoPrepend(tmp_path):
+    pytest.importorskip('zarr')
+    archive = WeatherArchive(str(tmp_path / 'archive.zarr'))
+    archive.append(dataset([1], '2020-06-12T00:00:00Z', '2020-06-12T03:00:00Z'))
+    with pytest.raises(ValueError):
+        archive.append(dataset([1], '2020-06-11T00:00:00Z', '2020-06-11T03:00:00Z'))
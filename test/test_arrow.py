@@ -0,0 +1,60 @@
+import numpy
+import pytest
+
+from conftest import ipm_response
+from weatherdata.convert import build_dataset
+
+pa = pytest.importorskip('pyarrow')
+
+
+def response(station, start='2020-12-31T22:00:00Z', end='2021-01-01T01:00:00Z'):
+    import pandas
+    times = pandas.date_range(start, end, freq='H')
+    return ipm_response([[station + t / 10., numpy.nan if t == 1 else 80. + t] for t in range(len(times))],
+                        [1002, 3002], start=start, longitude=20. + station, latitude=60. + station)
+
+
+def dataset():
+    ds = build_dataset([response(101104), response(101150, start='2020-12-31T23:00:00Z')],
+                       stationId=[101104, 101150])
+    ds['1002'].attrs = {'id': 1002, 'name': 'Mean air temperature at 2m', 'unit': 'Celcius'}
+    ds.attrs = {'weatherRessource': 'fi.fmi.observation.station', 'parameters': ['1002', '3002']}
+    return ds
+
+
+def testTable():
+    from weatherdata.arrow import from_table, to_table
+    ds = dataset()
+    table = to_table(ds)
+    assert table.num_rows == 4 * 2
+    assert table.column_names[:6] == ['source', 'location', 'year', 'time', 'lat', 'lon']
+    assert table.column('year').to_pylist()[::2] == [2020, 2020, 2021, 2021]
+    assert table.schema.field('1002').metadata
+
+    back = from_table(table)
+    assert back.identical(ds)
+    # zero copy of the table columns
+    assert not back['1002'].values.flags.owndata
+
+    # locations in the order of the table
+    ds = ds.isel(location=[1, 0])
+    back = from_table(to_table(ds))
+    assert list(back.location.values) == [101150, 101104]
+    assert back.identical(ds)
+
+
+def testParquet(tmp_path):
+    from weatherdata.arrow import read_parquet, to_parquet
+    ds = dataset()
+    to_parquet(ds, str(tmp_path))
+    assert (tmp_path / 'source=fi.fmi.observation.station' / 'location=101150' / 'year=2021').exists()
+
+    back = read_parquet(str(tmp_path))
+    assert back.equals(ds)
+    assert back['1002'].attrs['unit'] == 'Celcius'
+    assert list(back.location.values) == [101104, 101150]
+
+    part = read_parquet(str(tmp_path), location=[101150], years=[2021], parameters=[3002])
+    assert list(part.data_vars) == ['3002']
+    assert list(part.location.values) == [101150]
+    numpy.testing.assert_array_equal(part['3002'].values[:, 0], ds['3002'].sel(location=101150, time='2021').values)
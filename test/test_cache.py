@@ -0,0 +1,211 @@
+import time
+
+import numpy
+
+from conftest import ipm_response
+from weatherdata import settings
+from weatherdata.cache import ResponseCache, jsonable, request_key, to_seconds
+
+source = 'fi.fmi.observation.station'
+fmi_source = {'id': source, 'endpoint': '/weatheradapter/fmi/'}
+query = {'weatherStationId': 101104, 'timeStart': '2020-06-12T00:00:00Z', 'timeEnd': '2020-07-03T00:00:00Z',
+         'interval': 3600, 'parameters': '1002,3002'}
+
+
+def response(n=2):
+    return ipm_response([[1.0]] * n)
+
+
+def testRequestKey():
+    key = request_key(fmi_source, query)
+    assert key == request_key(fmi_source, dict(query, interval='3600', parameters=[1002, 3002]))
+    assert key != request_key(dict(fmi_source, id='other.source'), query)
+    assert key != request_key(fmi_source, dict(query, interval=86400))
+    assert key != request_key(fmi_source, dict(query, timeEnd='2020-07-04T00:00:00Z'))
+    assert key != request_key(fmi_source, dict(query, parameters='1002'))
+
+
+def testCacheTTL(tmp_path):
+    cache = ResponseCache(path=tmp_path, forecast_ttl=0.05, historic_ttl=None)
+    cache.put('forecast', response(), forecast=True)
+    cache.put('historic', response(), forecast=False)
+    assert cache.get('forecast') == response()
+    time.sleep(0.1)
+    assert cache.get('forecast') is None
+    assert cache.get('historic') == response()
+    assert cache.stats['hits'] == 2
+    assert cache.stats['misses'] == 1
+
+    # the index is persisted
+    cache.flush()
+    assert ResponseCache(path=tmp_path).get('historic') == response()
+
+
+def testIndexWrites(tmp_path, monkeypatch):
+    import json
+    monkeypatch.setattr(settings, 'CACHE_INDEX_DELAY', 3600)
+    cache = ResponseCache(path=tmp_path)
+    for key in 'abc':
+        cache.put(key, response())
+    # written on the first put, then batched
+    assert list(json.loads((tmp_path / 'index.json').read_text())) == ['a']
+    cache.flush()
+    assert list(json.loads((tmp_path / 'index.json').read_text())) == ['a', 'b', 'c']
+
+
+def testFailedReadOfReplacedResponse(tmp_path):
+    cache = ResponseCache(path=tmp_path)
+    cache.put('a', response())
+    # entry read before a put of the same key, then unreadable
+    old = dict(cache.index['a'], format='npz')
+    cache.put('a', response(3))
+    assert cache.__load__('a', old) is None
+    assert cache.get('a') == response(3)
+
+    # entry without file names
+    cache.index['b'] = {name: value for name, value in cache.index['a'].items() if name != 'files'}
+    cache.__remove__('b')
+    assert 'b' not in cache.index and cache.get('a') == response(3)
+
+
+def testCacheLRUEviction(tmp_path):
+    cache = ResponseCache(path=tmp_path)
+    cache.put('a', response(100))
+    size = cache.size
+    cache.max_bytes = 2.5 * size
+    cache.put('b', response(100))
+    time.sleep(0.01)
+    cache.get('a')
+    cache.put('c', response(100))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.stats['evictions'] == 1
+    assert cache.size <= cache.max_bytes
+
+
+def testDataCache(fmi, fake_adapter, tmp_path, monkeypatch):
+    calls = fake_adapter(fmi, value=lambda t, params: 1.0).calls
+    monkeypatch.setattr(fmi, 'cache', ResponseCache(path=tmp_path))
+
+    kwds = dict(stationId=[101104], parameters=[1002], timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+                display='json', usecache=True, savecache=True)
+    assert fmi.data(**kwds) == [response()]
+    assert fmi.data(**kwds) == [response()]
+    assert len(calls) == 1
+    fmi.data(**dict(kwds, interval=1800))
+    assert len(calls) == 2
+    assert fmi.cache.stats['hits'] == 1
+
+
+def testMissingWindows():
+    from weatherdata.cache import missing_windows
+    assert missing_windows(0, 100, 10, []) == [(0, 100)]
+    assert missing_windows(0, 100, 10, [(0, 40)]) == [(50, 100)]
+    assert missing_windows(0, 100, 10, [(20, 40), (35, 60), (90, 200)]) == [(0, 10), (70, 80)]
+    assert missing_windows(0, 100, 10, [(-50, 100)]) == []
+
+
+def testDataIncrementalCache(fmi, fake_adapter, tmp_path, monkeypatch):
+    adapter = fake_adapter(fmi)
+    monkeypatch.setattr(fmi, 'cache', ResponseCache(path=tmp_path))
+    kwds = dict(stationId=[101104], parameters=[1002, 3002], display='json', usecache=True, savecache=True)
+
+    fmi.data(timeStart='2020-01-02', timeEnd='2020-01-03', **kwds)
+    rep = fmi.data(timeStart='2020-01-01', timeEnd='2020-01-05', **kwds)
+    assert adapter.windows[1:] == [('2020-01-01T00:00:00Z', '2020-01-01T23:00:00Z'),
+                                   ('2020-01-03T01:00:00Z', '2020-01-05T00:00:00Z')]
+    data = rep[0]['locationWeatherData'][0]['data']
+    assert len(data) == 4 * 24 + 1
+    assert [row[0] for row in data[:48]] == list(range(24)) * 2
+    assert rep[0]['timeStart'] == '2020-01-01T00:00:00Z'
+
+    # the stitched response replaces the segments of its window
+    assert len(fmi.cache.index) == 1
+    rep = fmi.data(timeStart='2020-01-02', timeEnd='2020-01-04', **kwds)
+    assert len(adapter.calls) == 3
+    assert len(rep[0]['locationWeatherData'][0]['data']) == 2 * 24 + 1
+    assert fmi.cache.stats['hits'] == 1
+    assert fmi.cache.stats['partial_hits'] == 1
+
+
+def testTrailingRowsNotCovered(fmi, fake_adapter, tmp_path, monkeypatch):
+    now = '2020-01-05T00:00:00Z'
+
+    def value(t, params):
+        # values up to now only
+        return float(t.hour) if t.timestamp() <= to_seconds(now) else None
+    adapter = fake_adapter(fmi, value=value)
+    monkeypatch.setattr(fmi, 'cache', ResponseCache(path=tmp_path))
+    kwds = dict(stationId=[101104], parameters=[1002], display='json', usecache=True, savecache=True,
+                timeStart='2020-01-01', timeEnd='2020-01-08')
+
+    fmi.data(**kwds)
+    assert list(fmi.cache.index.values())[0]['window'][1] == to_seconds(now)
+    now = '2020-01-06T00:00:00Z'
+    rep = fmi.data(**kwds)
+    assert adapter.windows[1] == ('2020-01-05T01:00:00Z', '2020-01-08T00:00:00Z')
+    data = rep[0]['locationWeatherData'][0]['data']
+    assert numpy.isfinite(numpy.asarray(data, dtype=float)).sum() == 5 * 24 + 1
+
+
+def testCacheFormats(tmp_path):
+    import numpy
+    data = response(3)
+    data['locationWeatherData'][0]['data'] = [[1.0], [None], [3.0]]
+    for format in ('json', 'npy', 'npz'):
+        cache = ResponseCache(path=tmp_path / format, format=format)
+        cache.put('key', data)
+        cached = ResponseCache(path=tmp_path / format).get('key')
+        values = numpy.asarray(cached['locationWeatherData'][0]['data'], dtype=float)
+        assert numpy.isnan(values[1, 0])
+        assert values[2, 0] == 3.0
+        assert cached['weatherParameters'] == [1002]
+        assert jsonable(cached) == data
+    assert isinstance(cached['locationWeatherData'][0]['data'], numpy.ndarray)
+
+
+def testDataBinaryCache(fmi, fake_adapter, tmp_path, monkeypatch):
+    calls = fake_adapter(fmi).calls
+    monkeypatch.setattr(fmi, 'cache', ResponseCache(path=tmp_path, format='npy'))
+    kwds = dict(stationId=[101104], parameters=[1002, 3002], timeStart='2020-01-01', timeEnd='2020-01-03',
+                usecache=True, savecache=True)
+
+    ds = fmi.data(**kwds)
+    cached = fmi.data(**kwds)
+    assert len(calls) == 1
+    assert cached.equals(ds)
+    assert fmi.data(display='json', **kwds)[0]['locationWeatherData'][0]['data'][:2] == [[0.0, 0.0], [1.0, 1.0]]
+
+
+def testDailyData(fmi, fake_adapter, tmp_path, monkeypatch):
+    adapter = fake_adapter(fmi, value=lambda t, params: float(t.day))
+    monkeypatch.setattr(fmi, 'cache', ResponseCache(path=tmp_path))
+    kwds = dict(stationId=[101104], parameters=[1002], interval=86400, usecache=True, savecache=True)
+
+    ds = fmi.data(timeStart='2020-01-01', timeEnd='2020-01-20', window='7D', **kwds)
+    assert len(adapter.calls) == 3
+    assert list(ds['1002'].values[:, 0]) == list(range(1, 21))
+    ds = fmi.data(timeStart='2020-01-10', timeEnd='2020-01-25', **kwds)
+    assert adapter.windows[3:] == [('2020-01-21T00:00:00Z', '2020-01-25T00:00:00Z')]
+    assert list(ds['1002'].values[:, 0]) == list(range(10, 26))
+
+
+def testDataParameterSubset(fmi, fake_adapter, tmp_path, monkeypatch):
+    adapter = fake_adapter(fmi)
+    monkeypatch.setattr(fmi, 'cache', ResponseCache(path=tmp_path))
+    kwds = dict(stationId=[101104], timeStart='2020-01-01', timeEnd='2020-01-03',
+                display='json', usecache=True, savecache=True)
+
+    fmi.data(parameters=[1002, 3002, 2001], **kwds)
+    rep = fmi.data(parameters=[1002], **kwds)
+    assert len(adapter.calls) == 1
+    assert rep[0]['weatherParameters'] == [1002]
+    assert rep[0]['locationWeatherData'][0]['data'][:2] == [[0.0], [1.0]]
+
+    # partial overlap: only the missing parameter is requested
+    rep = fmi.data(parameters=[3002, 4002], **kwds)
+    assert [str(params['parameters']) for params in adapter.calls[1:]] == ['4002']
+    assert rep[0]['weatherParameters'] == [3002, 4002]
+    assert rep[0]['locationWeatherData'][0]['data'][:2] == [[0.0, 0.0], [1.0, 1.0]]
+    assert fmi.cache.stats == dict(fmi.cache.stats, hits=1, partial_hits=1, misses=1)
@@ -0,0 +1,79 @@
+import json
+
+import numpy
+import pandas
+import pytest
+
+from weatherdata.catalog import LocalCatalog, local_catalog
+
+
+def frame(n=24 * 60):
+    index = pandas.date_range('2012-09-01', periods=n, freq='H')
+    return pandas.DataFrame({'temperature_air': numpy.arange(n) / 10., 'rain': numpy.arange(n) % 3 * 1.},
+                            index=index)
+
+
+@pytest.fixture
+def catalog():
+    # empty for each test (see conftest)
+    return local_catalog
+
+
+def testCatalog(tmp_path):
+    catalog = LocalCatalog(tmp_path)
+    entry = catalog.add('boigneville', frame(), longitude=2.37, latitude=48.33, altitude=140)
+    assert entry['start'].startswith('2012-09-01T00:00') and entry['length'] == 24 * 60
+
+    # another instance reads the index only
+    catalog = LocalCatalog(tmp_path)
+    assert catalog.names == ['boigneville']
+    data = catalog.read('boigneville', timeStart='2012-10-01', timeEnd='2012-10-01 05:00', parameters=['rain'])
+    assert list(data.columns) == ['rain']
+    assert len(data) == 6 and data.index[0] == pandas.Timestamp('2012-10-01')
+    assert data.attrs['latitude'] == 48.33
+    # memory-mapped slice
+    assert not catalog.read('boigneville', timeStart='2012-10-01').values.flags.writeable
+
+    catalog.remove('boigneville')
+    assert catalog.names == [] and list(tmp_path.iterdir()) == [tmp_path / 'index.json']
+
+
+def testLocalResource(hub, catalog):
+    hub.add_local_ressource('Mydata', frame(), timezone='UTC',
+                            convert_name={'temperature_air': 1002, 'rain': 2001})
+    resources = hub.list_resources
+    assert 'Mydata' in resources.index and 'personal_data' in resources.index
+    assert resources.loc['Mydata', 'parameters']['common'] == [1002, 2001]
+
+    for name in ['personal_data', 'Mydata']:
+        source = hub.get_ressource(name)
+        rep = source.to_ipm(timeStart='2012-09-02', timeEnd='2012-09-02 23:00')
+        assert rep[0]['timeStart'] == '2012-09-02T00:00:00Z'
+        assert rep[0]['locationWeatherData'][0]['length'] == 24
+        # json serializable, like data(display='json')
+        assert json.loads(json.dumps(rep)) == rep
+        raw = source.to_ipm(timeStart='2012-09-02', timeEnd='2012-09-02 23:00', raw=True)
+        assert isinstance(raw[0]['locationWeatherData'][0]['data'], numpy.ndarray)
+
+    ds = hub.get_ressource('Mydata').data(parameters=[2001], timeStart='2012-09-03', timeEnd='2012-09-04')
+    assert list(ds.data_vars) == ['2001']
+    assert len(ds.time) == 25
+    assert (ds['2001'].values[:, 0] == (numpy.arange(48, 73) % 3)).all()
+
+    # the whole period by default
+    source = hub.get_ressource('Mydata')
+    assert len(source.data().time) == 24 * 60
+    with pytest.raises(ValueError):
+        source.data(timeStart='2020-06-12', timeEnd='2020-07-03')
+    with pytest.raises(KeyError):
+        source.data(parameters=[2001, 3002])
+
+    # same behaviour for a DataFrame source
+    from weatherdata.ipm import WeatherDataSource
+    df = frame().rename(columns={'temperature_air': 1002, 'rain': 2001})
+    df.attrs = {'longitude': 2.37, 'latitude': 48.33, 'altitude': 0, 'timezone': 'UTC', 'interval': 3600}
+    source = WeatherDataSource('frame', forecast=None, endpoint=None, df=df)
+    assert len(source.data().time) == 24 * 60
+    assert list(source.data(parameters=['2001']).data_vars) == ['2001']
+    with pytest.raises(KeyError):
+        source.data(parameters=[2001, 3002])
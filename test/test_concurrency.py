@@ -0,0 +1,107 @@
+import pytest
+import xarray
+from weatherdata import settings
+
+source = 'fi.fmi.observation.station'
+
+
+def station_delay(delay):
+    '''
+    Delay of the queries of a station: the first stations answer last
+    '''
+    return lambda params: delay * (1 + 1. / (1 + int(params['weatherStationId']) % 7))
+
+
+def station_value(t, params):
+    return float(params['weatherStationId'])
+
+
+def testParallelFetchKeepsOrder(fmi, fake_adapter):
+    adapter = fake_adapter(fmi, value=station_value, delay=station_delay(0.05))
+    stations = list(range(1, 13))
+
+    rep = fmi.data(stationId=stations, parameters=[1002],
+                   timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+                   display='json', max_workers=4)
+    assert [r['locationWeatherData'][0]['data'][0][0] for r in rep] == stations
+    assert 1 < adapter.max_running <= 4
+
+    ds = fmi.data(stationId=stations, parameters=[1002],
+                  timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+                  display='ds', max_workers=4)
+    assert type(ds) is xarray.Dataset
+    assert list(ds.location.values) == stations
+
+
+def testSourceConcurrencyCap(fmi, fake_adapter, monkeypatch):
+    adapter = fake_adapter(fmi, delay=station_delay(0.05))
+    monkeypatch.setitem(settings.SOURCE_MAX_WORKERS, source, 2)
+
+    fmi.data(stationId=list(range(1, 9)), parameters=[1002],
+             timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+             display='json', max_workers=8)
+    assert adapter.max_running <= 2
+
+
+def testSplitWindow():
+    from weatherdata.ipm import split_window
+    assert split_window(0, 99, 1, 40) == [(0, 39), (40, 79), (80, 99)]
+    assert split_window(0, 100, 10, 45) == [(0, 30), (40, 70), (80, 100)]
+    assert split_window(0, 100, 10, 40, bounds=(35, 75)) == [(40, 70)]
+
+
+def testWindowedFetch(fmi, fake_adapter, monkeypatch):
+    adapter = fake_adapter(fmi, value=lambda t, params: float(t.day))
+    monkeypatch.setitem(fmi.sources, source,
+                        dict(fmi.sources[source], temporal={'forecast': 0, 'historic': {'start': '2020-01-01', 'end': None}}))
+
+    ds = fmi.data(stationId=[101104], parameters=[1002], timeStart='2019-12-31', timeEnd='2020-01-10',
+                  window='3D', max_workers=4)
+    assert sorted(adapter.windows) == [('2020-01-01T00:00:00Z', '2020-01-03T23:00:00Z'),
+                               ('2020-01-04T00:00:00Z', '2020-01-06T23:00:00Z'),
+                               ('2020-01-07T00:00:00Z', '2020-01-09T23:00:00Z'),
+                               ('2020-01-10T00:00:00Z', '2020-01-10T00:00:00Z')]
+    assert len(ds.time) == 9 * 24 + 24 + 1
+    values = ds['1002'].sel(location=101104).to_series()
+    assert values[:'2019-12-31T23:00'].isnull().all()
+    assert (values['2020-01-01':].values == values['2020-01-01':].index.day).all()
+
+    # nothing to request
+    with pytest.raises(ValueError):
+        fmi.data(stationId=[101104], parameters=[1002], timeStart='2019-12-01', timeEnd='2019-12-10', window='3D')
+    assert len(adapter.calls) == 4
+
+
+def testLazyFetch(fmi, fake_adapter):
+    adapter = fake_adapter(fmi, value=lambda t, params: float(t.day))
+
+    ds = fmi.data(stationId=[101104, 101150], parameters=[1002], timeStart='2020-01-01', timeEnd='2020-01-10',
+                  window='3D', lazy=True)
+    assert adapter.calls == []
+    assert ds['1002'].chunks == ((72, 72, 72, 1), (1, 1))
+    assert len(ds.time) == 9 * 24 + 1
+
+    values = ds['1002'].sel(location=101150, time=slice('2020-01-04', '2020-01-05')).values
+    assert [(int(params['weatherStationId']), params['timeStart']) for params in adapter.calls] == \
+        [(101150, '2020-01-04T00:00:00Z')]
+    assert (values == [4.] * 24 + [5.] * 24).all()
+
+    assert (ds['1002'].sel(location=101104).values == ds.time.to_index().day).all()
+
+
+def testStream(fmi, fake_adapter):
+    adapter = fake_adapter(fmi, value=station_value, delay=station_delay(0.02))
+    stations = list(range(1, 21))
+
+    stream = fmi.data(stationId=stations, parameters=[1002],
+                      timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+                      display='stream', max_workers=2)
+    first = next(stream)
+    assert type(first) is xarray.Dataset
+    assert len(first.location) == 1
+    # the stations are not all fetched in advance
+    assert adapter.max_running <= 2
+    datasets = [first] + list(stream)
+    assert sorted(int(ds.location.values[0]) for ds in datasets) == stations
+    for ds in datasets:
+        assert (ds['1002'].values == ds.location.values[0]).all()
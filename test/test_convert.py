@@ -0,0 +1,103 @@
+import numpy
+
+from conftest import ipm_response
+from weatherdata.convert import build_dataset
+
+
+def response(station, parameters, start='2020-06-12T00:00:00Z'):
+    return ipm_response([[station * 10 + p % 10 + t / 10. for p in parameters] for t in range(4)], parameters,
+                        start=start, longitude=20. + station, latitude=60. + station)
+
+
+def testBuildDataset():
+    responses = [response(3, [1002, 3002]), response(1, [1002, 3002]), response(2, [1002, 3002])]
+    ds = build_dataset(responses, stationId=[3, 1, 2])
+    assert list(ds.coords) == ['time', 'location', 'lat', 'lon']
+    assert list(ds.location.values) == [3, 1, 2]
+    assert list(ds.data_vars) == ['1002', '3002']
+    assert ds['1002'].dims == ('time', 'location')
+    assert ds['1002'].dtype == 'float64'
+    assert numpy.all(ds['3002'].sel(location=1).values == [12.0, 12.1, 12.2, 12.3])
+    assert numpy.all(ds.lat.values == [63., 61., 62.])
+
+
+def testBuildDatasetHeterogeneousParameters():
+    responses = [response(1, [1002, 3002]), response(2, [3002, 2001])]
+    ds = build_dataset(responses)
+    assert list(ds.data_vars) == ['1002', '3002', '2001']
+    assert list(ds.location.values) == ['[61.0, 21.0]', '[62.0, 22.0]']
+    assert numpy.all(numpy.isnan(ds['1002'].values[:, 1]))
+    assert numpy.all(ds['3002'].values[0] == [12.0, 22.0])
+    assert numpy.all(ds['2001'].values[:, 1] == [21.0, 21.1, 21.2, 21.3])
+
+
+def testBuildDatasetShiftedStation():
+    # a station answering with a later timeStart (eg. 101649 of FMI)
+    responses = [response(1, [1002]),
+                 response(2, [1002], start='2020-06-12T02:00:00Z'),
+                 response(3, [1002])]
+    ds = build_dataset(responses, stationId=[1, 2, 3])
+    assert len(ds.time) == 6
+    assert str(ds.time.values[-1]) == '2020-06-12T05:00:00.000000000'
+    values = ds['1002'].values
+    assert numpy.all(values[:4, 0] == [12.0, 12.1, 12.2, 12.3])
+    assert numpy.all(numpy.isnan(values[4:, 0]))
+    assert numpy.all(numpy.isnan(values[:2, 1]))
+    assert numpy.all(values[2:, 1] == [22.0, 22.1, 22.2, 22.3])
+
+
+def testBuildDatasetRequestedAxis():
+    import pandas
+    responses = [response(1, [1002]), response(2, [1002], start='2020-06-12T02:00:00Z')]
+    times = pandas.date_range('2020-06-12T01:00', '2020-06-12T03:00', freq='H')
+    ds = build_dataset(responses, times=times)
+    assert len(ds.time) == 3
+    assert numpy.all(ds['1002'].values[:, 0] == [12.1, 12.2, 12.3])
+    assert numpy.all(ds['1002'].values[1:, 1] == [22.0, 22.1])
+
+
+def testBuildDatasetFloat32():
+    responses = [response(1, [1002, 3002]), response(2, [3002, 2001])]
+    ds = build_dataset(responses, dtype='float32')
+    assert all(ds[name].dtype == 'float32' for name in ds.data_vars)
+    assert numpy.allclose(ds['2001'].values[:, 1], [21.0, 21.1, 21.2, 21.3])
+
+
+def testBuildDatasetInt16():
+    import xarray
+    responses = [response(1, [1002, 4001]), response(2, [1002, 9999], start='2020-06-12T01:00:00Z')]
+    ds = build_dataset(responses, stationId=[1, 2], dtype='int16')
+    # packed values, decoded lazily
+    assert isinstance(ds['1002'].variable._data, xarray.core.indexing.LazilyIndexedArray)
+    assert ds['1002'].encoding['dtype'] == 'int16'
+    assert ds['1002'].encoding['scale_factor'] == 0.01
+    assert ds['4001'].encoding['scale_factor'] == 0.1
+    assert ds['1002'].dtype == 'float32'
+    assert numpy.allclose(ds['1002'].sel(location=1).values[:4], [12.0, 12.1, 12.2, 12.3])
+    assert numpy.isnan(ds['1002'].sel(location=1).values[4])
+    assert numpy.isnan(ds['1002'].sel(location=2).values[0])
+    # parameter without packing
+    assert ds['9999'].dtype == 'float32' and 'scale_factor' not in ds['9999'].encoding
+
+
+def testBuildDatasetBadDtype():
+    import pytest
+    with pytest.raises(ValueError):
+        build_dataset([response(1, [1002])], dtype='int8')
+    with pytest.raises(ValueError):
+        build_dataset([])
+
+
+def testBuildDatasetInt16Overflow(caplog):
+    from weatherdata.convert import pack
+    responses = [response(1, [1002, 2001]), response(2, [1002, 2001])]
+    responses[1]['locationWeatherData'][0]['data'][2][1] = 400.
+    ds = build_dataset(responses, stationId=[1, 2], dtype='int16')
+    # 400 mm is out of the int16 range of the packed precipitation
+    assert 'scale_factor' not in ds['2001'].encoding and ds['2001'].dtype == 'float32'
+    assert ds['2001'].sel(location=2).values[2] == 400.
+    assert ds['1002'].encoding['scale_factor'] == 0.01
+    assert 'out of the int16 range' in caplog.text
+
+    packed = pack(numpy.array([1., 400., numpy.nan]), 0.01)
+    assert list(packed[:2]) == [100, numpy.iinfo(numpy.int16).max]
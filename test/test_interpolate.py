@@ -0,0 +1,62 @@
+import numpy
+import pytest
+import xarray
+
+pytest.importorskip('scipy')
+
+from weatherdata import interpolate
+
+
+def station_dataset():
+    rng = numpy.random.default_rng(1)
+    lat, lon = rng.uniform(60, 62, 30), rng.uniform(22, 26, 30)
+    times = numpy.arange('2020-06-12T00', '2020-06-13T00', dtype='datetime64[h]').astype('datetime64[ns]')
+    # linear field in latitude and longitude
+    values = numpy.arange(len(times))[:, None] + 2 * lat[None] - lon[None]
+    return xarray.Dataset({'1002': (('time', 'location'), values, {'name': 'TM'})},
+                          coords={'time': times, 'location': numpy.arange(30),
+                                  'lat': ('location', lat), 'lon': ('location', lon)})
+
+
+def testIdwWeights():
+    lat, lon = numpy.array([60., 61., 62.]), numpy.array([24., 24., 24.])
+    matrix = interpolate.idw_weights(lat, lon, [61., 61.5], [24., 24.], k=2)
+    numpy.testing.assert_allclose(matrix.toarray(), [[0, 1, 0], [0, .5, .5]], atol=1e-9)
+
+
+def testLinearIsExact():
+    ds = station_dataset()
+    grid = interpolate.to_grid(ds, [60.8, 61.2], [23.5, 24., 24.5], method='linear')
+    assert grid['1002'].dims == ('time', 'lat', 'lon') and grid['1002'].shape == (24, 2, 3)
+    expected = numpy.arange(24)[:, None, None] + 2 * grid.lat.values[None, :, None] - grid.lon.values[None, None]
+    numpy.testing.assert_allclose(grid['1002'].values, expected)
+    assert grid['1002'].attrs == {'name': 'TM'}
+
+    # outside of the stations
+    grid = interpolate.to_grid(ds, [50.], [24.], method='linear')
+    assert numpy.isnan(grid['1002'].values).all()
+
+
+def testWeightsAreCached():
+    ds = station_dataset()
+    a = interpolate.weights(ds.lat.values, ds.lon.values, [61.], [24.], k=4)
+    b = interpolate.weights(ds.lat.values.copy(), ds.lon.values.copy(), [61.], [24.], k=4)
+    assert a is b
+    assert interpolate.weights(ds.lat.values, ds.lon.values, [61.], [24.], k=3) is not a
+    with pytest.raises(ValueError):
+        interpolate.weights(ds.lat.values, ds.lon.values, [61.], [24.], method='spline')
+
+
+def testMissingValuesAreRenormalized():
+    ds = station_dataset()
+    ds['1002'][0, :] = numpy.nan
+    ds['1002'][1, 0] = numpy.nan
+    grid = interpolate.to_grid(ds, numpy.linspace(60.5, 61.5, 5), numpy.linspace(23, 25, 7), k=4)
+    assert numpy.isnan(grid['1002'].values[0]).all()
+    assert numpy.isfinite(grid['1002'].values[1:]).all()
+
+    matrix = interpolate.weights(ds.lat.values, ds.lon.values, [60.5], [23.], k=4)
+    values = ds['1002'].values[1:3]
+    w = matrix.toarray()[0] * numpy.isfinite(values)
+    expected = numpy.nansum(w * values, axis=1) / w.sum(axis=1)
+    numpy.testing.assert_allclose(grid['1002'].values[1:3, 0, 0], expected)
@@ -0,0 +1,60 @@
+import os
+
+import numpy
+import pandas
+
+from weatherdata import local
+
+datadir = os.path.join(os.path.dirname(local.__file__), 'data')
+boigneville = os.path.join(datadir, 'Boigneville_2012_2013_h.csv')
+
+
+def reference(path):
+    data = pandas.read_csv(path, names=local.BOIGNEVILLE_COLUMNS, sep=';', skiprows=2, decimal=',',
+                           encoding='latin-1')
+    data.index = pandas.to_datetime(data['date'].map(str) + ' ' + data['h'], dayfirst=True)
+    data['global_radiation'] *= (10000. / 3600)
+    data['wind_speed'] *= (1000. / 3600)
+    return data.drop(columns=['date', 'h'])
+
+
+def testReadCsv(tmp_path):
+    expected = reference(boigneville)
+    data = local.read_csv(boigneville, chunksize=1000, cache_path=tmp_path)
+    assert list(data.columns) == list(expected.columns)
+    assert (data.index == expected.index).all()
+    numpy.testing.assert_allclose(data.to_numpy(), expected.to_numpy(dtype=float))
+
+    # binary copy
+    assert len(list(tmp_path.iterdir())) == 3
+    copy = local.read_csv(boigneville, cache_path=tmp_path)
+    # memory-mapped read-only copy
+    assert not copy.values.flags.writeable
+    pandas.testing.assert_frame_equal(copy, data, check_freq=False)
+
+
+def testReadCsvChanged(tmp_path):
+    path = tmp_path / 'station.csv'
+    path.write_text('header\nheader\n01/09/2012;00:00;8,6;74,5;0;6;0\n')
+    cache = tmp_path / 'cache'
+    assert len(local.read_csv(str(path), cache_path=cache)) == 1
+    with open(path, 'a') as f:
+        f.write('01/09/2012;01:00;7,5;76,5;0;6;36\n')
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    data = local.read_csv(str(path), cache_path=cache)
+    assert len(data) == 2
+    assert data['global_radiation'].iloc[1] == 100.
+    assert data.index[1] == pandas.Timestamp('2012-09-01 01:00')
+    # the copy of the previous version is replaced
+    assert len(list(cache.iterdir())) == 3
+    assert len(local.read_csv(str(path), cache_path=cache)) == 2
+
+
+def testDataReaderWritable(hub, tmp_path, monkeypatch):
+    monkeypatch.setattr(local, 'pathCache', lambda: tmp_path)
+    for i in range(2):
+        # the second read uses the binary copy
+        data = hub.__data_reader__(path=boigneville)
+        data['rain'] *= 2
+        data.iloc[0, 0] = 0.
+    assert len(list((tmp_path / 'local').iterdir())) == 3
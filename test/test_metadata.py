@@ -0,0 +1,79 @@
+import threading
+
+from weatherdata.metadata import MetadataCache
+
+
+class CountingIPM:
+    '''
+    IPM interface counting the metadata requests, unavailable if online is False
+    '''
+    def __init__(self, online=True):
+        self.online = online
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get_weatherdatasource(self):
+        with self.lock:
+            self.calls += 1
+        if not self.online:
+            raise ConnectionError('offline')
+        return {'my.source': {'id': 'my.source', 'name': 'my source', 'spatial': None}}
+
+    def get_parameter(self):
+        with self.lock:
+            self.calls += 1
+        if not self.online:
+            return 503
+        return [{'id': 1002, 'name': 'Mean air temperature at 2m', 'description': None, 'unit': 'Celcius'}]
+
+
+def testMetadataFetchedOnce(tmp_path):
+    ipm = CountingIPM()
+    cache = MetadataCache(path=tmp_path, ipm=ipm)
+    threads = [threading.Thread(target=cache.weatherdatasource) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert list(cache.weatherdatasource()) == ['my.source']
+    assert ipm.calls == 1
+
+
+def testMetadataPersistence(tmp_path):
+    MetadataCache(path=tmp_path, ipm=CountingIPM()).parameter()
+
+    ipm = CountingIPM(online=False)
+    parameters = MetadataCache(path=tmp_path, ipm=ipm).parameter()
+    assert parameters[0]['id'] == 1002
+    assert ipm.calls == 0
+
+
+def testMetadataTTL(tmp_path):
+    ipm = CountingIPM()
+    cache = MetadataCache(ttl=0, path=tmp_path, ipm=ipm)
+    cache.parameter()
+    cache.parameter()
+    assert ipm.calls == 2
+
+    # offline with an expired copy
+    ipm.online = False
+    assert cache.parameter()[0]['id'] == 1002
+
+
+def testMetadataOfflineFallback(tmp_path):
+    cache = MetadataCache(path=tmp_path, ipm=CountingIPM(online=False))
+    sources = cache.weatherdatasource()
+    assert sorted(sources) == ['fi.fmi.forecast.location', 'fi.fmi.observation.station',
+                               'no.met.locationforecast', 'no.nibio.lmt']
+    assert all(source['id'] == key and 'endpoint' in source for key, source in sources.items())
+    parameters = cache.parameter()
+    assert 1002 in [p['id'] for p in parameters]
+
+
+def testHubOffline(tmp_path, monkeypatch):
+    from weatherdata import ipm
+
+    monkeypatch.setattr(ipm, 'metadata_cache', MetadataCache(path=tmp_path, ipm=CountingIPM(online=False)))
+    fmi = ipm.WeatherDataHub().get_ressource('fi.fmi.observation.station')
+    assert fmi.forecast is False
+    assert len(fmi.stations) > 0
@@ -0,0 +1,52 @@
+import numpy
+import pandas
+import pytest
+import xarray
+
+from weatherdata import mini_models
+from weatherdata.mini_models import leaf_wetness_dataset, leaf_wetness_rapilly, leaf_wetness_rapilly_array
+
+
+def testRapillyArrayIsScalar():
+    rain = numpy.array([0., 0.5, 0., 0., 0., numpy.nan])
+    rh = numpy.array([90., 50., 90., 80., numpy.nan, 90.])
+    ppfd = numpy.array([100., 1000., 1000., 0., 0., 100.])
+    wet = leaf_wetness_rapilly_array(rain, rh, ppfd)
+    assert wet.dtype == bool
+    assert list(wet) == [leaf_wetness_rapilly(*args) for args in zip(rain, rh, ppfd)]
+    assert list(wet) == [True, True, False, False, False, True]
+
+    series = leaf_wetness_rapilly_array(pandas.Series(rain), pandas.Series(rh), 0.)
+    assert isinstance(series, pandas.Series) and series.dtype == bool
+
+
+def dataset():
+    times = pandas.date_range('2020-06-12', periods=4, freq='H').values
+    rain = [[0., 0.], [1., 0.], [0., 0.], [0., numpy.nan]]
+    rh = [[90., 90.], [50., 50.], [90., 70.], [90., 90.]]
+    radiation = [[0., 400.], [0., 0.], [100., 0.], [0., 0.]]
+    ds = xarray.Dataset({'2001': (('time', 'location'), rain, {'id': 2001}),
+                         '3002': (('time', 'location'), rh, {'id': 3002}),
+                         '5001': (('time', 'location'), radiation, {'id': 5001})},
+                        coords={'time': times, 'location': [101104, 101150]})
+    return ds
+
+
+def testLeafWetnessDataset():
+    ds = dataset()
+    wet = leaf_wetness_dataset(ds)
+    assert wet.name == 'leaf_wetness' and wet.dims == ('time', 'location') and wet.dtype == bool
+    # 400 W.m-2 is over 644 micromol.m-2.sec-1 of PPFD
+    numpy.testing.assert_array_equal(wet.values, [[True, False], [True, False], [True, False], [True, True]])
+
+    named = ds.rename_vars({'2001': 'PRECIP', '3002': 'RH', '5001': 'GR'})
+    assert (leaf_wetness_dataset(named) == wet).all()
+
+    df = ds.sel(location=101104).to_dataframe().drop(columns='location').rename(columns=int)
+    series = leaf_wetness_dataset(df)
+    assert list(series) == list(wet.sel(location=101104).values)
+
+    assert (leaf_wetness_dataset(ds[['2001']]) == (ds['2001'] > 0)).all()
+    with pytest.raises(KeyError):
+        leaf_wetness_dataset(ds[['5001']])
+    assert mini_models.PPFD_FACTOR == 0.48 * 4.6
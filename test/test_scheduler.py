@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+from conftest import ipm_response
+from weatherdata import settings
+from weatherdata.scheduler import SourceScheduler, TokenBucket, scheduler
+
+
+def flaky(results):
+    '''
+    Request returning (or raising) the results in turn
+    '''
+    calls = []
+
+    def request(x):
+        calls.append(x)
+        result = results[min(len(calls), len(results)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return request, calls
+
+
+def testRetries(monkeypatch):
+    monkeypatch.setattr(settings, 'RETRY_BACKOFF', 0.001)
+    sched = SourceScheduler('test.source')
+    request, calls = flaky([503, ConnectionError('reset'), {'data': 1}])
+    assert sched.call(request, 1, label=1) == {'data': 1}
+    assert len(calls) == 3
+    assert sched.stats['retries'] == 2
+
+    # no retry of client errors
+    request, calls = flaky([404, {'data': 1}])
+    assert sched.call(request, 2, label=2) == 404
+    assert len(calls) == 1
+
+
+def testNegativeCache(monkeypatch):
+    monkeypatch.setattr(settings, 'RETRY_BACKOFF', 0.001)
+    monkeypatch.setattr(settings, 'RETRIES', 2)
+    sched = SourceScheduler('test.source')
+    request, calls = flaky([500])
+    assert sched.call(request, 1, label=137188) == 500
+    assert len(calls) == 3
+    assert sched.call(request, 1, label=137188) == 500
+    assert len(calls) == 3
+    assert sched.stats['failing'] == [137188]
+    assert sched.stats['skipped'] == 1
+
+    monkeypatch.setattr(settings, 'NEGATIVE_TTL', 0)
+    sched.forget()
+    sched.call(request, 1, label=137188)
+    time.sleep(0.01)
+    sched.call(request, 1, label=137188)
+    assert len(calls) == 9
+
+
+def testClientErrorsNotCached(monkeypatch):
+    monkeypatch.setattr(settings, 'RETRY_BACKOFF', 0.001)
+    sched = SourceScheduler('test.source')
+    request, calls = flaky([404, {'data': 1}])
+    assert sched.call(request, 1, label=137188, key='a') == 404
+    assert sched.call(request, 1, label=137188, key='a') == {'data': 1}
+    assert sched.stats['failing'] == []
+
+    # server errors are remembered by request
+    request, calls = flaky([503])
+    monkeypatch.setattr(settings, 'RETRIES', 0)
+    assert sched.call(request, 1, label=137188, key='b') == 503
+    assert sched.call(request, 1, label=137188, key='c') == 503
+    assert sched.call(request, 1, label=137188, key='b') == 503
+    assert len(calls) == 2
+    assert sched.stats['failing'] == [137188]
+    sched.forget(137188)
+    assert sched.stats['failing'] == []
+
+
+def testWindowFailure(fmi, fake_adapter):
+    calls = fake_adapter(fmi, status=lambda params: 404 if params['timeStart'].startswith('2020-06-12') else None).calls
+
+    kwds = dict(stationId=[101104], parameters=[1002], display='json', window='1D')
+    rep = fmi.data(timeStart='2020-06-12', timeEnd='2020-06-14T23:00', **kwds)
+    # the other sub-windows are requested after the failure of the first one
+    assert len(calls) == 3 and len(rep) == 1
+    rep = fmi.data(timeStart='2020-06-15', timeEnd='2020-06-15T23:00', **kwds)
+    assert len(calls) == 4 and len(rep) == 1
+
+
+def testAsyncRetries(monkeypatch):
+    monkeypatch.setattr(settings, 'RETRY_BACKOFF', 0.001)
+    sched = SourceScheduler('test.source')
+    request, calls = flaky([429, {'data': 1}])
+
+    async def arequest(x):
+        return request(x)
+    assert asyncio.run(sched.acall(arequest, 1, label=1)) == {'data': 1}
+    assert len(calls) == 2
+
+
+def testUnreachableStation(fmi, monkeypatch):
+    monkeypatch.setattr(settings, 'RETRY_BACKOFF', 0.001)
+    calls = []
+
+    def get_weatheradapter(source, params, credentials=None):
+        calls.append(params['weatherStationId'])
+        if int(params['weatherStationId']) == 2:
+            raise ConnectionError('reset')
+        return ipm_response([[1.], [2.]])
+    monkeypatch.setattr(fmi.ipm, 'get_weatheradapter', get_weatheradapter)
+
+    kwds = dict(stationId=[1, 2, 3], parameters=[1002], timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00')
+    ds = fmi.data(**kwds)
+    # the other stations are kept
+    assert list(ds.location.values) == [1, 3]
+    assert calls.count(2) == settings.RETRIES + 1
+    assert scheduler(fmi.name).stats['failing'] == [2]
+    fmi.data(**kwds)
+    assert calls.count(2) == settings.RETRIES + 1
+
+
+def testAsyncConcurrencyCap(monkeypatch):
+    monkeypatch.setitem(settings.SOURCE_MAX_WORKERS, 'test.source', 2)
+    sched = SourceScheduler('test.source')
+    state = {'running': 0, 'max_running': 0}
+
+    async def request(x):
+        state['running'] += 1
+        state['max_running'] = max(state['max_running'], state['running'])
+        await asyncio.sleep(0.01)
+        state['running'] -= 1
+        return x
+
+    async def main():
+        # several callers of the same source
+        return await asyncio.gather(*[sched.acall(request, i) for i in range(8)])
+    assert asyncio.run(main()) == list(range(8))
+    assert state['max_running'] == 2
+
+
+def testTokenBucket():
+    bucket = TokenBucket(rate=50, burst=1)
+    t = time.monotonic()
+    for i in range(11):
+        bucket.acquire()
+    assert time.monotonic() - t >= 0.19
+    assert TokenBucket(rate=None).reserve() == 0
@@ -0,0 +1,66 @@
+import io
+import json
+
+import numpy
+
+from conftest import ipm_response
+from weatherdata.cache import jsonable
+from weatherdata.convert import build_dataset
+from weatherdata.serializer import dataset_response, dump, dumps, format_rows
+
+
+def response(station, n=3):
+    return ipm_response(numpy.array([[station + t / 10., numpy.nan if t == 1 else 80. + t] for t in range(n)]),
+                        [1002, 3002], longitude=20. + station, latitude=60. + station)
+
+
+def testFormatRows():
+    data = numpy.array([[1.0, numpy.nan], [2.5, 1e-05], [numpy.inf, -3.25]])
+    assert format_rows(data) == b'[1.0,null],[2.5,1e-05],[null,-3.25]'
+    assert format_rows(data.astype('float32')) == b'[1.0,null],[2.5,1e-05],[null,-3.25]'
+    assert format_rows(numpy.array([0.1, 2])) == b'[0.1],[2.0]'
+
+
+def testDumps():
+    r = response(1)
+    r['locationWeatherData'].append(dict(response(2)['locationWeatherData'][0],
+                                         data=response(2)['locationWeatherData'][0]['data'].tolist()))
+    d = json.loads(dumps(r))
+    assert d['weatherParameters'] == [1002, 3002]
+    assert len(d['locationWeatherData']) == 2
+    assert d['locationWeatherData'][0]['data'] == [[1.0, 80.0], [1.1, None], [1.2, 82.0]]
+    assert d['locationWeatherData'][1]['data'][1] == [2.1, None]
+    assert d['locationWeatherData'][1]['length'] == 3
+
+    # large arrays are written by blocks of rows
+    data = numpy.random.rand(200000, 3)
+    fp = io.BytesIO()
+    dump([dict(r, locationWeatherData=[dict(r['locationWeatherData'][0], data=data)])], fp)
+    assert (numpy.array(json.loads(fp.getvalue())[0]['locationWeatherData'][0]['data']) == data).all()
+
+
+def testDatasetResponse():
+    ds = build_dataset([response(1), response(2)], stationId=[1, 2])
+    r = dataset_response(ds)
+    assert r['timeStart'] == '2020-06-12T00:00Z' and r['timeEnd'] == '2020-06-12T02:00Z'
+    assert r['interval'] == 3600
+    assert [loc['latitude'] for loc in r['locationWeatherData']] == [61., 62.]
+    # round trip
+    back = build_dataset([dict(r, locationWeatherData=[loc]) for loc in r['locationWeatherData']], stationId=[1, 2])
+    assert back.equals(ds)
+    back = build_dataset([json.loads(dumps(dict(r, locationWeatherData=[loc]))) for loc in r['locationWeatherData']],
+                         stationId=[1, 2])
+    assert back.equals(ds)
+
+
+def testFormatRowsNotContiguous():
+    data = numpy.asfortranarray([[1.0, 2.0], [3.0, numpy.nan]])
+    assert format_rows(data) == b'[1.0,2.0],[3.0,null]'
+    assert format_rows(data[:, ::-1]) == b'[2.0,1.0],[null,3.0]'
+
+
+def testJsonable():
+    r = dataset_response(build_dataset([response(1), response(2)], stationId=[1, 2]))
+    d = jsonable(r)
+    assert json.loads(json.dumps(d)) == json.loads(dumps(r))
+    assert d['locationWeatherData'][1]['data'][1] == [2.1, None]
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+from weatherdata.singleflight import SingleFlight, flight_key
+from weatherdata import ipm
+
+
+def testThreadsCoalesced():
+    flights = SingleFlight()
+    calls = []
+
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.1)
+        return {'x': x}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do('key', slow, 1))) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == [{'x': 1}] * 5
+    assert flights.stats == {'calls': 5, 'coalesced': 4, 'in_flight': 0}
+
+    # later calls are sent again
+    flights.do('key', slow, 2)
+    assert calls == [1, 2]
+
+
+def testTasksCoalesced():
+    flights = SingleFlight()
+    calls = []
+
+    async def slow(x):
+        calls.append(x)
+        await asyncio.sleep(0.1)
+        return x
+
+    async def main():
+        waiting = asyncio.ensure_future(flights.ado('key', slow, 1))
+        others = asyncio.gather(*[flights.ado('key', slow, 1) for i in range(3)],
+                                flights.ado('other', slow, 2))
+        await asyncio.sleep(0.01)
+        # the request is still awaited by the other tasks
+        waiting.cancel()
+        return await others
+    assert asyncio.run(main()) == [1, 1, 1, 2]
+    assert calls == [1, 2]
+    assert flights.stats['coalesced'] == 3
+
+
+def testTaskCancelledWithLastWaiter():
+    flights = SingleFlight()
+    cancelled = []
+
+    async def slow(x):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(x)
+            raise
+        return x
+
+    async def main():
+        waiting = [asyncio.ensure_future(flights.ado('key', slow, 1)) for i in range(2)]
+        await asyncio.sleep(0.01)
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        assert flights.stats['in_flight'] == 0
+        # sent again
+        return await asyncio.wait_for(flights.ado('key', slow, 2), 2)
+    assert asyncio.run(main()) == 2
+    assert cancelled == [1]
+
+
+def testFlightKey():
+    assert flight_key('key') == 'key'
+    assert flight_key('key', {'userName': 'a'}) != flight_key('key', {'userName': 'b'})
+    assert flight_key('key', savecache=True) != flight_key('key', savecache=False)
+
+
+def testDataCoalesced(fmi, fake_adapter, monkeypatch):
+    adapter = fake_adapter(fmi, delay=0.1)
+    monkeypatch.setattr(ipm, 'single_flight', SingleFlight())
+
+    results = []
+    kwds = dict(stationId=[101104], parameters=[1002], timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+                display='json')
+    threads = [threading.Thread(target=lambda: results.append(fmi.data(**kwds))) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(adapter.calls) == 1
+    assert len(results) == 4
+    assert all(result == results[0] for result in results)
+    assert ipm.single_flight.stats['coalesced'] == 3
+
+
+def testSavecacheNotShared(fmi, fake_adapter, tmp_path, monkeypatch):
+    from weatherdata.cache import ResponseCache
+
+    adapter = fake_adapter(fmi, delay=0.1)
+    monkeypatch.setattr(ipm, 'single_flight', SingleFlight())
+    monkeypatch.setattr(fmi, 'cache', ResponseCache(path=tmp_path))
+    kwds = dict(stationId=[101104], parameters=[1002], timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00',
+                display='json')
+    threads = [threading.Thread(target=fmi.data, kwargs=dict(kwds, savecache=savecache)) for savecache in (False, True)]
+    for t in threads:
+        t.start()
+        time.sleep(0.02)
+    for t in threads:
+        t.join()
+    # the response of the caller with savecache is cached
+    assert len(adapter.calls) == 2
+    assert fmi.cache.stats['entries'] == 1
@@ -0,0 +1,135 @@
+import numpy
+import pytest
+
+from weatherdata import spatial
+
+pytest.importorskip('scipy')
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(numpy.radians, (lat1, lon1, lat2, lon2))
+    a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+    return 2 * spatial.EARTH_RADIUS * numpy.arcsin(numpy.sqrt(a))
+
+
+def testNearestIsBruteForce():
+    rng = numpy.random.default_rng(0)
+    lat, lon = rng.uniform(40, 70, 500), rng.uniform(-10, 30, 500)
+    index = spatial.SpatialIndex(numpy.arange(500), lat, lon)
+    qlat, qlon = rng.uniform(40, 70, 50), rng.uniform(-10, 30, 50)
+
+    ids, distances = index.nearest(qlat, qlon, k=3)
+    assert ids.shape == distances.shape == (50, 3)
+    brute = haversine(qlat[:, None], qlon[:, None], lat[None], lon[None])
+    numpy.testing.assert_array_equal(ids.astype(int), numpy.argsort(brute, axis=1)[:, :3])
+    numpy.testing.assert_allclose(distances, numpy.sort(brute, axis=1)[:, :3], rtol=1e-9)
+
+    within = index.radius(qlat[0], qlon[0], 300)
+    assert within == list(numpy.argsort(brute[0])[:len(within)])
+    assert sorted(within) == list(numpy.flatnonzero(brute[0] <= 300))
+
+    ids, distances = index.nearest(qlat[0], qlon[0], k=2, max_distance=1e-3)
+    assert list(ids) == [None, None] and numpy.isinf(distances).all()
+
+
+def testBbox():
+    index = spatial.SpatialIndex([1, 2, 3], [10, 20, 30], [179, -179, 0])
+    assert index.bbox(5, 170, 25, -170) == [1, 2]
+    assert index.bbox(25, -10, 35, 10) == [3]
+
+
+def testStationsAreCached(fmi):
+    stations = fmi.stations
+    # geoJSON positions are [longitude, latitude]
+    assert (stations.latitude > 59).all() and (stations.longitude < 32).all()
+    assert spatial.stations(fmi.name, fmi.__source__) is spatial.stations(fmi.name, fmi.__source__)
+    assert fmi.spatial_index is fmi.spatial_index
+
+    station = stations.index[0]
+    lat, lon = stations.loc[station, ['latitude', 'longitude']]
+    assert fmi.stations_within(lat, lon, 0.1) == [station]
+    nearest = fmi.nearest_stations(lat, lon, k=2)
+    assert nearest.station.iloc[0] == station and nearest.distance.iloc[0] < 1e-6
+
+
+def testNearestAcrossSources(hub):
+    df = hub.nearest_stations([60.2, 63.0], [24.9, 8.7], k=2)
+    assert list(df.location) == [0, 0, 1, 1]
+    assert (df.groupby('location').distance.diff().fillna(0) >= 0).all()
+    single = [hub.nearest_stations(60.2, 24.9, k=2, sources=[name]) for name in hub.spatial_indexes()]
+    best = min(d.distance.iloc[0] for d in single)
+    assert df.distance.iloc[0] == best
+
+
+def testPointsInPolygon():
+    square = [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]
+    hole = [[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]]
+    lat = numpy.array([5, 2, 5, 12, -1])
+    lon = numpy.array([5, 2, 11, 5, 5])
+    inside = spatial.points_in_polygon(lat, lon, square)
+    assert list(inside) == [True, True, False, False, False]
+    inside = spatial.points_in_polygon(lat, lon, {'type': 'Polygon', 'coordinates': [square, hole]})
+    assert list(inside) == [False, True, False, False, False]
+
+    index = spatial.SpatialIndex([1, 2, 3, 4, 5], lat, lon)
+    assert index.polygon(square) == [1, 2]
+
+
+def testDataInRegion(hub, fmi, monkeypatch):
+    stations = fmi.stations
+    south = stations[(stations.latitude >= 59) & (stations.latitude <= 60.35) & (stations.longitude >= 19)]
+    bbox = (59, 19, 60.35, 32)
+    assert sorted(fmi.stations_in_region(bbox=bbox)) == sorted(south.index)
+
+    def data(self, stationId=None, **kwds):
+        return stationId, kwds
+    monkeypatch.setattr(type(fmi), 'data', data)
+    stationId, kwds = fmi.data_in_region(bbox=bbox, parameters=[1002])
+    assert stationId == fmi.stations_in_region(bbox=bbox) and kwds == {'parameters': [1002]}
+
+    ring = [[19, 59], [32, 59], [32, 60.35], [19, 60.35]]
+    datas = hub.data_in_region(polygon=ring, parameters=[1002])
+    assert list(datas) == [fmi.name] and sorted(datas[fmi.name][0]) == sorted(south.index)
+    with pytest.raises(ValueError):
+        fmi.data_in_region(bbox=(0, 0, 1, 1))
+
+
+def testSnapPoints():
+    lat, lon, alt, cells = spatial.snap_points([60.001, 60.012, 59.999, 61.], [24.001, 23.99, 24.004, 24.], 0.025)
+    assert list(lat) == [60., 61.] and list(lon) == [24., 24.] and alt is None
+    assert list(cells) == [0, 0, 0, 1]
+    lat, lon, alt, cells = spatial.snap_points([60., 60., 60.], [24., 24., 24.], 0.025, [10., 140., 30.], 100)
+    assert list(alt) == [0., 100.] and list(cells) == [0, 1, 0]
+    lat, lon, alt, cells = spatial.snap_points([60., 60.], [24., 24.], 0.025, [10., 30.])
+    assert list(alt) == [10., 30.] and list(cells) == [0, 1]
+
+
+def testForecastSnapping(hub, fake_adapter, tmp_path, monkeypatch):
+    from weatherdata.cache import ResponseCache
+
+    met = hub.get_ressource('no.met.locationforecast')
+    calls = fake_adapter(met, value=lambda t, params: float(params['latitude'])).calls
+    monkeypatch.setattr(met, 'cache', ResponseCache(path=tmp_path))
+
+    latitude, longitude, altitude = [60.001, 60.004, 61.0, 59.999], [10.001, 9.999, 10., 10.002], [10., 20., 30., 40.]
+    kwds = dict(parameters=[1002], timeStart='2020-06-12T00:00', timeEnd='2020-06-12T01:00', snap=True,
+                usecache=True, savecache=True)
+    ds = met.data(latitude=latitude, longitude=longitude, altitude=altitude, **kwds)
+    assert len(calls) == 2
+    assert list(ds.lat.values) == latitude and list(ds.lon.values) == longitude
+    numpy.testing.assert_array_equal(ds['1002'].values[0], [60., 60., 61., 60.])
+
+    rep = met.data(latitude=latitude, longitude=longitude, altitude=altitude, display='json', **kwds)
+    # the locations keep their coordinates
+    assert [r['locationWeatherData'][0]['altitude'] for r in rep] == altitude
+    assert len(calls) == 2
+
+    # a nearby location, in a cached cell
+    streamed = list(met.data(latitude=[60.01], longitude=[10.], altitude=[5.], display='stream', **kwds))
+    assert len(calls) == 2 and float(streamed[0].lat) == 60.01
+
+    pytest.importorskip('dask')
+    ds = met.data(latitude=latitude, longitude=longitude, altitude=altitude, lazy=True, **kwds)
+    assert list(ds.lat.values) == latitude
+    numpy.testing.assert_array_equal(ds['1002'].values[0], [60., 60., 61., 60.])
+    assert len(calls) == 2